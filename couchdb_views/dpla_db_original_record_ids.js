@@ -0,0 +1,20 @@
+{
+   "_id": "_design/original_record_ids",
+   "language": "javascript",
+   "views": {
+       "by_provider_name_and_id": {
+           "map": "function(doc) {
+                       if (doc.originalRecord) {
+                           provider_name = doc._id.split('--').shift();
+                           record_id = doc.originalRecord.id;
+                           if (!record_id && doc.originalRecord.header) {
+                               record_id = doc.originalRecord.header.identifier;
+                           }
+                           if (record_id) {
+                               emit([provider_name, record_id], null);
+                           }
+                       }
+                   }"
+       }
+   }
+}
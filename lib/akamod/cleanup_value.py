@@ -2,6 +2,7 @@ from akara import logger
 from akara import response
 from akara.services import simple_service
 from amara.thirdparty import json
+from dplaingestion.pipeline import record_service, map_records
 from dplaingestion.selector import getprop, setprop, exists
 import re
 
@@ -37,11 +38,26 @@ def cleanup(value, prop):
         Converted string.
     """
     # Do not remove double quotes from title
-    dquote = '' if prop == "sourceResource/title" else '"'
+    strip_dquote = prop != "sourceResource/title"
 
     # Remove dot at the end if field name is not in the
     # DONT_STRIP_DOT_END table.
-    with_dot = '' if prop in DONT_STRIP_DOT_END else "\."
+    strip_dot = prop not in DONT_STRIP_DOT_END
+
+    if isinstance(value, basestring):
+        value = value.strip()
+        for regex, replace in REGEXPS[(strip_dquote, strip_dot)]:
+            value = regex.sub(replace, value)
+
+    return value
+
+
+def compile_regexps(strip_dquote, strip_dot):
+    """Returns the compiled (regex, replacement) pairs applied by cleanup(),
+       depending on whether double quotes and a dot at the end are stripped.
+    """
+    dquote = '"' if strip_dquote else ''
+    with_dot = "\." if strip_dot else ''
     # Tags for stripping at beginning and at the end.
 
     TAGS_FOR_STRIPPING = '[%s\' \r\t\n;,%s]*'
@@ -49,19 +65,19 @@ def cleanup(value, prop):
     TAGS_FOR_STRIPPING_AT_BEGIN = TAGS_FOR_STRIPPING % ("\.", dquote)
     TAGS_FOR_STRIPPING_AT_END = TAGS_FOR_STRIPPING % (with_dot, dquote)
 
-    REGEXPS = ('\( ', '('), \
-              (' \)', ')'), \
-              (' *-- *', '--'), \
-              ('[\t ]{2,}', ' '), \
-              ('^' + TAGS_FOR_STRIPPING_AT_BEGIN, ''), \
-              (TAGS_FOR_STRIPPING_AT_END + '$', '')
+    return [(re.compile(pattern), replace) for pattern, replace in (
+        ('\( ', '('),
+        (' \)', ')'),
+        (' *-- *', '--'),
+        ('[\t ]{2,}', ' '),
+        ('^' + TAGS_FOR_STRIPPING_AT_BEGIN, ''),
+        (TAGS_FOR_STRIPPING_AT_END + '$', ''))]
 
-    if isinstance(value, basestring):
-        value = value.strip()
-        for pattern, replace in REGEXPS:
-            value = re.sub(pattern, replace, value)
-
-    return value
+# (strip_dquote, strip_dot) -> compiled regexps for cleanup()
+REGEXPS = dict(((strip_dquote, strip_dot),
+                compile_regexps(strip_dquote, strip_dot))
+               for strip_dquote in (True, False)
+               for strip_dot in (True, False))
 
 """
 Fields which should not be changed:
@@ -99,6 +115,18 @@ DEFAULT_PROP = [
 ]
 
 
+@record_service('cleanup_value')
+def cleanup_value_record(data, action="cleanup_value",
+                         prop=",".join(DEFAULT_PROP + DONT_STRIP_DOT_END)):
+    """Applies cleanup() to the prop field(s) of the given record. See
+       cleanup_value().
+    """
+    for p in prop.split(","):
+        convert(data, p)
+
+    return data
+
+
 @simple_service('POST', 'http://purl.org/la/dp/cleanup_value', 'cleanup_value',
                 'application/json')
 def cleanup_value(body, ctype, action="cleanup_value",
@@ -117,8 +145,7 @@ def cleanup_value(body, ctype, action="cleanup_value",
             response.add_header('content-type', 'text/plain')
             return "Unable to parse body as JSON"
 
-        for p in prop.split(","):
-            convert(data, p)
+        data = map_records(cleanup_value_record, data, action, prop)
     else:
         logger.error("Prop param in None in %s" % __name__)
 
@@ -1,38 +1,20 @@
+from copy import deepcopy
 from akara import logger
 from akara import response
 from akara.services import simple_service
 from amara.thirdparty import json
+from dplaingestion.pipeline import record_service, map_records
 from dplaingestion.selector import getprop, setprop, exists
 from dplaingestion.utilities import iterify
 
-@simple_service('POST', 'http://purl.org/la/dp/copy_prop', 'copy_prop',
-    'application/json')
-def copyprop(body, ctype, prop=None, to_prop=None, skip_if_exists=None):
-    """Copies value in one prop to another prop. For use with string and/or
-       list prop value types. If to_prop exists, its value is iterified then
-       extended with the iterified value of prop. If the to_prop parent prop
-       (ie hasView in hasView/rights) does not exist, the from_prop value is
-       not copied and an error is logged.
+def is_string_or_list(value):
+    return (isinstance(value, basestring) or isinstance(value, list))
 
-    Keyword arguments:
-    body -- the content to load
-    ctype -- the type of content
-    prop -- the prop to copy from (default None)
-    to_prop -- the prop to copy into (default None)
-    skip_if_exists -- set to True to not copy if to_prop exists
+@record_service('copy_prop')
+def copy_prop_record(data, prop=None, to_prop=None, skip_if_exists=None):
+    """Copies the value of prop to to_prop in the given record. See
+       copyprop().
     """
-
-    def is_string_or_list(value):
-        return (isinstance(value, basestring) or isinstance(value, list))
-
-    try:
-        data = json.loads(body)
-    except:
-        response.code = 500
-        response.add_header('content-type', 'text/plain')
-        return "Unable to parse body as JSON"
-
-
     if exists(data, to_prop) and skip_if_exists:
         pass
     else:
@@ -43,23 +25,50 @@ def copyprop(body, ctype, prop=None, to_prop=None, skip_if_exists=None):
                     msg = "Prop %s " % prop + \
                           "is not a string/list for record %s" % data["id"]
                     logger.error(msg)
-                    return body
+                    return data
 
                 to_value = getprop(data, to_prop)
                 if not is_string_or_list(to_value):
                     msg = "Prop %s " % to_prop + \
                           "is not a string/list for record %s" % data["id"]
                     logger.error(msg)
-                    return body
+                    return data
 
                 to_value = iterify(to_value)
-                to_value.extend(iterify(from_value))
+                to_value.extend(deepcopy(iterify(from_value)))
                 setprop(data, to_prop, to_value)
             else:
                 try:
-                    setprop(data, to_prop, getprop(data, prop))
+                    setprop(data, to_prop, deepcopy(getprop(data, prop)))
                 except Exception, e:
                     logger.error("Could not copy %s to %s: %s" %
                                  (prop, to_prop, e))
 
-    return json.dumps(data)
+    return data
+
+@simple_service('POST', 'http://purl.org/la/dp/copy_prop', 'copy_prop',
+    'application/json')
+def copyprop(body, ctype, prop=None, to_prop=None, skip_if_exists=None):
+    """Copies value in one prop to another prop. For use with string and/or
+       list prop value types. If to_prop exists, its value is iterified then
+       extended with the iterified value of prop. If the to_prop parent prop
+       (ie hasView in hasView/rights) does not exist, the from_prop value is
+       not copied and an error is logged.
+
+    Keyword arguments:
+    body -- the content to load
+    ctype -- the type of content
+    prop -- the prop to copy from (default None)
+    to_prop -- the prop to copy into (default None)
+    skip_if_exists -- set to True to not copy if to_prop exists
+    """
+
+    try:
+        data = json.loads(body)
+    except:
+        response.code = 500
+        response.add_header('content-type', 'text/plain')
+        return "Unable to parse body as JSON"
+
+    return json.dumps(map_records(copy_prop_record, data, prop, to_prop,
+                                  skip_if_exists))
@@ -87,7 +87,8 @@ def listrecords(endpoint, oaiset=None, resumption_token=None,
         return json.dumps({
                            'items': exhibit_records,
                            'data_profile': PROFILE,
-                           'resumption_token': resumption_token
+                           'resumption_token': resumption_token,
+                           'deleted': list_records_result.get('deleted', [])
                            },
                            indent=4)
     except OAIError as e:
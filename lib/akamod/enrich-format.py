@@ -8,6 +8,41 @@ from amara.thirdparty import json
 from dplaingestion.selector import delprop, getprop, setprop, exists
 from amara.lib.iri import is_absolute
 
+FORMAT_2_TYPE_MAPPINGS = {
+    "audio": "sound",
+    "image": "image",
+    "video": "moving image",
+    "text": "text"
+}
+
+REGEXPS = [(re.compile(pattern), replace) for pattern, replace in (
+    ('audio/mp3', 'audio/mpeg'), ('images/jpeg', 'image/jpeg'),
+    ('image/jpg', 'image/jpeg'), ('image/jp$', 'image/jpeg'),
+    ('img/jpg', 'image/jpeg'), ('^jpeg$', 'image/jpeg'),
+    ('^jpg$', 'image/jpeg'), ('\W$', ''))]
+# Removes any extra text after an IMT
+TRAILING_TEXT = re.compile(r"^([a-z0-9/]+)\s.*")
+
+IMT_TYPES = ['application', 'audio', 'image', 'message', 'model',
+             'multipart', 'text', 'video']
+IMT_REGEX = re.compile('^(?:' + '|'.join(IMT_TYPES) + ')(/)')
+
+
+def get_ext(s):
+    ext = os.path.splitext(s)[1].split('.')
+
+    return ext[1] if len(ext) == 2 else ""
+
+def cleanup(s):
+    s = s.lower().strip()
+    for regex, replace in REGEXPS:
+        s = regex.sub(replace, s)
+        s = TRAILING_TEXT.sub(r"\1", s)
+    return s
+
+def is_imt(s):
+    return IMT_REGEX.match(s) is not None
+
 
 @simple_service('POST', 'http://purl.org/la/dp/enrich-format', 'enrich-format',
                 'application/json')
@@ -34,36 +69,6 @@ def enrichformat(body, ctype, action="enrich-format",
     by passing the name of the field to use as the 'prop' parameter.
     """
 
-    FORMAT_2_TYPE_MAPPINGS = {
-        "audio": "sound",
-        "image": "image",
-        "video": "moving image",
-        "text": "text"
-    }
-
-    REGEXPS = ('audio/mp3', 'audio/mpeg'), ('images/jpeg', 'image/jpeg'), \
-              ('image/jpg', 'image/jpeg'), ('image/jp$', 'image/jpeg'), \
-              ('img/jpg', 'image/jpeg'), ('^jpeg$', 'image/jpeg'), \
-              ('^jpg$', 'image/jpeg'), ('\W$', '')
-    IMT_TYPES = ['application', 'audio', 'image', 'message', 'model',
-                 'multipart', 'text', 'video']
-
-    def get_ext(s):
-        ext = os.path.splitext(s)[1].split('.')
-
-        return ext[1] if len(ext) == 2 else ""
-
-    def cleanup(s):
-        s = s.lower().strip()
-        for pattern, replace in REGEXPS:
-            s = re.sub(pattern, replace, s)
-            s = re.sub(r"^([a-z0-9/]+)\s.*",r"\1", s)
-        return s
-
-    def is_imt(s):
-        imt_regexes = [re.compile('^' + x + '(/)') for x in IMT_TYPES]
-        return any(regex.match(s) for regex in imt_regexes)
-
     try:
         data = json.loads(body)
     except:
@@ -5,6 +5,26 @@ from amara.thirdparty import json
 from dplaingestion.selector import getprop, setprop, exists
 import re
 
+TAGS_FOR_STRIPPING = '[\.\' ";]*' # Tags for stripping at beginning and at the end.
+REGEXPS = [(re.compile(pattern), replace) for pattern, replace in (
+    ('\s*-{2,4}\s*', '--'),
+    ('\s*-\s*-\s*', '--'),
+    ('^' + TAGS_FOR_STRIPPING, ''),
+    (TAGS_FOR_STRIPPING + '$',''))]
+
+def cleanup(s):
+    try:
+        s = s.strip()
+    except AttributeError:  # when s is None
+        s = ''
+    for regex, replace in REGEXPS:
+        s = regex.sub(replace, s)
+    if len(s) > 2:
+        s = s[0].upper() + s[1:]
+    else:
+        s = None
+    return s
+
 @simple_service('POST', 'http://purl.org/la/dp/enrich-subject', 'enrich-subject', 'application/json')
 def enrichsubject(body,ctype,action="enrich-subject",prop="sourceResource/subject"):
     '''   
@@ -17,25 +37,6 @@ def enrichsubject(body,ctype,action="enrich-subject",prop="sourceResource/subjec
     By default works on the 'subject' field, but can be overridden by passing the name of the field to use
     as a parameter
     '''   
-    
-    TAGS_FOR_STRIPPING = '[\.\' ";]*' # Tags for stripping at beginning and at the end.
-    REGEXPS = ('\s*-{2,4}\s*', '--'), \
-              ('\s*-\s*-\s*', '--'), \
-              ('^' + TAGS_FOR_STRIPPING, ''), \
-              (TAGS_FOR_STRIPPING + '$','')
-
-    def cleanup(s):
-        try:
-            s = s.strip()
-        except AttributeError:  # when s is None
-            s = ''
-        for pattern, replace in REGEXPS:
-            s = re.sub(pattern, replace, s)
-        if len(s) > 2:
-            s = s[0].upper() + s[1:]
-        else:
-            s = None
-        return s
 
     try :
         data = json.loads(body)
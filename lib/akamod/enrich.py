@@ -1,42 +1,18 @@
-import re
 from akara import logger
 from akara import request
-from amara.lib.iri import is_absolute
 from akara.services import simple_service
 from akara.util import copy_headers_to_dict
-from amara.thirdparty import json, httplib2
+from amara.thirdparty import json
+from dplaingestion import pipeline
 from dplaingestion.utilities import iso_utc_with_tz
 
-H = httplib2.Http()
-H.force_exception_as_status_code = True
-
 # FIXME: should support changing media type in a pipeline
-def pipe(content, ctype, enrichments, wsgi_header):
-    body = json.dumps(content)
-    error = None
-    for uri in enrichments:
-        if not uri: continue # in case there's no pipeline
-        if not is_absolute(uri):
-            prefix = request.environ["wsgi.url_scheme"] + "://" 
-            if request.environ.get("HTTP_HOST"):
-                prefix += request.environ["HTTP_HOST"]
-            else:
-                prefix += request.environ["SERVER_NAME"]
-            # Join the prefix and given pipeline module path, ensuring the
-            # path starts with "/".
-            uri = prefix + re.sub(r"^(?!/)", "/", uri)
-        headers = copy_headers_to_dict(request.environ, exclude=[wsgi_header])
-        headers["content-type"] = ctype
-        logger.debug("Calling url: %s " % uri)
-        resp, cont = H.request(uri, "POST", body=body, headers=headers)
-        if not str(resp.status).startswith("2"):
-            error = "Error in enrichment pipeline at %s" % uri
-            logger.error(error)
-            continue
-
-        body = cont
-
-    return error, body
+def pipe(contents, ctype, steps, wsgi_header):
+    """Runs a batch of records through the resolved pipeline steps, in this
+       process where possible, and returns an (error, body) tuple for each.
+       See dplaingestion.pipeline.
+    """
+    return pipeline.run_batch(contents, ctype, steps, wsgi_header)
 
 @simple_service("POST", "http://purl.org/la/dp/enrich", "enrich",
                 "application/json")
@@ -49,8 +25,8 @@ def enrich(body, ctype):
     count of records enriched.
     """
     request_headers = copy_headers_to_dict(request.environ)
-    item_enrichments = request_headers.get(u"Pipeline-Item", "").split(",")
-    coll_enrichments = request_headers.get(u"Pipeline-Coll", "").split(",")
+    item_plan = pipeline.get_plan(request_headers.get(u"Pipeline-Item", ""))
+    coll_plan = pipeline.get_plan(request_headers.get(u"Pipeline-Coll", ""))
 
     records = json.loads(body)
 
@@ -62,22 +38,32 @@ def enrich(body, ctype):
 
     errors = []
     enriched_records = {}
+    colls = []
+    items = []
     for record in records:
         if record.get("ingestType") == "collection":
-            wsgi_header = "HTTP_PIPELINE_COLL"
-            enrichments = coll_enrichments
+            colls.append(record)
         else:
-            wsgi_header = "HTTP_PIPELINE_ITEM"
-            enrichments = item_enrichments
             # Preserve record prior to any enrichments
             record["originalRecord"] = record.copy()         
             record["ingestType"] = "item"
+            items.append(record)
 
         # Explicitly populate ingestDate as UTC
         record["ingestDate"] = iso_utc_with_tz()
 
-        error, enriched_record_text = pipe(record, ctype, enrichments,
-                                           wsgi_header)
+    # Each pipeline step is run once for all collections and once for all
+    # items, rather than once per record
+    coll_results = iter(pipe(colls, ctype, coll_plan.steps,
+                             "HTTP_PIPELINE_COLL"))
+    item_results = iter(pipe(items, ctype, item_plan.steps,
+                             "HTTP_PIPELINE_ITEM"))
+
+    for record in records:
+        if record.get("ingestType") == "collection":
+            error, enriched_record_text = coll_results.next()
+        else:
+            error, enriched_record_text = item_results.next()
         enriched_record = json.loads(enriched_record_text)
         if error:
             errors.append(error)
@@ -106,7 +92,9 @@ def enrich(body, ctype):
         "enriched_item_count": enriched_item_count,
         "missing_id_count": missing_id_count,
         "missing_source_resource_count": missing_source_resource_count,
-        "errors": errors
+        "errors": errors,
+        "pipelines": {"item": item_plan.describe(),
+                      "coll": coll_plan.describe()}
     }
 
     return json.dumps(data)
@@ -119,7 +107,7 @@ def enrich_storage(body, ctype):
     """
 
     request_headers = copy_headers_to_dict(request.environ)
-    rec_enrichments = request_headers.get(u"Pipeline-Item","").split(",")
+    rec_plan = pipeline.get_plan(request_headers.get(u"Pipeline-Item", ""))
 
     records = json.loads(body)
 
@@ -131,9 +119,8 @@ def enrich_storage(body, ctype):
 
     errors = []
     enriched_records = {}
-    for record in records:
-        error, enriched_record_text = pipe(record, ctype, rec_enrichments,
-                                           "HTTP_PIPELINE_ITEM")
+    for error, enriched_record_text in pipe(records, ctype, rec_plan.steps,
+                                            "HTTP_PIPELINE_ITEM"):
         if error:
             errors.append(error)
 
@@ -163,7 +150,8 @@ def enrich_storage(body, ctype):
         "enriched_item_count": enriched_item_count,
         "missing_id_count": missing_id_count,
         "missing_source_resource_count": missing_source_resource_count,
-        "errors": errors
+        "errors": errors,
+        "pipelines": {"item": rec_plan.describe()}
     }
 
     return json.dumps(data)
@@ -7,6 +7,8 @@ from akara.services import simple_service
 from amara.thirdparty import json
 from dateutil.parser import parse as dateutil_parse
 from zen import dateparser
+from dplaingestion.lru_cache import LRUCache, memoize
+from dplaingestion.pipeline import record_service, map_records
 from dplaingestion.selector import getprop, setprop, delprop, exists
 from dplaingestion.utilities import iterify, clean_date, \
                                     remove_all_brackets_and_strip, \
@@ -28,6 +30,16 @@ DEFAULT_DATETIME = dateutil_parse(DEFAULT_DATETIME_STR)
 # as simple solution, hardcoded UTC seconds is given
 DEFAULT_DATETIME_SECS = 32503680000.0 # UTC seconds for "3000-01-01"
 
+# Date strings such as "1900" or "Undated" recur across records and
+# providers, so the results of parsing them are kept for the requests that
+# this process serves
+DATE_CACHE_SIZE = 20000
+
+def date_cache_stats():
+    """Returns the cache statistics of the date parsing functions"""
+    return {"parse_date_or_range": parse_date_or_range.cache.stats(),
+            "robust_date_parser": robust_date_parser.cache.stats()}
+
 def out_of_range(d):
     ret = None
     try:
@@ -41,7 +53,56 @@ def out_of_range(d):
 # (like ISO-8601 but doesn't require timezone)
 edtf_date_and_time = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
 
+# The date shapes that most dates have, which are parsed without the fuzzy
+# parsers: ie 1970, 1970-08 or 1970-08-01
+iso_date = re.compile(r"^(?P<year>\d{4})(?:-(?P<month>\d{2})"
+                      r"(?:-(?P<day>\d{2}))?)?$")
+# ie 8/1/1970
+month_day_year = re.compile(r"^(?P<month>\d{1,2})/(?P<day>\d{1,2})/"
+                            r"(?P<year>\d{4})$")
+
+def is_valid_date(year, month=1, day=1):
+    """Returns True if year, month and day are a date of the calendar, in
+       a year of four digits
+    """
+    if year < 1000:
+        return False
+    try:
+        datetime.date(year, month, day)
+    except ValueError:
+        return False
+    return True
+
+def fast_date_parser(d):
+    """
+    Returns the 8601 date that robust_date_parser() returns for d, if d is a
+    valid date of one of the common shapes YYYY, YYYY-MM, YYYY-MM-DD or
+    M/D/YYYY, else None
+    """
+    match = iso_date.match(d)
+    if match:
+        year, month, day = match.group("year", "month", "day")
+        if is_valid_date(int(year), int(month or 1), int(day or 1)):
+            return d
+        return None
+
+    match = month_day_year.match(d)
+    if match:
+        year, month, day = [int(v) for v in match.group("year", "month",
+                                                         "day")]
+        if is_valid_date(year, month, day):
+            return "%d-%02d-%02d" % (year, month, day)
+    return None
+
+@memoize(LRUCache(DATE_CACHE_SIZE))
 def robust_date_parser(d):
+    """
+    Returns the date of d that fast_date_parser() or else
+    fuzzy_date_parser() returns, or None
+    """
+    return fast_date_parser(d) or fuzzy_date_parser(d)
+
+def fuzzy_date_parser(d):
     """
     Robust wrapper around some date parsing libs, making a best effort to return
     a single 8601 date from the input string. No range checking is performed, and
@@ -102,7 +163,41 @@ decade_date_s = re.compile("(?P<year>\d{4})s")
 # ie between 2000 and 2002
 between_date = re.compile("between\s*(?P<year1>\d{4})\s*and\s*(?P<year2>\d{4})")
 
+def fast_date_or_range(d):
+    """
+    Returns the (begin, end) tuple that parse_date_or_range() returns for d,
+    if d is a valid date of a shape that fast_date_parser() parses or a
+    YYYY-YYYY range, else None
+    """
+    match = year_range.match(d)
+    if match:
+        return tuple(sorted((match.group("year1"), match.group("year2"))))
+
+    match = iso_date.match(d)
+    if match and match.group("month") and not match.group("day"):
+        # As parse_date_or_range() does, read 1970-08 as a month but 1970-75
+        # as a range of years
+        year, month = match.group("year", "month")
+        year_end = year[:2] + month
+        if int(year) >= 1000 and int(year) < int(year_end):
+            return year, year_end
+        if int(year) >= 1000 and not 1 <= int(month) <= 12:
+            return year, year
+
+    date = fast_date_parser(d)
+    if date:
+        return date, date
+    return None
+
+@memoize(LRUCache(DATE_CACHE_SIZE))
 def parse_date_or_range(d):
+    """
+    Returns a (begin, end) tuple of the dates of the date or range d, from
+    fast_date_or_range() or else fuzzy_parse_date_or_range()
+    """
+    return fast_date_or_range(d) or fuzzy_parse_date_or_range(d)
+
+def fuzzy_parse_date_or_range(d):
     #TODO: Handle dates with BC, AD, AH
     #      Handle ranges like 1920s - 1930s
     #      Handle ranges like 11th - 12th century
@@ -342,6 +437,26 @@ def check_date_format(data, prop):
                                      (k, e, data.get("_id")))
                         setprop(d, k, None)
 
+@record_service('enrich_earliest_date')
+def enrich_earliest_date_record(data, action="enrich_earliest_date",
+                                prop="sourceResource/date"):
+    """Sets prop to the earliest date in the given record. See
+       enrich_earliest_date().
+    """
+    convert_dates(data, prop, True)
+    check_date_format(data, prop)
+    return data
+
+
+@record_service('enrich_date')
+def enrich_date_record(data, action="enrich_date",
+                       prop="sourceResource/temporal"):
+    """Sets prop to all dates in the given record. See enrich_date()."""
+    convert_dates(data, prop, False)
+    check_date_format(data, prop)
+    return data
+
+
 @simple_service('POST', 'http://purl.org/la/dp/enrich_earliest_date', 'enrich_earliest_date', HTTP_TYPE_JSON)
 def enrich_earliest_date(body, ctype, action="enrich_earliest_date", prop="sourceResource/date"):
     """
@@ -359,9 +474,8 @@ def enrich_earliest_date(body, ctype, action="enrich_earliest_date", prop="sourc
         response.add_header(HTTP_HEADER_TYPE, HTTP_TYPE_TEXT)
         return "Unable to parse body as JSON"
 
-    convert_dates(data, prop, True)
-    check_date_format(data, prop)
-    return json.dumps(data)
+    return json.dumps(map_records(enrich_earliest_date_record, data, action,
+                                  prop))
 
 
 @simple_service('POST', 'http://purl.org/la/dp/enrich_date', 'enrich_date', HTTP_TYPE_JSON)
@@ -381,6 +495,4 @@ def enrich_date(body, ctype, action="enrich_date", prop="sourceResource/temporal
         response.add_header(HTTP_HEADER_TYPE, HTTP_TYPE_TEXT)
         return "Unable to parse body as JSON"
 
-    convert_dates(data, prop, False)
-    check_date_format(data, prop)
-    return json.dumps(data)
+    return json.dumps(map_records(enrich_date_record, data, action, prop))
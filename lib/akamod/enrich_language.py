@@ -2,6 +2,7 @@ from akara import logger
 from akara import response
 from akara.services import simple_service
 from amara.thirdparty import json
+from dplaingestion.pipeline import record_service, map_records
 from dplaingestion.selector import getprop, setprop, delprop, exists
 from dplaingestion.iso639_3 import ISO639_3_SUBST
 from dplaingestion.iso639_3 import EXACT_LANGUAGE_NAME_REGEXES
@@ -9,32 +10,101 @@ from dplaingestion.iso639_3 import WB_LANGUAGE_NAME_REGEXES
 from dplaingestion.iso639_3 import ISO639_3_1
 from dplaingestion.iso639_1 import ISO639_1
 import re
+import string
 
-@simple_service("POST", "http://purl.org/la/dp/enrich_language",
-                "enrich_language", "application/json")
-def enrich_language(body, ctype, action="enrich_language",
-                      prop="sourceResource/language"):
+# Strips the region, script etc. from a language tag such as "en-US"
+LANGUAGE_TAG_SUBTAGS = re.compile("[-_/].*$")
+PUNCTUATION = re.compile("[\.\[\]\(\)]")
+
+# The language name regexes are compiled with re.I but not re.U, so they only
+# ignore the case of ASCII letters, and their \b only counts ASCII letters,
+# digits and "_" as word characters.
+ASCII_LOWERCASE = dict((ord(c), ord(c.lower())) for c in string.ascii_uppercase)
+WORD_CHARS = frozenset(unicode(string.ascii_letters + string.digits + "_"))
+
+def fold_case(s):
+    """Returns s as unicode with its ASCII letters lowercased. A str is
+       decoded byte for byte, as the regexes match it.
     """
-    Service that accepts a JSON document and sets the language ISO 639-3
-    code(s) and language name from the current language value(s) by:
+    if isinstance(s, str):
+        s = s.decode("latin-1")
+    return s.translate(ASCII_LOWERCASE)
 
-    a) Checking if the value is a language code, else
-    a) Attempting to convert value the value from ISO 639-1 to ISO639-3, else
-    c) Attempting to find an exact language name match, else
-    d) Attempting to find language name matches withing the value
+class LanguageNameTables(object):
+    """Case-folded lookup tables of the language names, in place of the
+       regexes. Build with language_name_tables().
     """
 
-    def iso1_to_iso3(s):
-        s = re.sub("[-_/].*$", "", s).strip()
-        return ISO639_1.get(s, s)
+    def __init__(self):
+        # Case-folded language name -> the code whose regex in
+        # EXACT_LANGUAGE_NAME_REGEXES would match first
+        self.exact_names = {}
+        for iso_code in EXACT_LANGUAGE_NAME_REGEXES:
+            self.exact_names.setdefault(fold_case(ISO639_3_SUBST[iso_code]),
+                                        iso_code)
 
-    try:
-        data = json.loads(body)
-    except:
-        response.code = 500
-        response.add_header("content-type", "text/plain")
-        return "Unable to parse body as JSON"
+        # Case-folded language name -> codes, and code -> its position in
+        # WB_LANGUAGE_NAME_REGEXES, so that matches are listed in the order
+        # the regexes would find them
+        self.wb_names = {}
+        self.wb_order = {}
+        for i, iso_code in enumerate(WB_LANGUAGE_NAME_REGEXES):
+            self.wb_names.setdefault(fold_case(ISO639_3_SUBST[iso_code]),
+                                     []).append(iso_code)
+            self.wb_order[iso_code] = i
+        self.max_name_length = max(len(name) for name in self.wb_names)
+
+_language_name_tables = None
 
+def language_name_tables():
+    """Returns the LanguageNameTables, building them on first use so that
+       importing this module stays cheap for Akara workers.
+    """
+    global _language_name_tables
+    if _language_name_tables is None:
+        _language_name_tables = LanguageNameTables()
+    return _language_name_tables
+
+def iso1_to_iso3(s):
+    s = LANGUAGE_TAG_SUBTAGS.sub("", s).strip()
+    return ISO639_1.get(s, s)
+
+def exact_language_name_code(lang_string):
+    """Returns the code that the first of EXACT_LANGUAGE_NAME_REGEXES to
+       match the stripped lang_string is for, or None.
+    """
+    return language_name_tables().exact_names.get(
+        fold_case(lang_string.strip()))
+
+def language_name_codes(lang_string):
+    """Returns the codes of all the language names found in lang_string
+       between word boundaries, in the order of WB_LANGUAGE_NAME_REGEXES.
+
+       Rather than searching lang_string with every regex, looks up each span
+       of lang_string that starts and ends at a word boundary.
+    """
+    tables = language_name_tables()
+    s = fold_case(lang_string)
+    is_word = [c in WORD_CHARS for c in s]
+    # \b matches where a word character and a non-word character (or either
+    # end of the string) meet
+    boundaries = [i for i in range(len(s) + 1) if
+                  (i > 0 and is_word[i - 1]) != (i < len(s) and is_word[i])]
+
+    codes = set()
+    for n, start in enumerate(boundaries):
+        for end in boundaries[n + 1:]:
+            if end - start > tables.max_name_length:
+                break
+            codes.update(tables.wb_names.get(s[start:end], ()))
+    return sorted(codes, key=tables.wb_order.get)
+
+@record_service("enrich_language")
+def enrich_language_record(data, action="enrich_language",
+                           prop="sourceResource/language"):
+    """Sets the language codes and names in the given record. See
+       enrich_language().
+    """
     if exists(data, prop):
         v = getprop(data, prop)
         language_strings = [v] if not isinstance(v, list) else v
@@ -47,23 +117,18 @@ def enrich_language(body, ctype, action="enrich_language",
             else:
                 # If lang_string is an ISO 639-1 code, convert to ISO 639-3
                 iso3 = iso1_to_iso3(
-                        re.sub("[\.\[\]\(\)]", "", lang_string).lower().strip()
+                        PUNCTUATION.sub("", lang_string).lower().strip()
                         )
                 if iso3 not in iso_codes and iso3 in ISO639_3_SUBST:
                     iso_codes.append(iso3)
                 else:
                     # First check for exact language name matches
-                    for iso_code, regex in EXACT_LANGUAGE_NAME_REGEXES.items():
-                        match = regex.match(lang_string.strip())
-                        if match:
-                            iso_codes.append(iso_code)
-                            break
-
-                    if match is None:
-                        # Check for language names with word boundary regex
-                        for iso_code, regex in WB_LANGUAGE_NAME_REGEXES.items():
-                            if regex.search(lang_string):
-                                iso_codes.append(iso_code)
+                    iso_code = exact_language_name_code(lang_string)
+                    if iso_code:
+                        iso_codes.append(iso_code)
+                    else:
+                        # Check for language names between word boundaries
+                        iso_codes.extend(language_name_codes(lang_string))
 
         if iso_codes:
             seen = set()
@@ -76,4 +141,27 @@ def enrich_language(body, ctype, action="enrich_language",
                            (language_strings, data["_id"]))
             delprop(data, prop)
 
-    return json.dumps(data)
+    return data
+
+@simple_service("POST", "http://purl.org/la/dp/enrich_language",
+                "enrich_language", "application/json")
+def enrich_language(body, ctype, action="enrich_language",
+                      prop="sourceResource/language"):
+    """
+    Service that accepts a JSON document and sets the language ISO 639-3
+    code(s) and language name from the current language value(s) by:
+
+    a) Checking if the value is a language code, else
+    a) Attempting to convert value the value from ISO 639-1 to ISO639-3, else
+    c) Attempting to find an exact language name match, else
+    d) Attempting to find language name matches withing the value
+    """
+
+    try:
+        data = json.loads(body)
+    except:
+        response.code = 500
+        response.add_header("content-type", "text/plain")
+        return "Unable to parse body as JSON"
+
+    return json.dumps(map_records(enrich_language_record, data, action, prop))
@@ -6,7 +6,8 @@ from amara.thirdparty import json
 from dplaingestion.selector import getprop, setprop, exists
 from dplaingestion.utilities import iterify
 
-REGEXPS = ('\.',''), ('\(',''), ('\)',''), ('-',''), (',','')
+# Characters removed before looking for state abbreviations
+ABBREV_PUNCTUATION = re.compile(r"[.()\-,]")
 
 @simple_service('POST', 'http://purl.org/la/dp/enrich_location', 'enrich_location', 'application/json')
 def enrichlocation(body,ctype,action="enrich_location", prop="sourceResource/spatial"):
@@ -60,8 +61,9 @@ def get_isostate(strg, abbrev=None):
         states = from_abbrev(s) if abbrev else s
         for state in (states if isinstance(states, list) else [states]):
             append_empty_strings = True
+            upper_state = state.upper()
             for st in STATES:
-                if st in state.upper():
+                if st in upper_state:
                     iso_arr.append(STATES[st])
                     state_arr.append(st.title())
                     append_empty_strings = None
@@ -79,24 +81,21 @@ def get_isostate(strg, abbrev=None):
 
 def from_abbrev(strg):
     states = []
-    for pattern, replace in REGEXPS:
-        strg = re.sub(pattern, replace, strg)
+    strg = ABBREV_PUNCTUATION.sub('', strg)
     # First check against STATES iso values, minus the "US-"
-    for state, iso in STATES.iteritems():
-        st = re.sub('US-','',iso)
-        match = re.compile(r'\b({0})\b'.format(st)).search(strg.upper())
-        if match:
-            s = match.group(0)
-            # Check against cases like "in"/"as"/etc
-            low = re.compile(r'\b({0})\b'.format(s.lower())).search(strg)
-            if not low:
+    found = set(STATE_ABBREV_REGEX.findall(strg.upper()))
+    if found:
+        # Check against cases like "in"/"as"/etc
+        found -= set(st.upper() for st in
+                     LOWER_STATE_ABBREV_REGEX.findall(strg))
+        for state, iso in STATES.iteritems():
+            if iso[3:] in found:
                 states.append(state.title())
     # If no matches, check againts the ABBREV values
     if not states:
-        for state,abbrevs in ABBREV.iteritems():
-            for abbrev in abbrevs.split(';'):
-                match = re.compile(r'\b({0})\b'.format(abbrev)).search(strg.upper())
-                if match:
+        for state, regexes in ABBREV_REGEXES:
+            for regex in regexes:
+                if regex.search(strg.upper()):
                     states.append(state)
                 break
     if not states:
@@ -127,12 +126,16 @@ def create_dictionaries(data):
                     dicts.append(dict)
     return filter(None, dicts)
 
+LEADING_SPACES = re.compile('^  *')
+LEADING_BRACKET = re.compile('^\[')
+TRAILING_SPACES = re.compile(' *$')
+
 def remove_space_around_semicolons(strg):
     strg_arr = strg.split(';')
     for i in range(len(strg_arr)):
-        strg_arr[i] = re.sub('^  *','',strg_arr[i])
-        strg_arr[i] = re.sub('^\[','',strg_arr[i])
-        strg_arr[i] = re.sub(' *$','',strg_arr[i])
+        strg_arr[i] = LEADING_SPACES.sub('',strg_arr[i])
+        strg_arr[i] = LEADING_BRACKET.sub('',strg_arr[i])
+        strg_arr[i] = TRAILING_SPACES.sub('',strg_arr[i])
     strg = ';'.join(strg_arr)
     return strg
 
@@ -200,3 +203,14 @@ ABBREV = {
     "Pennsylvania": "PEN;PENN",
     "Massachusetts": "MASS"
 }
+
+# Matches any of the STATES iso values, minus the "US-", as a word
+STATE_ABBREV_REGEX = re.compile(r'\b({0})\b'.format(
+    "|".join(iso[3:] for iso in STATES.itervalues())))
+LOWER_STATE_ABBREV_REGEX = re.compile(r'\b({0})\b'.format(
+    "|".join(iso[3:].lower() for iso in STATES.itervalues())))
+
+# (state, regexes of its ABBREV values), in ABBREV order
+ABBREV_REGEXES = [(state, [re.compile(r'\b({0})\b'.format(abbrev))
+                           for abbrev in abbrevs.split(';')])
+                  for state, abbrevs in ABBREV.iteritems()]
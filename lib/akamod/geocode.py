@@ -4,15 +4,139 @@ from akara import module_config, response
 from akara import logger
 from akara.services import simple_service
 from amara.thirdparty import json
+from dplaingestion.pipeline import record_service, record_batch_service
 from dplaingestion.selector import getprop, setprop, exists
 from geopy import point
 import re
+import time
+import threading
 import traceback
+from multiprocessing.pool import ThreadPool
 from urllib import urlencode
-from urllib2 import urlopen, URLError
+from requests import RequestException
+from dplaingestion import http_pool
+from dplaingestion import geocode_cache
+from dplaingestion.gazetteer import Gazetteer
 from dplaingestion.utilities import iterify
 
 
+_geocoder = None
+
+def get_geocoder():
+    """Returns the geocoder shared by all requests to this module"""
+    global _geocoder
+    if _geocoder is None:
+        config = module_config()
+        if config.get('geocoder') == 'gazetteer':
+            _geocoder = GazetteerGeocoder(
+                Gazetteer(config.get('gazetteer_path')))
+            return _geocoder
+        cache = geocode_cache.GeocodeCache(
+            path=config.get('cache_path'),
+            maxsize=config.get('cache_size', geocode_cache.MAXSIZE),
+            ttl=config.get('cache_ttl', geocode_cache.TTL),
+            negative_ttl=config.get('cache_negative_ttl',
+                                    geocode_cache.NEGATIVE_TTL))
+        _geocoder = TwofishesGeocoder(cache)
+        _geocoder.batch_threads = config.get('batch_threads',
+                                             _geocoder.batch_threads)
+    return _geocoder
+
+@record_service('geocode')
+def geocode_record(data, prop="sourceResource/spatial", newprop='coordinates'):
+    """Adds geocode data to the given record. See geocode()."""
+    if (not exists(data, prop)):
+        pass
+    else:
+        logger.debug("Geocoding %s" % data["_id"])
+        value = getprop(data, prop)
+        places = []
+
+        for v in iterify(value):
+            if not isinstance(v, dict):
+                logger.error("Spatial value must be a dictionary; record %s" %
+                             data["_id"])
+                continue
+            place = Place(v)
+            place.enrich_geodata(get_geocoder())
+            places.append(place)
+
+        setprop(data, prop, [_map_json(place) for place in places])
+
+    return data
+
+
+@record_batch_service('geocode')
+def geocode_records(data, prop="sourceResource/spatial",
+                    newprop='coordinates'):
+    """Adds geocode data to each of the given list of records, as
+    geocode_record() does, but geocodes each distinct place of the records
+    only once, with up to the geocoder's batch_threads places at a time.
+    """
+    geocoder = get_geocoder()
+    distinct = {}
+    record_keys = []
+    total = 0
+    for record in data:
+        if not exists(record, prop):
+            continue
+        keys = []
+        for v in iterify(getprop(record, prop)):
+            if not isinstance(v, dict):
+                logger.error("Spatial value must be a dictionary; record %s" %
+                             record["_id"])
+                continue
+            place = Place(v)
+            key = tuple(getattr(place, name) for name in Place.MAP_FIELDS)
+            try:
+                hash(key)
+            except TypeError:
+                # Not a place that can be looked up once for all records
+                key = object()
+            distinct.setdefault(key, place)
+            keys.append(key)
+        total += len(keys)
+        record_keys.append((record, keys))
+
+    def _geocode(place):
+        place.enrich_geodata(geocoder)
+        return _map_json(place)
+
+    start = time.time()
+    keys = distinct.keys()
+    threads = min(geocoder.batch_threads, len(keys))
+    if threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            values = pool.map(_geocode, [distinct[key] for key in keys])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        values = [_geocode(distinct[key]) for key in keys]
+    value_for_key = dict(zip(keys, values))
+    elapsed = time.time() - start
+
+    for record, keys in record_keys:
+        # Records must not share the same dictionaries
+        setprop(record, prop, [dict(value_for_key[key]) for key in keys])
+
+    if total:
+        logger.info("Geocoded %d places of %d records as %d distinct " %
+                    (total, len(data), len(value_for_key)) +
+                    "places (dedup ratio %.1f) in %.3fs" %
+                    (float(total) / len(value_for_key), elapsed))
+    return data
+
+
+def _map_json(place):
+    """Returns the MAP JSON of place, whose strings are UTF-8 encoded, with
+    the strings decoded
+    """
+    return dict((k, v.decode("utf-8") if isinstance(v, str) else v)
+                for k, v in place.to_map_json().iteritems())
+
+
 @simple_service('POST', 'http://purl.org/la/dp/geocode', 'geocode',
                 'application/json')
 def geocode(body, ctype, prop="sourceResource/spatial", newprop='coordinates'):
@@ -36,25 +160,10 @@ def geocode(body, ctype, prop="sourceResource/spatial", newprop='coordinates'):
         response.add_header('content-type','text/plain')
         return "Unable to parse body as JSON"
 
-    if (not exists(data, prop)):
-        pass
+    if isinstance(data, list):
+        data = geocode_records(data, prop, newprop)
     else:
-        logger.debug("Geocoding %s" % data["_id"])
-        value = getprop(data, prop)
-        places = []
-
-        for v in iterify(value):
-            if not isinstance(v, dict):
-                logger.error("Spatial value must be a dictionary; record %s" %
-                             data["_id"])
-                continue
-            place = Place(v)
-            place.enrich_geodata(TwofishesGeocoder())
-            places.append(place)
-
-        values = map(lambda x: x.to_map_json(), places)
-        setprop(data, prop, values)
-
+        data = geocode_record(data, prop, newprop)
     return json.dumps(data)
 
 
@@ -136,21 +245,26 @@ class Place:
                 setattr(self, prop, getattr(coded_place, prop))
 
 
-class TwofishesGeocoder():
-    """Geocoder that uses Twofishes"""
+class Geocoder(object):
+    """Interface of the geocoders that enrich Places
 
-    # A subset of the WOE Types above that we want to try to apply to
+    Subclasses implement the two lookups that enrich_place() makes:
+
+        _place_from_coordinates(lat, lng): Given coordinates, returns a Place
+            or None if there is no match
+        _geocode_place(place): Given a Place with a name, returns a Place or
+            None if there is no match
+    """
+
+    # How many places geocode_records() looks up at a time
+    batch_threads = 1
+
+    # The Where On Earth (WOE) Types that we want to try to apply to
     # sourceResource.spatial properties. Our "region" spatial property is
     # not precisely defined and does not correspond cleanly to any of the WOE
     # Types.
     PROP_FOR_WOE_TYPE = {7: 'city', 8: 'state', 9: 'county', 12: 'country'}
 
-    def __init__(self):
-        self.base_url = module_config().get('twofishes_base_url')
-        self.params = {'lang': 'en',
-                       'responseIncludes': 'PARENTS,DISPLAY_NAME',
-                       'maxInterpretations': 1}
-
     def enrich_place(self, place):
         """Take a Place and return an enriched replacement, if possible.
 
@@ -174,6 +288,25 @@ class TwofishesGeocoder():
                 return new_place
         return place
 
+
+class TwofishesGeocoder(Geocoder):
+    """Geocoder that uses Twofishes"""
+
+    batch_threads = 8
+
+    # Log the cache statistics every LOG_STATS_EVERY lookups
+    LOG_STATS_EVERY = 1000
+
+    def __init__(self, cache=None):
+        self.base_url = module_config().get('twofishes_base_url')
+        self.params = {'lang': 'en',
+                       'responseIncludes': 'PARENTS,DISPLAY_NAME',
+                       'maxInterpretations': 1}
+        self.cache = cache
+        self.lookups = 0
+        # Lookups are made by several threads for a batch of records
+        self._lookups_lock = threading.Lock()
+
     def _place_from_coordinates(self, lat, lng):
         """Given coordinates, return a Place or None if there is no match
 
@@ -235,10 +368,36 @@ class TwofishesGeocoder():
         return self._lookup_data(our_params)
 
     def _lookup_data(self, xtra_params):
-        """Given query parameters, return a Twofishes interpretation"""
+        """Given query parameters, return a Twofishes interpretation
+
+        Interpretations, and the lack of one, are cached if there is a cache;
+        failed requests are not.
+        """
         url = self._url(xtra_params)
+        if self.cache is None:
+            return self._interpretation(self._twofishes_data(url))
+
+        key = geocode_cache.cache_key(xtra_params)
+        interpretation = self.cache.get(key)
+        if interpretation is None:
+            data = self._twofishes_data(url)
+            interpretation = self._interpretation(data)
+            if data:
+                self.cache.put(key, interpretation)
+
+        with self._lookups_lock:
+            self.lookups += 1
+            log_stats = self.lookups % self.LOG_STATS_EVERY == 0
+        if log_stats:
+            logger.info("Geocode cache: %s" % self.cache.stats())
+        return interpretation
+
+    def _interpretation(self, data):
+        """Return the first interpretation of the Twofishes data, or an
+        empty dictionary if there is none
+        """
         try:
-            return self._twofishes_data(url)['interpretations'][0]
+            return data['interpretations'][0]
         except (KeyError, IndexError) as e:
             return {}
 
@@ -253,17 +412,17 @@ class TwofishesGeocoder():
         """
         logger.debug("GET %s" % url)
         try:
-            response = urlopen(url, None, 2)
-            http_status = response.getcode()
+            response = http_pool.get(url, timeout=2)
+            http_status = response.status_code
             if http_status != 200:
                 logger.error("Got status %d from %s" % (http_status, url))
                 return {}
-            return json.loads(response.read())
-        except URLError as e:
+            return json.loads(response.content)
+        except RequestException as e:
             logger.error("Could not open %s (%s)" % (url, e))
             return {}
         except Exception as e:
-            logger.error("Unexpected exception from %s: %e" % (url, e))
+            logger.error("Unexpected exception from %s: %s" % (url, e))
             return {}
 
     def _query_phrase(self, place):
@@ -275,3 +434,63 @@ class TwofishesGeocoder():
                                  place.state])
         ok_features = [f for f in features if f not in place.name]
         return " ".join([place.name] + ok_features)
+
+
+class GazetteerGeocoder(Geocoder):
+    """Geocoder that uses a local Gazetteer, without network requests"""
+
+    def __init__(self, gazetteer):
+        self.gazetteer = gazetteer
+
+    def _place_from_coordinates(self, lat, lng):
+        """Given coordinates, return a Place for the nearest town or None if
+        there is none
+
+        See self.enrich_place()
+        """
+        try:
+            found = self.gazetteer.nearest(float(lat), float(lng))
+        except ValueError:
+            return None
+        if found:
+            return Place(self._place_features(found))
+        else:
+            return None
+
+    def _geocode_place(self, place):
+        """Enhance a given Place by looking its name up in the gazetteer
+
+        A name such as "Bakersfield, CA" that is not found as a whole is
+        looked up by its first part, preferring the places within the rest
+        of it and within the Place's city, county, state and country.
+        """
+        parts = [p.strip() for p in place.name.split(',') if p.strip()]
+        context = parts[1:] + [place.city, place.county, place.state,
+                               place.country]
+        found = self.gazetteer.find(place.name, context)
+        if not found and len(parts) > 1:
+            found = self.gazetteer.find(parts[0], context)
+        if found:
+            return Place(self._place_features(found))
+        else:
+            return None
+
+    def _place_features(self, found):
+        """Given a gazetteer place, return a dictionary that expresses the
+        Place's properties, as TwofishesGeocoder._place_features does
+        """
+        ancestors = self.gazetteer.ancestors(found)
+        display_parts = [found.name] + [a.name for a in ancestors
+                                        if a.woe_type in (8, 12)]
+        rv = {'name': ', '.join(display_parts)}
+        i_type = self.PROP_FOR_WOE_TYPE.get(found.woe_type, None)
+        if i_type:
+            rv[i_type] = found.name
+            if i_type != 'country' and found.lat is not None:
+                # Assign coordinates if it's not a country.
+                rv['coordinates'] = ', '.join([str(found.lat),
+                                               str(found.lng)])
+        rv.update(dict((self.PROP_FOR_WOE_TYPE[a.woe_type], a.name)
+                       for a in ancestors
+                       if a.woe_type in self.PROP_FOR_WOE_TYPE))
+        return rv
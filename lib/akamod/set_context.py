@@ -1,8 +1,31 @@
 from akara import response
 from amara.thirdparty import json
 from akara.services import simple_service
+from dplaingestion.pipeline import record_service, map_records
 from dplaingestion.selector import setprop
 
+ITEM_CONTEXT = {
+    "@context": "http://dp.la/api/items/context",
+    "aggregatedCHO": "#sourceResource",
+    "@type": "ore:Aggregation"
+}
+
+COLLECTION_CONTEXT = {
+    "@context": "http://dp.la/api/collections/context",
+    "@type": "dcmitype:Collection" 
+}
+
+@record_service('set_context')
+def set_context_record(data, prop="@context"):
+    """Sets the "@context" field of the given record. See setcontext()."""
+    if data["ingestType"] == "item":
+        data.update(ITEM_CONTEXT)
+        setprop(data, "sourceResource/@id", "%s#sourceResource" % data["@id"])
+    else:
+        data.update(COLLECTION_CONTEXT)
+
+    return data
+
 @simple_service('POST', 'http://purl.org/la/dp/set_context',
                 'set_context', 'application/json')
 def setcontext(body, ctype, prop="@context"):
@@ -18,21 +41,4 @@ def setcontext(body, ctype, prop="@context"):
         response.add_header('content-type','text/plain')
         return "Unable to parse body as JSON"
 
-    item_context = {
-        "@context": "http://dp.la/api/items/context",
-        "aggregatedCHO": "#sourceResource",
-        "@type": "ore:Aggregation"
-    }
-
-    collection_context = {
-        "@context": "http://dp.la/api/collections/context",
-        "@type": "dcmitype:Collection" 
-    }
-
-    if data["ingestType"] == "item":
-        data.update(item_context)
-        setprop(data, "sourceResource/@id", "%s#sourceResource" % data["@id"])
-    else:
-        data.update(collection_context)
-
-    return json.dumps(data)
+    return json.dumps(map_records(set_context_record, data, prop))
@@ -2,33 +2,14 @@ from akara import logger
 from akara import response
 from akara.services import simple_service
 from amara.thirdparty import json
+from dplaingestion.pipeline import record_service, map_records
 from dplaingestion.selector import getprop, setprop, delprop, exists
 from dplaingestion.utilities import iterify
 
-@simple_service('POST', 'http://purl.org/la/dp/set_prop', 'set_prop',
-    'application/json')
-def set_prop(body, ctype, prop=None, value=None, condition_prop=None,
-             condition_value=None, _dict=None):
-    """Sets the value of prop.
-
-    Keyword arguments:
-    body -- the content to load
-    ctype -- the type of content
-    prop -- the prop to set
-    value -- the value to set prop to
-    condition_prop -- (optional) the field that must exist to set the prop
-    condition_value -- (optional, if condition_prop set) the value that
-                       condition_prop must have to set the prop
-    
-    """
-
-    try:
-        data = json.loads(body)
-    except:
-        response.code = 500
-        response.add_header('content-type', 'text/plain')
-        return "Unable to parse body as JSON"
-
+@record_service('set_prop')
+def set_prop_record(data, prop=None, value=None, condition_prop=None,
+                    condition_value=None, _dict=None):
+    """Sets the value of prop in the given record. See set_prop()."""
     if not value:
         logger.error("No value was supplied to set_prop.")
     else:
@@ -37,7 +18,10 @@ def set_prop(body, ctype, prop=None, value=None, condition_prop=None,
                 value = json.loads(value)
             except Exception, e:
                 logger.error("Unable to parse set_prop value: %s" % e)
-                return body
+                return data
+        elif isinstance(value, str):
+            # As it would be after a round trip through JSON
+            value = value.decode("utf-8")
 
         def _set_prop():
             """Returns true if
@@ -59,31 +43,47 @@ def set_prop(body, ctype, prop=None, value=None, condition_prop=None,
             except Exception, e:
                 logger.error("Error in set_prop: %s" % e)
 
-    return json.dumps(data)
+    return data
 
-@simple_service('POST', 'http://purl.org/la/dp/unset_prop', 'unset_prop',
+@simple_service('POST', 'http://purl.org/la/dp/set_prop', 'set_prop',
     'application/json')
-def unset_prop(body, ctype, prop=None, condition=None, condition_prop=None):
-    """Unsets the value of prop.
+def set_prop(body, ctype, prop=None, value=None, condition_prop=None,
+             condition_value=None, _dict=None):
+    """Sets the value of prop.
 
     Keyword arguments:
     body -- the content to load
     ctype -- the type of content
-    prop -- the prop to unset
-    condition -- the condition to be met (uses prop by default) 
-    condition_prop -- the prop(s) to use in the condition (comma-separated if
-                      multiple props)
-    
+    prop -- the prop to set
+    value -- the value to set prop to
+    condition_prop -- (optional) the field that must exist to set the prop
+    condition_value -- (optional, if condition_prop set) the value that
+                       condition_prop must have to set the prop
+
     """
 
-    CONDITIONS = {
-        "is_digit": lambda v: v[0].isdigit(),
-        "mwdl_exclude": lambda v: (v[0] == "collections" or
-                                   v[0] == "findingAids"),
-        "hathi_exclude": lambda v: "Minnesota Digital Library" in v,
-        "finding_aid_title": lambda v: v[0].startswith("Finding Aid"),
-        "usc_no_contributor": lambda v: not v[0].get("contributor", False)
-    }
+    try:
+        data = json.loads(body)
+    except:
+        response.code = 500
+        response.add_header('content-type', 'text/plain')
+        return "Unable to parse body as JSON"
+
+    return json.dumps(map_records(set_prop_record, data, prop, value,
+                                  condition_prop, condition_value, _dict))
+
+CONDITIONS = {
+    "is_digit": lambda v: v[0].isdigit(),
+    "mwdl_exclude": lambda v: (v[0] == "collections" or
+                               v[0] == "findingAids"),
+    "hathi_exclude": lambda v: "Minnesota Digital Library" in v,
+    "finding_aid_title": lambda v: v[0].startswith("Finding Aid"),
+    "usc_no_contributor": lambda v: not v[0].get("contributor", False)
+}
+
+@record_service('unset_prop')
+def unset_prop_record(data, prop=None, condition=None, condition_prop=None):
+    """Unsets the value of prop in the given record. See unset_prop()."""
 
     def condition_met(condition_prop, condition):
         values = []
@@ -94,13 +94,6 @@ def unset_prop(body, ctype, prop=None, condition=None, condition_prop=None):
 
         return CONDITIONS[condition](values)
 
-    try:
-        data = json.loads(body)
-    except:
-        response.code = 500
-        response.add_header('content-type', 'text/plain')
-        return "Unable to parse body as JSON"
-
     # Check if prop exists to avoid key error
     if exists(data, prop):
         if not condition:
@@ -110,11 +103,35 @@ def unset_prop(body, ctype, prop=None, condition=None, condition_prop=None):
                 condition_prop = prop
             try:
                 if condition_met(condition_prop, condition):
-                    logger.debug("Unsetting prop %s for doc with id %s" % 
+                    logger.debug("Unsetting prop %s for doc with id %s" %
                                  (prop, data["_id"]))
                     delprop(data, prop)
             except KeyError:
                 logger.error("CONDITIONS does not contain %s" % condition)
-                
 
-    return json.dumps(data)
+    return data
+
+@simple_service('POST', 'http://purl.org/la/dp/unset_prop', 'unset_prop',
+    'application/json')
+def unset_prop(body, ctype, prop=None, condition=None, condition_prop=None):
+    """Unsets the value of prop.
+
+    Keyword arguments:
+    body -- the content to load
+    ctype -- the type of content
+    prop -- the prop to unset
+    condition -- the condition to be met (uses prop by default)
+    condition_prop -- the prop(s) to use in the condition (comma-separated if
+                      multiple props)
+
+    """
+
+    try:
+        data = json.loads(body)
+    except:
+        response.code = 500
+        response.add_header('content-type', 'text/plain')
+        return "Unable to parse body as JSON"
+
+    return json.dumps(map_records(unset_prop_record, data, prop, condition,
+                                  condition_prop))
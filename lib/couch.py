@@ -3,15 +3,23 @@ import sys
 import json
 import time
 import couchdb
+import hashlib
 import logging
 import traceback
 import ConfigParser
 from copy import deepcopy
 from datetime import datetime
-from dplaingestion.selector import setprop
+from dplaingestion.selector import getprop, setprop
 from dplaingestion.dict_differ import DictDiffer
 from dplaingestion.utilities import iso_utc_with_tz
 
+# Fields that differ between ingestions of an unchanged document
+DIFF_IGNORE_KEYS = ["_rev", "admin", "ingestDate", "ingestionSequence"]
+# Fields left out of the content hash. Unlike the diff, the hash covers
+# admin (but for admin/contentHash), so that a document whose admin fields
+# changed, ie admin/object_status, is saved as harvested.
+HASH_IGNORE_KEYS = ["_rev", "ingestDate", "ingestionSequence"]
+
 class Couch(object):
     """A class to hold the couchdb-python functionality used during ingestion.
 
@@ -35,15 +43,31 @@ class Couch(object):
                              are located.
             batch_size: The batch size to use with iterview
             sync_qa_views: Boolean; determines whether QA views get synced
+            skip_unchanged_docs: Boolean; determines whether documents whose
+                                 content has not changed since the last
+                                 ingestion are saved again as they are
+                                 stored, with only the new
+                                 ingestionSequence, rather than as
+                                 harvested. They are still saved, and so
+                                 get a new revision; only the diff is
+                                 skipped
+            backup_mode: "full" to copy all of a provider's documents to the
+                         backup database, or "delta" to only record the
+                         documents an ingestion changes or deletes
         """
         config = ConfigParser.ConfigParser({"LogLevel": "INFO",
-                                            "SyncQAViews": "True"})
+                                            "SyncQAViews": "True",
+                                            "SkipUnchangedDocs": "True",
+                                            "BackupMode": "full"})
         config.readfp(open(config_file))
         url = config.get("CouchDb", "Url")
         username = config.get("CouchDb", "Username")
         password = config.get("CouchDb", "Password")
         log_level = config.get("CouchDb", "LogLevel")
         sync_qa_views = config.getboolean("CouchDb", "SyncQAViews")
+        skip_unchanged_docs = config.getboolean("CouchDb",
+                                                "SkipUnchangedDocs")
+        backup_mode = config.get("CouchDb", "BackupMode")
 
         if not kwargs:
             dpla_db_name = "dpla"
@@ -52,6 +76,8 @@ class Couch(object):
             dpla_db_name = kwargs.get("dpla_db_name")
             dashboard_db_name = kwargs.get("dashboard_db_name")
             sync_qa_views = kwargs.get("sync_qa_views", True)
+            skip_unchanged_docs = kwargs.get("skip_unchanged_docs", True)
+            backup_mode = kwargs.get("backup_mode", "full")
 
         bulk_download_db_name = "bulk_download"
 
@@ -66,6 +92,14 @@ class Couch(object):
         self.views_directory = "couchdb_views"
         self.batch_size = 500
         self.sync_qa_views = sync_qa_views
+        # Design doc file -> (file mtime, design doc)
+        self._design_doc_files = {}
+        # (db name, design doc file) -> (file mtime, revision saved)
+        self._synced_design_docs = {}
+        self.skip_unchanged_docs = skip_unchanged_docs
+        if backup_mode not in ("full", "delta"):
+            raise ValueError("Unknown backup mode %s" % backup_mode)
+        self.backup_mode = backup_mode
 
         self.logger = logging.getLogger("couch")
         handler = logging.FileHandler("logs/couch.log")
@@ -90,11 +124,12 @@ class Couch(object):
         """Return the result of the given view in the "dpla" database"""
         return self.dpla_db.view(viewname, None, **options)
 
-    def sync_views(self, db_name):
-        """Fetches design documents from the views_directory, saves/updates
-           them in the appropriate database, then build the views. 
+    def _get_db_and_view_files(self, db_name):
+        """Returns the database with the given name along with the names of
+           the design document files in views_directory to sync to it.
         """
         build_views_from_file = ["dpla_db_all_provider_docs.js",
+                                 "dpla_db_original_record_ids.js",
                                  "dashboard_db_all_provider_docs.js",
                                  "dashboard_db_all_ingestion_docs.js",
                                  "dpla_db_export_database.js",
@@ -111,38 +146,103 @@ class Couch(object):
         elif db_name == "bulk_download":
             db = self.bulk_download_db
 
-        for file in os.listdir(self.views_directory):
-            if file.startswith(db_name) and file in build_views_from_file:
-                fname = os.path.join(self.views_directory, file)
-                with open(fname, "r") as f:
-                    s = f.read().replace("\n", "")
-                    design_doc = json.loads(s)
-
-                # Check if the design doc has changed
-                prev_design_doc = db.get(design_doc["_id"], {})
-                prev_revision = prev_design_doc.pop("_rev", None)
-                diff = DictDiffer(design_doc, prev_design_doc)
-                if diff.differences():
-                    # Save thew design document
-                    if prev_revision:
-                        design_doc["_rev"] = prev_revision
-                    db[design_doc["_id"]] = design_doc
-
-                # Build views
-                design_doc_name = design_doc["_id"].split("_design/")[-1]
-                real_views = (v for v in design_doc["views"] if v != "lib")
-                for view in real_views:
-                    view_path = "%s/%s" % (design_doc_name, view)
-                    start = time.time()
-                    try:
-                        for doc in db.view(view_path, limit=0):
-                            pass
-                        self.logger.debug("Built %s view %s in %s seconds"
-                                          % (db.name, view_path,
-                                             time.time() - start))
-                    except Exception, e:
-                        self.logger.error("Error building %s view %s: %s" %
-                                          (db.name, view_path, e))
+        return db, [file for file in os.listdir(self.views_directory)
+                    if file.startswith(db_name) and
+                    file in build_views_from_file]
+
+    def _read_design_doc(self, file):
+        """Returns the design document in the given views_directory file along
+           with the file's modification time. The file is only read again
+           once it has been modified.
+        """
+        fname = os.path.join(self.views_directory, file)
+        mtime = os.path.getmtime(fname)
+        cached = self._design_doc_files.get(file)
+        if not cached or cached[0] != mtime:
+            with open(fname, "r") as f:
+                s = f.read().replace("\n", "")
+                cached = (mtime, json.loads(s))
+            self._design_doc_files[file] = cached
+        return dict(cached[1]), mtime
+
+    def _sync_design_doc(self, db, file):
+        """Saves the design document in the given views_directory file to db
+           if it has changed, and returns it.
+
+           The revision saved is remembered along with the file's modification
+           time, so that the design document is not diffed again while both
+           stay the same.
+        """
+        design_doc, mtime = self._read_design_doc(file)
+        prev_design_doc = db.get(design_doc["_id"], {})
+        prev_revision = prev_design_doc.pop("_rev", None)
+        if self._synced_design_docs.get((db.name, file)) == \
+           (mtime, prev_revision):
+            return design_doc
+
+        # Check if the design doc has changed
+        diff = DictDiffer(design_doc, prev_design_doc)
+        if diff.differences():
+            # Save thew design document
+            if prev_revision:
+                design_doc["_rev"] = prev_revision
+            db[design_doc["_id"]] = design_doc
+            prev_revision = design_doc.pop("_rev")
+        self._synced_design_docs[(db.name, file)] = (mtime, prev_revision)
+        return design_doc
+
+    def sync_views(self, db_name, wait=True):
+        """Fetches design documents from the views_directory, saves/updates
+           them in the appropriate database, then build the views. 
+
+           If wait is False, the views are queried with stale=update_after,
+           which starts updating their indexes without waiting for them; see
+           view_index_lag.
+        """
+        db, files = self._get_db_and_view_files(db_name)
+        view_options = {"limit": 0}
+        if not wait:
+            view_options["stale"] = "update_after"
+
+        for file in files:
+            design_doc = self._sync_design_doc(db, file)
+
+            # Build views
+            design_doc_name = design_doc["_id"].split("_design/")[-1]
+            real_views = (v for v in design_doc["views"] if v != "lib")
+            for view in real_views:
+                view_path = "%s/%s" % (design_doc_name, view)
+                start = time.time()
+                try:
+                    for doc in db.view(view_path, **view_options):
+                        pass
+                    self.logger.debug("%s %s view %s in %s seconds"
+                                      % ("Built" if wait else "Refreshed",
+                                         db.name, view_path,
+                                         time.time() - start))
+                except Exception, e:
+                    self.logger.error("Error building %s view %s: %s" %
+                                      (db.name, view_path, e))
+
+    def view_index_lag(self, db_name):
+        """Returns a dictionary of the number of database updates that each
+           design document's view index has yet to process, by design
+           document name.
+        """
+        db, files = self._get_db_and_view_files(db_name)
+        db_seq = _seq_number(db.info()["update_seq"])
+        lag = {}
+        for file in files:
+            design_doc, _ = self._read_design_doc(file)
+            design_doc_name = design_doc["_id"].split("_design/")[-1]
+            try:
+                info = db.info(design_doc_name)
+                lag[design_doc_name] = db_seq - \
+                    _seq_number(info["view_index"]["update_seq"])
+            except Exception, e:
+                self.logger.error("Error getting %s view index info for %s: "
+                                  "%s" % (db.name, design_doc_name, e))
+        return lag
 
     def update_ingestion_doc(self, ingestion_doc, **kwargs):
         for prop, value in kwargs.items():
@@ -224,6 +324,36 @@ class Couch(object):
                                                       provider_name,
                                                       ingestion_sequence)
  
+    def _query_all_dpla_prov_docs_before_ingest_seq(self, provider_name,
+                                                    ingestion_sequence):
+        """Yields all "dpla" database documents for the given provider that
+           were last saved before the given ingestion sequence.
+        """
+        view_name = "all_provider_docs/by_provider_name_and_ingestion_sequence"
+        for row in self.dpla_db.iterview(view_name,
+                                         batch=self.batch_size,
+                                         include_docs=True,
+                                         startkey=[provider_name, 0],
+                                         endkey=[provider_name,
+                                                 ingestion_sequence]):
+            yield row["doc"]
+
+    def _query_dpla_prov_docs_by_original_record_id(self, provider_name,
+                                                    record_ids):
+        """Yields the "dpla" database documents for the given provider whose
+           original records have one of the given identifiers, looking them
+           up batch_size identifiers at a time.
+        """
+        view_name = "original_record_ids/by_provider_name_and_id"
+        record_ids = list(record_ids)
+        for i in range(0, len(record_ids), self.batch_size):
+            keys = [[provider_name, record_id] for record_id in
+                    record_ids[i:i + self.batch_size]]
+            for row in self.dpla_db.view(view_name, keys=keys,
+                                         include_docs=True):
+                if row.doc is not None:
+                    yield row.doc
+
     def _query_all_dashboard_provider_docs(self, provider_name):
         """Yield all "dashboard" database documents for the given provider"""
         # See http://docs.couchdb.org/en/latest/couchapp/views/collation.html
@@ -268,25 +398,37 @@ class Couch(object):
 
     def _prep_for_diff(self, doc):
         """Removes keys from document that should not be compared."""
-        ignore_keys = ["_rev", "admin", "ingestDate", "ingestionSequence"]
-        for key in ignore_keys:
+        for key in DIFF_IGNORE_KEYS:
             if key in doc:
                 del doc[key]
         return doc
 
+    def _content_hash(self, doc):
+        """Returns a hash of the document's canonical JSON, leaving out the
+           keys in HASH_IGNORE_KEYS and admin/contentHash. Documents with the
+           same hash have no fields changed.
+        """
+        content = dict((k, v) for k, v in doc.iteritems()
+                       if k not in HASH_IGNORE_KEYS)
+        if isinstance(content.get("admin"), dict):
+            content["admin"] = dict((k, v) for k, v in
+                                    content["admin"].iteritems()
+                                    if k != "contentHash")
+        return hashlib.sha1(json.dumps(content, sort_keys=True,
+                                       separators=(",", ":"))).hexdigest()
+
     def _get_fields_changed(self, harvested_doc, database_doc):
         """Compares harvested_doc and database_doc and returns any changed
            fields.
         """
         fields_changed = {}
         diff = DictDiffer(harvested_doc, database_doc)
-        if diff.added():
-            fields_changed["added"] = diff.added()
-        if diff.removed():
-            fields_changed["removed"] = diff.removed()
-        if diff.changed():
-            fields_changed["changed"] = diff.changed()
-        
+        for name, fields in (("added", diff.added()),
+                             ("removed", diff.removed()),
+                             ("changed", diff.changed())):
+            if fields:
+                fields_changed[name] = fields
+
         return fields_changed
 
     def _get_sorted_ingestion_docs_for(self, provider_name):
@@ -297,12 +439,28 @@ class Couch(object):
                                     key=lambda k: k["ingestionSequence"])
         return ingestion_docs
 
-    def _get_last_ingestion_doc_for(self, provider_name):
-        last_ingestion_doc = None
+    def _get_last_ingestion_doc_for(self, provider_name, before_sequence=None,
+                                    successful=False):
+        """Returns the provider's last ingestion document, or None if there
+           is none.
+
+           If before_sequence is given, only ingestions with a lower
+           ingestionSequence are considered. If successful is True, only
+           ingestions that ran through to the removal of deleted records,
+           and that have not been rolled back, are considered.
+        """
         ingestion_docs = self._get_sorted_ingestion_docs_for(provider_name)
-        if ingestion_docs:
-            last_ingestion_doc = ingestion_docs[-1]
-        return last_ingestion_doc
+        for ingestion_doc in reversed(ingestion_docs):
+            if before_sequence is not None and \
+               ingestion_doc["ingestionSequence"] >= before_sequence:
+                continue
+            if successful and \
+               (ingestion_doc.get("rolledBackTo") or
+                getprop(ingestion_doc, "delete_process/status", True) !=
+                "complete"):
+                continue
+            return ingestion_doc
+        return None
 
     def _update_ingestion_doc_counts(self, ingestion_doc, **kwargs):
         for k, v in kwargs.iteritems():
@@ -310,7 +468,7 @@ class Couch(object):
                 ingestion_doc[k] += v
             else:
                 self.logger.error("Key %s not in ingestion doc with ID: %s" %
-                                  (k, ingestion_doc_id))
+                                  (k, ingestion_doc["_id"]))
         self.dashboard_db.save(ingestion_doc)
 
     def _delete_documents(self, db, docs):
@@ -409,10 +567,177 @@ class Couch(object):
 
         return backup_db_name
 
+    def _create_delta_backup_db(self, provider):
+        """Creates an empty backup database in which the documents that an
+           ingestion changes or deletes are recorded as it goes (see
+           _back_up_deltas), returning the backup database name.
+        """
+        backup_db_name = "%s_%s" % (provider,
+                                    datetime.utcnow().strftime("%Y%m%d%H%M%S"))
+        self.server.create(backup_db_name)
+
+        msg = "Recording changes to %s in database %s" % (provider,
+                                                          backup_db_name)
+        self.logger.debug(msg)
+        print >> sys.stderr, msg
+
+        return backup_db_name
+
+    def _get_delta_backup_db(self, ingestion_doc):
+        """Returns the database in which the ingestion records the documents
+           it changes or deletes, or None if it is not backed up that way.
+        """
+        if ingestion_doc.get("backupMode") == "delta":
+            return self.server[ingestion_doc["backupDB"]]
+        return None
+
+    def _back_up_deltas(self, backup_db, previous_docs, added_ids=()):
+        """Records in backup_db the documents about to be changed or deleted,
+           as they are in the dpla database, and the ids of the documents
+           about to be added.
+
+           A document is only recorded the first time, so that its delta
+           holds the document as it was before the ingestion.
+        """
+        deltas = []
+        for doc in previous_docs:
+            previous = dict(doc)
+            previous.pop("_rev", None)
+            previous.pop("_deleted", None)
+            deltas.append({"_id": doc["_id"], "previous": previous})
+        deltas.extend([{"_id": doc_id} for doc_id in added_ids])
+        if deltas:
+            # Conflicts with documents already recorded are left in the
+            # response rather than raised
+            self._bulk_post_to(backup_db, deltas)
+
+    def _undo_deltas(self, deltas):
+        """Restores the previous version of the documents recorded in deltas
+           and deletes those that were added, returning the number of
+           documents updated.
+        """
+        current_docs = self._get_docs_by_id(self.dpla_db,
+                                            [delta["_id"] for delta in deltas])
+        docs = []
+        for delta in deltas:
+            doc_id = delta["_id"]
+            current = current_docs.get(doc_id)
+            if "previous" in delta:
+                doc = delta["previous"]
+            elif current:
+                doc = {"_id": doc_id, "_deleted": True}
+            else:
+                # Added, then deleted by a later ingestion
+                continue
+            if current:
+                doc["_rev"] = current["_rev"]
+            docs.append(doc)
+        if docs:
+            self._bulk_post_to(self.dpla_db, docs)
+        return len(docs)
+
+    def _rollback_deltas(self, ingestion_docs):
+        """Undoes the changes recorded in the delta backups of ingestion_docs,
+           the latest ingestion first.
+
+           Returns an error message, or None if the rollback succeeded.
+        """
+        ingestion_docs = sorted(ingestion_docs,
+                                key=lambda k: k["ingestionSequence"],
+                                reverse=True)
+        for ingestion_doc in ingestion_docs:
+            if ingestion_doc.get("backupMode") != "delta" or \
+               ingestion_doc.get("backupDB") not in self.server:
+                return "Attempted to rollback but ingestionSequence " + \
+                       "%s has no delta backup" % \
+                       ingestion_doc["ingestionSequence"]
+
+        for ingestion_doc in ingestion_docs:
+            backup_db_name = ingestion_doc["backupDB"]
+            what = "Undoing changes recorded in database %s" % backup_db_name
+            print what
+            count = 0
+            deltas = []
+            try:
+                for delta in self._query_all_docs(self.server[backup_db_name]):
+                    deltas.append(delta)
+                    if len(deltas) == self.batch_size:
+                        count += self._undo_deltas(deltas)
+                        print "%s documents rolled back" % count
+                        deltas = []
+                # Last batch
+                if deltas:
+                    count += self._undo_deltas(deltas)
+                    print "%s documents rolled back" % count
+            except couchdb.http.ServerError as e:
+                print_couch_traceback()
+                return self._couchdb_server_error_msg(e, what)
+            except Exception as e:
+                print_couch_traceback()
+                return self._generic_exception_error_msg(e, what)
+
+        what = "Resetting the ingestionSequence of unchanged documents"
+        print what
+        try:
+            self._reset_ingestion_sequences(
+                ingestion_docs[0]["provider"],
+                [doc["ingestionSequence"] for doc in ingestion_docs],
+                ingestion_docs[-1]["ingestionSequence"] - 1)
+        except couchdb.http.ServerError as e:
+            print_couch_traceback()
+            return self._couchdb_server_error_msg(e, what)
+        except Exception as e:
+            print_couch_traceback()
+            return self._generic_exception_error_msg(e, what)
+
+        self.sync_views(self.dpla_db.name)
+        return None
+
+    def _reset_ingestion_sequences(self, provider, sequences,
+                                   ingestion_sequence):
+        """Gives the provider documents still carrying one of the ingestion
+           sequences rolled back from the ingestion_sequence rolled back to.
+
+           Once their deltas are undone, these are the documents that the
+           ingestions rolled back found unchanged, and so only gave their
+           own ingestionSequence, and that were already there after the
+           ingestion rolled back to.
+        """
+        for seq in sequences:
+            docs = []
+            for doc in self._query_all_dpla_prov_docs_by_ingest_seq(provider,
+                                                                    seq):
+                doc["ingestionSequence"] = ingestion_sequence
+                docs.append(doc)
+                if len(docs) == self.batch_size:
+                    self._bulk_post_to(self.dpla_db, docs)
+                    docs = []
+            if docs:
+                self._bulk_post_to(self.dpla_db, docs)
+
     def _bulk_post_to(self, db, docs, **options):
         resp = db.update(docs, **options)
         self.logger.debug("%s database response: %s" % (db.name, resp))
 
+    def _get_docs_by_id(self, db, doc_ids):
+        """Returns a dictionary of the documents in db with the given ids,
+           keyed by id. Documents that do not exist or were deleted are left
+           out.
+
+           The documents are fetched with one _all_docs POST per batch_size
+           ids, rather than one GET per document.
+        """
+        doc_ids = list(doc_ids)
+        docs = {}
+        for i in range(0, len(doc_ids), self.batch_size):
+            rows = db.view("_all_docs", keys=doc_ids[i:i + self.batch_size],
+                           include_docs=True)
+            for row in rows:
+                # Rows for missing or deleted documents have no doc
+                if row.doc is not None:
+                    docs[row.key] = row.doc
+        return docs
+
     def _create_ingestion_document(self, provider, uri_base, profile_path,
                                    thresholds, fetcher_threads=1):
         """Creates and returns an ingestion document for the provider.
@@ -426,6 +751,7 @@ class Couch(object):
             "countAdded": 0,
             "countChanged": 0,
             "countDeleted": 0,
+            "countUnchanged": 0,
             "uri_base": uri_base,
             "profile_path": profile_path,
             "fetcher_threads": fetcher_threads,
@@ -510,9 +836,18 @@ class Couch(object):
         return ingestion_doc_id
 
     def _back_up_data(self, ingestion_doc):
+        """Backs up the provider documents, unless this is the first
+           ingestion. In "delta" backup mode, only creates the backup database
+           in which the ingestion then records the documents it changes or
+           deletes.
+        """
         if ingestion_doc["ingestionSequence"] != 1:
             try:
-                backup_db_name = self._backup_db(ingestion_doc["provider"])
+                if self.backup_mode == "delta":
+                    backup_db_name = self._create_delta_backup_db(
+                        ingestion_doc["provider"])
+                else:
+                    backup_db_name = self._backup_db(ingestion_doc["provider"])
             except couchdb.http.ServerError as e:
                 self._print_couchdb_server_error(e, "backing up data")
                 print_couch_traceback()
@@ -522,6 +857,7 @@ class Couch(object):
                 print_couch_traceback()
                 return -1
             ingestion_doc["backupDB"] = backup_db_name
+            ingestion_doc["backupMode"] = self.backup_mode
             self.dashboard_db.save(ingestion_doc)
 
     def create_ingestion_doc_and_backup_db(self, provider):
@@ -542,24 +878,44 @@ class Couch(object):
         if not last_ingestion_doc:
             ingestion_sequence = 1
         else:
-            # Since this is not the first ingestion we will back up the
-            # provider documents and upate the current ingestion document with
-            # the backup database name.
             ingestion_sequence = last_ingestion_doc["ingestionSequence"] + 1
-            backup_db_name = self._backup_db(provider)
-            ingestion_doc["backupDB"] = backup_db_name
-            self.dashboard_db.save(ingestion_doc)
-            
 
         ingestion_doc["ingestionSequence"] = ingestion_sequence
         ingestion_doc_id = self.dashboard_db.save(ingestion_doc)[0]
+        # Backs up the provider documents, as backup_mode says, and updates
+        # the ingestion document with the backup database name
+        if self._back_up_data(ingestion_doc) == -1:
+            raise Exception("Error backing up %s documents" % provider)
         return ingestion_doc_id
 
+    def _read_deleted_ids(self, ingestion_doc):
+        """Returns the set of the identifiers of the records that the
+           ingestion's fetch found deleted, read from the file named by
+           fetch_process/deleted_ids_file, one per line. If there is no such
+           file no records were found deleted.
+        """
+        deleted_ids = set()
+        path = getprop(ingestion_doc, "fetch_process/deleted_ids_file", True)
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.rstrip("\n").decode("utf-8")
+                    if line:
+                        deleted_ids.add(line)
+        return deleted_ids
+
     def process_deleted_docs(self, ingestion_doc):
-        """Deletes any provider document whose ingestionSequence equals the
-           previous ingestion's ingestionSequence, adds the deleted document id
-           to the dashboard database, and updates the current ingestion
-           document's countDeleted.
+        """Deletes any provider document that the ingestion did not harvest
+           (that is, whose ingestionSequence is lower than the ingestion's),
+           adds the deleted document id to the dashboard database, and
+           updates the current ingestion document's countDeleted. If the
+           ingestion is backed up with deltas, the documents are recorded in
+           the backup database before they are deleted.
+
+           If the ingestion harvested incrementally (its
+           fetch_process/harvest_from is set), only the documents whose
+           records the provider reported deleted are deleted instead. They
+           are looked up by the identifiers of their original records.
 
            Returns a status (-1 for error, 0 for success) along with the total
            number of documents deleted.
@@ -568,13 +924,29 @@ class Couch(object):
         if not ingestion_doc["ingestionSequence"] == 1:
             provider = ingestion_doc["provider"]
             curr_seq = int(ingestion_doc["ingestionSequence"])
-            prev_seq = curr_seq - 1
 
             delete_docs = []
             dashboard_docs = []
-            alldocs = self._query_all_dpla_prov_docs_by_ingest_seq
+            what = "opening backup database"
             try:
-                for doc in alldocs(provider, prev_seq):
+                backup_db = self._get_delta_backup_db(ingestion_doc)
+                if getprop(ingestion_doc, "fetch_process/harvest_from", True):
+                    # An incremental harvest only fetches the records added
+                    # or changed since the last ingestion, so only those the
+                    # provider reported deleted are deleted
+                    what = "reading deleted record ids"
+                    deleted_ids = self._read_deleted_ids(ingestion_doc)
+                    if not deleted_ids:
+                        return (0, total_deleted)
+                    docs = (doc for doc in
+                            self._query_dpla_prov_docs_by_original_record_id(
+                                provider, deleted_ids)
+                            if doc.get("ingestionSequence") < curr_seq)
+                else:
+                    docs = self._query_all_dpla_prov_docs_before_ingest_seq(
+                        provider, curr_seq)
+                what = "querying documents (dpla db)"
+                for doc in docs:
                     delete_docs.append(doc)
                     dashboard_docs.append({"id": doc["_id"],
                                            "type": "record",
@@ -591,6 +963,9 @@ class Couch(object):
                         self._update_ingestion_doc_counts(
                             ingestion_doc, countDeleted=len(delete_docs)
                             )
+                        if backup_db is not None:
+                            what = "backing up deleted documents"
+                            self._back_up_deltas(backup_db, delete_docs)
                         what = "deleting documents (dpla db)"
                         self._delete_documents(self.dpla_db, delete_docs)
                         total_deleted += len(delete_docs)
@@ -607,6 +982,9 @@ class Couch(object):
                     self._update_ingestion_doc_counts(
                         ingestion_doc, countDeleted=len(delete_docs)
                         )
+                    if backup_db is not None:
+                        what = "backing up deleted documents"
+                        self._back_up_deltas(backup_db, delete_docs)
                     what = "deleting documents (dpla db)"
                     self._delete_documents(self.dpla_db, delete_docs)
                     total_deleted += len(delete_docs)
@@ -683,9 +1061,15 @@ class Couch(object):
         1. Removing unmodified docs from harvested set
         2. Counting changed docs
         3. Counting added docs
-        4. Adding the ingestionSequence to the harvested doc
+        4. Adding the ingestionSequence and content hash to the harvested doc
         5. Inserting the changed and added docs to the ingestion database
 
+        A doc whose content hash matches the stored doc's is not diffed.
+        Unless skip_unchanged_docs is False, it is saved as it is stored with
+        only the new ingestionSequence, so that process_deleted_docs and the
+        Elasticsearch index see it in this ingestion. It is still saved, and
+        gets a new revision.
+
         Params:
         harvested_docs - A dictionary with the doc "_id" as the key and the
                          document to be inserted in CouchDB as the value
@@ -694,19 +1078,66 @@ class Couch(object):
         Returns a tuple (status, error_msg) where status is -1 for an error or
         0 otherwise
         """
+        status, batch = self.prepare_dpla_batch(harvested_docs, ingestion_doc)
+        if status == -1:
+            return (status, batch)
+        return self.post_dpla_batch(batch, ingestion_doc)
+
+    def prepare_dpla_batch(self, harvested_docs, ingestion_doc,
+                           pending_doc_ids=()):
+        """Does the work of process_and_post_to_dpla up to, but not including,
+           the database updates, which post_dpla_batch makes.
+
+           Harvested documents whose ids are in pending_doc_ids, those of
+           batches prepared but not yet posted, are removed as duplicates.
+
+           Returns a tuple (status, batch) where status is -1 for an error,
+           with batch the error message, or 0 otherwise, with batch the
+           dictionary of documents and counts to pass to post_dpla_batch.
+        """
         provider = ingestion_doc["provider"]
         ingestion_sequence = ingestion_doc["ingestionSequence"]
 
         added_docs = []
         changed_docs = []
         duplicate_doc_ids = []
+        unchanged_doc_ids = []
+        # Documents as they are in the dpla database, keyed by id
+        previous_docs = {}
+        # Unchanged documents as they are in the dpla database, with the
+        # ingestionSequence of this ingestion. They are saved again like the
+        # others, since the ingestionSequence is only seen by readers of the
+        # dpla database (and of the Elasticsearch index fed from it) once it
+        # is saved.
+        marker_docs = {}
+        what = "fetching documents (dpla db)"
+        try:
+            db_docs = self._get_docs_by_id(self.dpla_db, harvested_docs.keys())
+        except couchdb.http.ServerError as e:
+            error_msg = self._couchdb_server_error_msg(e, what)
+            print >> sys.stderr, self._ts_for_err(), error_msg
+            print_couch_traceback()
+            return (-1, error_msg)
+        except Exception as e:
+            error_msg = self._generic_exception_error_msg(e, what)
+            print >> sys.stderr, self._ts_for_err(), error_msg
+            print_couch_traceback()
+            return (-1, error_msg)
         for hid in harvested_docs:
-            # Add ingestonSequence to harvested document
+            if hid in pending_doc_ids:
+                # Remove duplicate documents not yet posted
+                duplicate_doc_ids.append(hid)
+                continue
+
+            # Add ingestonSequence and content hash to harvested document
             harvested_docs[hid]["ingestionSequence"] = ingestion_sequence
+            content_hash = self._content_hash(harvested_docs[hid])
+            harvested_docs[hid].setdefault("admin", {})["contentHash"] = \
+                content_hash
 
             # Add the revision and find the fields changed for harvested
             # documents that were ingested in a prior ingestion
-            db_doc = self.dpla_db.get(hid)
+            db_doc = db_docs.get(hid)
             if db_doc:
                 if db_doc.get("ingestionSequence") == ingestion_sequence:
                     # Remove duplicate documents
@@ -714,6 +1145,14 @@ class Couch(object):
                     continue
 
                 harvested_docs[hid]["_rev"] = db_doc["_rev"]
+                previous_docs[hid] = dict(db_doc)
+
+                if db_doc.get("admin", {}).get("contentHash") == content_hash:
+                    unchanged_doc_ids.append(hid)
+                    if self.skip_unchanged_docs:
+                        marker_docs[hid] = dict(
+                            db_doc, ingestionSequence=ingestion_sequence)
+                    continue
 
                 db_doc = self._prep_for_diff(db_doc)
                 harvested_doc = self._prep_for_diff(deepcopy(harvested_docs[hid]))
@@ -739,16 +1178,48 @@ class Couch(object):
         # Remove duplicate documents to prevent multiple saves
         for id in duplicate_doc_ids:
             del harvested_docs[id]
-        
+
+        post_docs = [marker_docs.get(hid, doc)
+                     for hid, doc in harvested_docs.iteritems()]
+
+        # The documents a delta backup records before post_dpla_batch changes
+        # them. Those only given a new ingestionSequence are not recorded;
+        # rollback resets it (see _reset_ingestion_sequences)
+        backup_docs = [previous_docs[doc["_id"]] for doc in post_docs
+                       if doc["_id"] in previous_docs and
+                       doc["_id"] not in marker_docs]
+        added_ids = [doc["id"] for doc in added_docs]
+
+        return (0, {"dashboard_docs": added_docs + changed_docs,
+                    "post_docs": post_docs,
+                    "backup_docs": backup_docs,
+                    "added_ids": added_ids,
+                    "counts": {"countAdded": len(added_docs),
+                               "countChanged": len(changed_docs),
+                               "countUnchanged": len(unchanged_doc_ids)}})
+
+    def post_dpla_batch(self, batch, ingestion_doc):
+        """Posts a batch prepared by prepare_dpla_batch to the dashboard and
+           dpla databases and updates the ingestion document counts, first
+           recording the documents it changes if the ingestion is backed up
+           with deltas.
+
+           Returns a tuple (status, error_msg) where status is -1 for an error
+           or 0 otherwise
+        """
         try:
+            what = "backing up changed documents"
+            backup_db = self._get_delta_backup_db(ingestion_doc)
+            if backup_db is not None:
+                self._back_up_deltas(backup_db, batch["backup_docs"],
+                                     batch["added_ids"])
             what = "posting to dashboard db"
-            self._bulk_post_to(self.dashboard_db, added_docs + changed_docs)
+            self._bulk_post_to(self.dashboard_db, batch["dashboard_docs"])
             what = "updating ingestion document counts"
             self._update_ingestion_doc_counts(ingestion_doc,
-                                              countAdded=len(added_docs),
-                                              countChanged=len(changed_docs))
+                                              **batch["counts"])
             what = "posting to dpla database"
-            self._bulk_post_to(self.dpla_db, harvested_docs.values())
+            self._bulk_post_to(self.dpla_db, batch["post_docs"])
         except couchdb.http.ServerError as e:
             error_msg = self._couchdb_server_error_msg(e, what)
             print >> sys.stderr, self._ts_for_err(), error_msg
@@ -769,6 +1240,10 @@ class Couch(object):
         2. Removing all provider documents from the DPLA database
         3. Fetching all the backup database documents, removing the "_rev"
            field, then posting to the DPLA database
+
+        If the ingestion after the one rolled back to was backed up with
+        deltas, the changes recorded by it and by every later ingestion are
+        undone instead, the latest ingestion first.
         """
         # Since the ingestion that triggered a backup contains the backup
         # database name, we add 1 to the ingestion sequence provider to fetch
@@ -777,7 +1252,17 @@ class Couch(object):
         ingest_doc = self._query_prov_ingest_doc_by_ingest_seq(provider,
                                                                ingest_sequence)
         backup_db_name = ingest_doc["backupDB"] if ingest_doc else None
-        if backup_db_name:
+        if ingest_doc and ingest_doc.get("backupMode") == "delta":
+            rollback_docs = [doc for doc in
+                             self._get_sorted_ingestion_docs_for(provider)
+                             if doc["ingestionSequence"] >= ingest_sequence]
+            error_msg = self._rollback_deltas(rollback_docs)
+            if error_msg:
+                return error_msg
+            rollback_sequences = [doc["ingestionSequence"] for doc in
+                                  rollback_docs]
+        elif backup_db_name:
+            rollback_sequences = [ingest_sequence]
             what = "Deleting DPLA provider documents"
             print what
             count = 0
@@ -836,28 +1321,14 @@ class Couch(object):
             return "Attempted to rollback but no ingestion document with " + \
                    "ingestionSequence of %s was found" % ingest_sequence
 
-        # Delete dashboard "record" documents for the ingestionSequence rolled
-        # back from
-        what = "Deleting ingestionSequence %s dashboard documents" % \
-               ingest_sequence
-        print what
-        count = 0
-        delete_docs = []
+        # Mark the ingestions rolled back from, so that an incremental
+        # harvest is not made from one of them
+        what = "Marking the ingestion documents rolled back from"
         try:
-            alldocs = self._query_all_dashboard_prov_docs_by_ingest_seq
-            for doc in alldocs(provider, ingest_sequence):
-                if doc.get("type") == "record":
-                    delete_docs.append(doc)
-                if len(delete_docs) == self.batch_size:
-                    count += len(delete_docs)
-                    print "%s documents deleted" % count
-                    self._delete_documents(self.dashboard_db, delete_docs)
-                    delete_docs = []
-            # Last delete
-            if delete_docs:
-                count += len(delete_docs)
-                print "%s documents deleted" % count
-                self._delete_documents(self.dashboard_db, delete_docs)
+            for doc in self._get_sorted_ingestion_docs_for(provider):
+                if doc["ingestionSequence"] >= ingest_sequence:
+                    doc["rolledBackTo"] = ingest_sequence - 1
+                    self.dashboard_db.save(doc)
         except couchdb.http.ServerError as e:
             print_couch_traceback()
             return self._couchdb_server_error_msg(e, what)
@@ -865,6 +1336,36 @@ class Couch(object):
             print_couch_traceback()
             return self._generic_exception_error_msg(e, what)
 
+        # Delete the dashboard documents, other than the ingestion
+        # documents, for the ingestionSequences rolled back from
+        for ingest_sequence in rollback_sequences:
+            what = "Deleting ingestionSequence %s dashboard documents" % \
+                   ingest_sequence
+            print what
+            count = 0
+            delete_docs = []
+            try:
+                alldocs = self._query_all_dashboard_prov_docs_by_ingest_seq
+                for doc in alldocs(provider, ingest_sequence):
+                    if doc.get("type") != "ingestion":
+                        delete_docs.append(doc)
+                    if len(delete_docs) == self.batch_size:
+                        count += len(delete_docs)
+                        print "%s documents deleted" % count
+                        self._delete_documents(self.dashboard_db, delete_docs)
+                        delete_docs = []
+                # Last delete
+                if delete_docs:
+                    count += len(delete_docs)
+                    print "%s documents deleted" % count
+                    self._delete_documents(self.dashboard_db, delete_docs)
+            except couchdb.http.ServerError as e:
+                print_couch_traceback()
+                return self._couchdb_server_error_msg(e, what)
+            except Exception as e:
+                print_couch_traceback()
+                return self._generic_exception_error_msg(e, what)
+
         return "Rollback complete"
 
     def update_bulk_download_document(self, contributor, file_path,
@@ -908,6 +1409,12 @@ class Couch(object):
         return "[%s]" % iso_utc_with_tz()
 
 
+def _seq_number(seq):
+    """Returns the number of a database update sequence, which is either a
+       number or, from CouchDB 2.0 on, a string starting with one.
+    """
+    return int(str(seq).split("-")[0])
+
 def print_couch_traceback(limit=10):
     exc_type, exc_value, exc_traceback = sys.exc_info()
     traceback.print_tb(exc_traceback, limit=limit, file=sys.stderr)
@@ -1,57 +1,82 @@
-# DictDiffer class modified from http://stackoverflow.com
-# http://stackoverflow.com/questions/6027558/flatten-nested-python-dictionaries-compressing-keys
-
-from itertools import *
-from collections import *
-
 class DictDiffer(object):
     """
     Calculate the difference between two dictionaries as:
     (1) List f items added
     (2) List of items removed
     (3) List of keys same in both but changed values
-    """
 
-    same = lambda x:x  # identity function
-    add = lambda a,b:a+b
-    _tuple = lambda x:(x,)  # python actually has coercion, avoid it like so
+    Nested dictionaries are compared key by key, and their items are named by
+    their "/"-separated paths (ie "sourceResource/title"). Any other value,
+    lists included, is compared as a whole.
+    """
 
     def __init__(self, current_dict, past_dict):
-        self.current_dict = self._pathify_dict(current_dict)
-        self.past_dict = self._pathify_dict(past_dict)
-
-        self.set_current = set(self.current_dict)
-        self.set_past = set(self.past_dict)
-
-        self.intersect = self.set_current.intersection(self.set_past)
-
-    def _flatten_dict(self, dictionary, key_reducer=add, key_lift=_tuple, init=()):
-        """Given a nested dict, returns a flattened dict with all nested keys as a tuple key"""
-
-        def _flatten_iter(pairs, _key_accum=init):
-            atoms = ((k,v) for k,v in pairs if not isinstance(v, Mapping))
-            submaps = ((k,v) for k,v in pairs if isinstance(v, Mapping))
-            def compress(k):
-                return key_reducer(_key_accum, key_lift(k))
-            return chain(((compress(k),v) for k,v in atoms),
-                         *[_flatten_iter(submap.items(), compress(k)) for k, submap in submaps])
-        return dict(_flatten_iter(dictionary.items()))
-
-    def _pathify_dict(self, d):
-        """Sets the tuple keys of dict d to 'tuple_val1/tuple_val2/.../tuple_valN'"""
-        flat_dict = self._flatten_dict(d)
-        return dict(("/".join(k), v) for k, v in flat_dict.iteritems())
+        self.current_dict = current_dict
+        self.past_dict = past_dict
+        self._diff = None
 
+    def _differences(self):
+        """Returns the sorted (added, removed, changed) lists, walking both
+           dictionaries the first time only.
+        """
+        if self._diff is None:
+            added, removed, changed = [], [], []
+            _diff_dicts(self.current_dict, self.past_dict, "",
+                        added, removed, changed)
+            self._diff = (sorted(added), sorted(removed), sorted(changed))
+        return self._diff
 
     def added(self):
-        return list(self.set_current - self.intersect)
+        return list(self._differences()[0])
 
     def removed(self):
-        return list(self.set_past - self.intersect)
+        return list(self._differences()[1])
 
     def changed(self):
-        return list(set(o for o in list(self.intersect) if
-                    self.past_dict[o] != self.current_dict[o]))
+        return list(self._differences()[2])
 
     def differences(self):
         return self.added() + self.removed() + self.changed()
+
+
+def _diff_dicts(current, past, prefix, added, removed, changed):
+    """Appends the paths of the items added to, removed from and changed in
+       past to get current, in a single walk of both dictionaries.
+    """
+    for key, value in current.iteritems():
+        path = prefix + key
+        if key not in past:
+            _add_paths(value, path, added)
+            continue
+
+        past_value = past[key]
+        # Identical or equal subtrees have no differences
+        if value is past_value or value == past_value:
+            continue
+        if isinstance(value, dict):
+            if isinstance(past_value, dict):
+                _diff_dicts(value, past_value, path + "/",
+                            added, removed, changed)
+            else:
+                _add_paths(value, path, added)
+                removed.append(path)
+        elif isinstance(past_value, dict):
+            added.append(path)
+            _add_paths(past_value, path, removed)
+        else:
+            changed.append(path)
+
+    for key, past_value in past.iteritems():
+        if key not in current:
+            _add_paths(past_value, prefix + key, removed)
+
+
+def _add_paths(value, path, paths):
+    """Appends the paths of the items in value, found at path, to paths. An
+       empty dictionary has no items.
+    """
+    if isinstance(value, dict):
+        for key, v in value.iteritems():
+            _add_paths(v, path + "/" + key, paths)
+    else:
+        paths.append(path)
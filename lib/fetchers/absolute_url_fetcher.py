@@ -1,7 +1,33 @@
-import sys
+import time
+import Queue
+import urlparse
 import threading
+from urllib import urlencode
+from itertools import izip, islice
+from requests import RequestException
+from multiprocessing.pool import ThreadPool
+from dplaingestion import http_pool
 from dplaingestion.utilities import iterify
-from dplaingestion.fetchers.fetcher import Fetcher
+from dplaingestion.fetchers.fetcher import Fetcher, XML_PARSE
+
+# Seconds to wait before the first retry of a failed detail request, doubled
+# for each further retry
+DETAIL_FETCH_BACKOFF = 1
+
+# Host -> semaphore limiting the concurrent detail requests to it, shared by
+# the fetchers of all fetch threads
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+def host_semaphore(url, limit):
+    """Returns the semaphore limiting the concurrent requests to the host of
+       url to limit.
+    """
+    host = urlparse.urlsplit(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+        return _host_semaphores[host]
 
 
 class AbsoluteURLFetcher(Fetcher):
@@ -9,9 +35,126 @@ class AbsoluteURLFetcher(Fetcher):
         self.get_sets_url = profile.get("get_sets_url")
         self.get_records_url = profile.get("get_records_url")
         self.endpoint_url_params = profile.get("endpoint_url_params")
-        self.retry = []
+        # Number of item detail requests (see request_details) made at once,
+        # at most max_requests_per_host of them to the same host
+        self.detail_fetch_threads = profile.get("detail_fetch_threads", 4)
+        self.max_requests_per_host = profile.get("max_requests_per_host", 4)
+        # Number of times a failed detail or page request is retried
+        self.detail_fetch_retries = profile.get("detail_fetch_retries", 2)
+        # Number of pages (see request_pages) requested or waiting to be
+        # processed at once
+        self.page_fetch_window = profile.get("page_fetch_window", 4)
         super(AbsoluteURLFetcher, self).__init__(profile, uri_base,
                                                  config_file)
+        # Keep a connection open for each concurrent detail request
+        http_pool.require_pool_size(self.max_requests_per_host)
+
+    def request_with_retries(self, url, params=None):
+        """Requests url, with the query parameters params, like
+           request_content_from. Waits while max_requests_per_host requests
+           to the host of url are under way, and retries connection errors,
+           timeouts and 429 or 5xx responses up to detail_fetch_retries
+           times, backing off exponentially.
+
+           Returns an (error, content) tuple
+        """
+        if params:
+            request = "%s?%s" % (url, urlencode(params, True))
+        else:
+            request = url
+        for attempt in range(self.detail_fetch_retries + 1):
+            if attempt:
+                time.sleep(DETAIL_FETCH_BACKOFF * 2 ** (attempt - 1))
+            retry = False
+            with host_semaphore(url, self.max_requests_per_host):
+                try:
+                    r = http_pool.get(url, params=params,
+                                      headers=self.http_headers)
+                except RequestException, e:
+                    error = "Error (%s) requesting %s" % (e, request)
+                    retry = True
+                else:
+                    if r.ok:
+                        return None, r.text
+                    error = "Error (%s--%s) requesting %s" % (r.status_code,
+                                                              r.reason,
+                                                              request)
+                    retry = r.status_code == 429 or r.status_code >= 500
+            if not retry:
+                break
+        return error, None
+
+    def request_details(self, urls):
+        """Yields a (url, error, content) tuple for each of urls, in order,
+           requesting up to detail_fetch_threads of them at once with
+           request_with_retries.
+        """
+        if self.detail_fetch_threads <= 1 or len(urls) <= 1:
+            for url in urls:
+                error, content = self.request_with_retries(url)
+                yield url, error, content
+            return
+
+        pool = ThreadPool(min(self.detail_fetch_threads, len(urls)))
+        try:
+            for url, (error, content) in \
+                    izip(urls, pool.imap(self.request_with_retries, urls)):
+                yield url, error, content
+        finally:
+            pool.terminate()
+
+    def request_pages(self, url, page_params):
+        """Yields a (params, error, content) tuple for each of the
+           page_params query parameter dicts as the request of its page
+           completes. Requests the pages concurrently with
+           request_with_retries, with at most page_fetch_window pages
+           requested or waiting to be yielded at once.
+        """
+        if not page_params:
+            return
+
+        completed = Queue.Queue()
+        def _request(params):
+            try:
+                error, content = self.request_with_retries(url, params)
+            except Exception, e:
+                error, content = "Error (%s) requesting %s?%s" % \
+                                 (e, url, urlencode(params, True)), None
+            completed.put((params, error, content))
+
+        page_params = iter(page_params)
+        pool = ThreadPool(self.page_fetch_window)
+        try:
+            outstanding = 0
+            for params in islice(page_params, self.page_fetch_window):
+                pool.apply_async(_request, (params,))
+                outstanding += 1
+            while outstanding:
+                # Wait with a timeout so that a keyboard interrupt gets
+                # through
+                try:
+                    result = completed.get(True, 1)
+                except Queue.Empty:
+                    continue
+                yield result
+                # Request the next page once this one has been processed
+                outstanding -= 1
+                for params in islice(page_params, 1):
+                    pool.apply_async(_request, (params,))
+                    outstanding += 1
+        finally:
+            pool.terminate()
+
+    def remaining_page_params(self, content):
+        """Returns the query parameters of every page of a set after the one
+           whose extracted content is content, to be requested concurrently
+           with request_pages, or None if they can not be known from the
+           page, in which case pages are requested one after another for as
+           long as request_records says there are more.
+
+           Returns None by default but can be overridden in child classes
+        """
+        return None
 
     def extract_content(self, content, url):
         """Calls extract_xml_content by default but can be overriden in
@@ -59,6 +202,50 @@ class AbsoluteURLFetcher(Fetcher):
             for record in records:
                 record["collection"] = collection
 
+    def request_set_records(self, url, set_id):
+        """Yields an (error, records) tuple for each batch of records that
+           request_records extracts from the pages of the set at url. Once
+           the first page gives remaining_page_params, the other pages are
+           requested concurrently with request_pages, and their records are
+           yielded as the pages complete.
+        """
+        request_more = True
+        page_params = None
+        while request_more:
+            error, content = self.request_content_from(
+                url, self.endpoint_url_params
+                )
+            print "requesting %s %s" % (url, self.endpoint_url_params)
+
+            if error is not None:
+                # Stop requesting from this set
+                yield error, []
+                return
+
+            error, content = self.extract_content(content, url)
+            if error is not None:
+                yield error, []
+                return
+
+            page_params = self.remaining_page_params(content)
+            for error, records, request_more in \
+                    self.request_records(content=content, set_id=set_id):
+                yield error, records
+            if page_params is not None:
+                break
+
+        for params, error, content in self.request_pages(url, page_params):
+            print "requested %s %s" % (url, params)
+            if error is None:
+                error, content = self.extract_content(content, url)
+            if error is not None:
+                # Go on to the other pages
+                yield error, []
+                continue
+            for error, records, request_more in \
+                    self.request_records(content=content, set_id=set_id):
+                yield error, records
+
     def fetch_all_data(self, set_id=None):
         """A generator to yield batches of records fetched, and any errors
            encountered in the process, via the self.response dicitonary.
@@ -97,60 +284,23 @@ class AbsoluteURLFetcher(Fetcher):
         # Request records for each set
         for set_id in self.collections.keys():
 
-            request_more = True
             if set_id:
                 url = self.endpoint_url.format(set_id)
             else:
                 url = self.endpoint_url
 
-            while request_more:
-
-                error, content = self.request_content_from(
-                    url, self.endpoint_url_params
-                    )
-                print "requesting %s %s" % (url, self.endpoint_url_params)
-
-                if error is not None:
-                    # Stop requesting from this set
-                    request_more = False
-                    self.response["errors"].append(error)
-                    continue
-
-                error, content = self.extract_content(content, url)
+            for error, records in self.request_set_records(url, set_id):
                 if error is not None:
-                    request_more = False
                     self.response["errors"].extend(iterify(error))
-                else:
-                    for error, records, request_more in \
-                            self.request_records(content=content,
-                                                 set_id=set_id):
-                        if error is not None:
-                            self.response["errors"].extend(iterify(error))
-                        if records:
-                            self.add_provider_to_item_records(records)
-                            self.add_collection_to_item_records(set_id,
-                                                                records)
-                            self.response["records"].extend(records)
-                        if len(self.response["records"]) >= self.batch_size:
-                            yield self.response
-                            self.reset_response()
+                if records:
+                    self.add_provider_to_item_records(records)
+                    self.add_collection_to_item_records(set_id, records)
+                    self.response["records"].extend(records)
+                if len(self.response["records"]) >= self.batch_size:
+                    yield self.response
+                    self.reset_response()
 
         # Last yield
         if self.response["errors"] or self.response["records"]:
             yield self.response
             self.reset_response()
-
-        # Retry fetches, if any
-        if self.retry:
-            print >> sys.stderr, "Retrying %s fetches..." % \
-                                 len(self.retry)
-            for error, records in self.retry_fetches():
-                self.response["errors"].extend(error)
-                self.response["records"].extend(records)
-
-                if len(self.response["records"]) >= self.batch_size:
-                    yield self.response
-                    self.reset_response()
-
-            if self.response["errors"] or self.response["records"]:
-                yield self.response
@@ -16,7 +16,7 @@ from dplaingestion.selector import exists
 from dplaingestion.selector import setprop
 from dplaingestion.selector import getprop as get_prop
 from dplaingestion.utilities import iterify, couch_id_builder
-import requests
+from dplaingestion import http_pool
 from requests import RequestException
 import re
 
@@ -43,6 +43,7 @@ class Fetcher(object):
         self.config = ConfigParser.ConfigParser()
         with open(config_file, "r") as f:
             self.config.readfp(f)
+        http_pool.configure_from(self.config)
 
         # Which OAI sets get added as collections
         self.sets = profile.get("sets")
@@ -77,13 +78,18 @@ class Fetcher(object):
         r = None
 
         try:
-            r = requests.get(url, params=params, headers=self.http_headers)
+            r = http_pool.get(url, params=params, headers=self.http_headers)
             r.raise_for_status()
             resp = r.text
-        except RequestException:
-            error = "Error (%s--%s) requesting %s?%s" % (r.status_code,
-                                                         r.reason, url,
+        except RequestException, e:
+            if r is None:
+                # No response, as on a connection error or timeout
+                error = "Error (%s) requesting %s?%s" % (e, url,
                                                          urlencode(params))
+            else:
+                error = "Error (%s--%s) requesting %s?%s" % (r.status_code,
+                                                             r.reason, url,
+                                                             urlencode(params))
         return error, resp
 
     def create_collection_records(self):
@@ -1,13 +1,48 @@
 import os
 import hashlib
 import fnmatch
+import multiprocessing
 from dplaingestion.utilities import couch_id_builder
 from dplaingestion.fetchers.fetcher import Fetcher, XML_PARSE
 
+# Number of files sent to a parsing process at a time
+FILE_PARSE_CHUNKSIZE = 16
+
+# The fetcher of a file parsing process (see _init_file_parser)
+_file_parser = None
+
+def _init_file_parser(fetcher):
+    global _file_parser
+    _file_parser = fetcher
+
+def _parse_file(filepath):
+    """Extracts all the records of the file at filepath with the fetcher of
+       this parsing process.
+
+       Returns a (filepath, errors, records, collections) tuple, collections
+       holding the collection records created for the file.
+    """
+    _file_parser.collections = {}
+    errors = []
+    records = []
+    try:
+        for file_errors, file_records in \
+                _file_parser.extract_records(filepath):
+            errors.extend(file_errors)
+            records.extend(file_records)
+    except Exception, e:
+        errors.append("Error parsing file %s: %s" % (filepath, e))
+    return filepath, errors, records, _file_parser.collections
+
 
 class FileFetcher(Fetcher):
     def __init__(self, profile, uri_base, config_file):
         self.collections = {}
+        # Number of processes parsing files at once; files are parsed in the
+        # fetching process if 1. Unless file_parse_ordered is false, records
+        # are yielded in the order of the files they come from.
+        self.file_parse_processes = profile.get("file_parse_processes", 1)
+        self.file_parse_ordered = profile.get("file_parse_ordered", True)
         super(FileFetcher, self).__init__(profile, uri_base, config_file)
 
     def extract_xml_content(self, filepath):
@@ -48,6 +83,55 @@ class FileFetcher(Fetcher):
                 "ingestType": "collection"
             }
 
+    def extract_all_records(self, path):
+        """Yields the (errors, records) tuples of extract_records for each
+           file under path that matches self.file_filter.
+        """
+        for (root, dirs, files) in os.walk(path):
+            filtered_files = fnmatch.filter(files, self.file_filter)
+            total_files = len(files)
+            file_count = 0
+            for filename in filtered_files:
+                file_count += 1
+                print ("Fetching from %s (file %s of %s)" %
+                       (filename, file_count, total_files))
+                filepath = os.path.join(root, filename)
+                for errors, records in self.extract_records(filepath):
+                    yield errors, records
+
+    def extract_all_records_in_parallel(self, path):
+        """Like extract_all_records, but parses the files in a pool of
+           self.file_parse_processes processes. Yields one (errors, records)
+           tuple per file, and adds the collection records created for it
+           to self.collections.
+
+           A file's records are all returned at once, so this suits
+           providers with many small files rather than a few big ones.
+        """
+        def _filepaths():
+            for (root, dirs, files) in os.walk(path):
+                for filename in fnmatch.filter(files, self.file_filter):
+                    yield os.path.join(root, filename)
+
+        pool = multiprocessing.Pool(self.file_parse_processes,
+                                    _init_file_parser, (self,))
+        if self.file_parse_ordered:
+            results = pool.imap(_parse_file, _filepaths(),
+                                FILE_PARSE_CHUNKSIZE)
+        else:
+            results = pool.imap_unordered(_parse_file, _filepaths(),
+                                          FILE_PARSE_CHUNKSIZE)
+        try:
+            file_count = 0
+            for filepath, errors, records, collections in results:
+                file_count += 1
+                print "Fetched from %s (file %s)" % (filepath, file_count)
+                for hid, collection in collections.iteritems():
+                    self.collections.setdefault(hid, collection)
+                yield errors, records
+        finally:
+            pool.terminate()
+
     def fetch_all_data(self, set=None):
         """A generator to yield batches of records fetched, and any errors
            encountered in the process, via the self.response dicitonary.
@@ -58,24 +142,18 @@ class FileFetcher(Fetcher):
         # file:/path/to/files/
         if self.endpoint_url.startswith("file:/"):
             path = self.endpoint_url[5:]
-            for (root, dirs, files) in os.walk(path):
-                filtered_files = fnmatch.filter(files, self.file_filter)
-                total_files = len(files)
-                file_count = 0
-                for filename in fnmatch.filter(files, self.file_filter):
-                    file_count += 1
-                    print ("Fetching from %s (file %s of %s)" %
-                           (filename, file_count, total_files))
-                    filepath = os.path.join(root, filename)
-                    for errors, records in self.extract_records(filepath):
-                        self.response["errors"].extend(errors)
-                        self.add_provider_to_item_records(records)
-                        self.response["records"].extend(records)
-                        # Yield when response["records"] reaches
-                        # self.batch_size
-                        if len(self.response["records"]) >= self.batch_size:
-                            yield self.response
-                            self.reset_response()
+            if self.file_parse_processes > 1:
+                extracted = self.extract_all_records_in_parallel(path)
+            else:
+                extracted = self.extract_all_records(path)
+            for errors, records in extracted:
+                self.response["errors"].extend(errors)
+                self.add_provider_to_item_records(records)
+                self.response["records"].extend(records)
+                # Yield when response["records"] reaches self.batch_size
+                if len(self.response["records"]) >= self.batch_size:
+                    yield self.response
+                    self.reset_response()
             # Last yield
             if self.response["errors"] or self.response["records"]:
                 yield self.response
@@ -1,81 +1,104 @@
-import itertools as it
+from collections import OrderedDict
+from xml.etree import cElementTree as ET
+from dplaingestion.utilities import iterify
 from dplaingestion.fetchers.file_fetcher import FileFetcher
 
 
+def local_name(tag):
+    """Returns tag without its "{namespace}" prefix, if any"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def element_to_dict(elem):
+    """Returns the ElementTree element elem as XML_PARSE parses an element:
+       attributes and child elements keyed by name, children with the same
+       name in a list, and any text under "#text", or just the text for an
+       element with no attributes or children.
+    """
+    item = OrderedDict()
+    for name, value in elem.attrib.items():
+        item[local_name(name)] = value
+
+    text = [elem.text or ""]
+    for child in elem:
+        key = local_name(child.tag)
+        value = element_to_dict(child)
+        if key not in item:
+            item[key] = value
+        elif isinstance(item[key], list):
+            item[key].append(value)
+        else:
+            item[key] = [item[key], value]
+        text.append(child.tail or "")
+    text = "".join(text).strip() or None
+
+    if not item:
+        return text
+    if text is not None:
+        item["#text"] = text
+    return item
+
+
+def iter_xml_items(f, tag):
+    """Yields each tag element that is a child of the root element of the
+       XML file object f, as a dictionary (see element_to_dict), parsing the
+       file incrementally. Each element is freed once it has been yielded,
+       so that memory use does not grow with the size of the file.
+    """
+    root = None
+    depth = 0
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = elem
+            continue
+
+        depth -= 1
+        if depth == 1 and local_name(elem.tag) == tag:
+            yield element_to_dict(elem)
+            # Drop the element and its parsed predecessors from the tree
+            elem.clear()
+            root.clear()
+
+
 class HathiFetcher(FileFetcher):
     def __init__(self, profile, uri_base, config_file):
         self.file_filter = "*.xml"
         super(HathiFetcher, self).__init__(profile, uri_base, config_file)
 
-    def parse(self, grouped_records, file):
-        error = None
-        try:
-            parsed_xml = XML_PARSE("<group_records>\n<record>\n" + \
-                                   "<record>\n".join(grouped_records) + \
-                                   "</group_records>")
-            parsed_docs = parsed_xml["group_records"]["record"]
-            if not isinstance(parsed_docs, list):
-                parsed_docs = [parsed_docs]
-        except Exception, e:
-            error = "Error parsing grouped records from file %s: %s" % \
-                    (file, e)
-            parsed_docs = None
-
-        return error, parsed_docs
-
     def extract_xml_content(self, filepath):
-        error = None
-
-        # Read in every self.batch_size docs
-        grouped_records = []
-        with open(filepath, "r") as f:
-            first_group = True
-            for key, group in it.groupby(f, lambda line:
-                                         line.startswith("<record>")):
-                if not key:
-                    try:
-                        grouped_records.append("".join(list(group)))
-                        if first_group:
-                            # First item is not a record
-                            grouped_records = grouped_records[1:]
-                            first_group = False
-                        
-                        if len(grouped_records) == self.batch_size:
-                            if "</collection>" in grouped_records[-1]:
-                                # Strip "</collection>" from last item
-                                last_record = grouped_records[-1].split("</collection>")[0]
-                                grouped_records[-1] = last_record
-
-                            error, parsed_docs = self.parse(grouped_records,
-                                                            filepath)
-                            yield error, parsed_docs
-                            grouped_records = []
-                    except Exception, e:
-                        error = "Error grouping records from file %s: %s" % \
-                                (filepath, e)
-                        yield error, None
-                        break
+        """Yields an (error, records) tuple for every self.batch_size
+           <record> elements in the MARC XML file at filepath, streaming
+           them from the file.
+        """
+        records = []
+        with open(filepath, "rb") as f:
+            try:
+                for record in iter_xml_items(f, "record"):
+                    records.append(record)
+                    if len(records) == self.batch_size:
+                        yield None, records
+                        records = []
+            except Exception, e:
+                error = "Error parsing records from file %s: %s" % \
+                        (filepath, e)
+                yield error, records
+                return
         # Last yield
-        if grouped_records:
-            if first_group:
-                # First item is not a record
-                grouped_records = grouped_records[1:]
-            # Strip "</collection>" from last item
-            last_record = grouped_records[-1].split("</collection>")[0]
-            grouped_records[-1] = last_record
-            error, parsed_docs = self.parse(grouped_records, filepath)
-            yield error, parsed_docs
+        if records:
+            yield None, records
 
     def extract_records(self, file_path):
         errors = []
 
         for error, records in self.extract_xml_content(file_path):
-            if error is None:
-                for record in records:
-                    if record["controlfield"][0]["tag"] == "001":
-                        record["_id"] = record["controlfield"][0]["#text"]
-            else:
+            if error is not None:
                 errors.append(error)
+            for record in records:
+                controlfields = iterify(record.get("controlfield", []))
+                if controlfields and controlfields[0]["tag"] == "001":
+                    record["_id"] = controlfields[0]["#text"]
 
             yield errors, records
             errors = []
@@ -1,15 +1,14 @@
 import json
 import hashlib
-from urllib import urlencode
 from dplaingestion.utilities import iterify, couch_id_builder
-from dplaingestion.fetchers.fetcher import Fetcher, getprop
+from dplaingestion.fetchers.fetcher import getprop
+from dplaingestion.fetchers.absolute_url_fetcher import AbsoluteURLFetcher
 
 
-class MDLAPIFetcher(Fetcher):
+class MDLAPIFetcher(AbsoluteURLFetcher):
     def __init__(self, profile, uri_base, config_file):
         super(MDLAPIFetcher, self).__init__(profile, uri_base, config_file)
         self.total_records = None
-        self.endpoint_url_params = profile.get("endpoint_url_params")
 
     def extract_content(self, content, url):
         error = None
@@ -54,58 +53,46 @@ class MDLAPIFetcher(Fetcher):
         error, records = self.mdl_extract_records(content)
         if error:
             error = "Error at index %s: %s" % \
-                    (self.endpoint_url_params["start"],
-                     error)
-
-            # Go on to the next start point
-            bulk_size = self.endpoint_url_params["per_page"]
-            self.endpoint_url_params["start"] += bulk_size
-        else:
-            self.endpoint_url_params["start"] += len(records)
-            print "Fetched %s of %s" % (self.endpoint_url_params["start"],
-                                        self.total_records)
-        request_more = (int(self.total_records) >
-                        int(self.endpoint_url_params["start"]))
+                    (getprop(content, "start"), error)
+        request_more = False
 
         yield error, records, request_more
 
+    def remaining_page_params(self, content):
+        """Returns the query parameters of the pages after the first one,
+           with content, up to self.total_records. Pages hold per_page
+           records, or as many as the first page if per_page is not set.
+        """
+        start = int(self.endpoint_url_params.get("start", 0))
+        per_page = self.endpoint_url_params.get("per_page") or \
+                   len(iterify(getprop(content, "docs") or []))
+        if not per_page:
+            return []
+        return [dict(self.endpoint_url_params, start=page_start) for
+                page_start in range(start + int(per_page),
+                                    int(self.total_records or 0),
+                                    int(per_page))]
+
     def fetch_all_data(self, set):
         """A generator to yield batches of records fetched, and any errors
            encountered in the process, via the self.response dictonary.
-        """
-
-        request_more = True
-        while request_more:
 
-            error, content = self.request_content_from(
-                self.endpoint_url, self.endpoint_url_params
-                )
-            print "Requesting %s?%s" % (self.endpoint_url,
-                                        urlencode(self.endpoint_url_params,
-                                                  True))
-
-            if error is not None:
-                # Stop requesting from this set
-                request_more = False
-                self.response["errors"].append(error)
-                break
-
-            error, content = self.extract_content(content,
-                                                      self.endpoint_url)
+           Once the first page gives the total number of records, the other
+           pages are requested concurrently (see request_pages).
+        """
+        for error, records in self.request_set_records(self.endpoint_url,
+                                                       None):
             if error is not None:
-                request_more = False
                 self.response["errors"].extend(iterify(error))
-            else:
-                for error, records, request_more in \
-                        self.request_records(content):
-                    if error is not None:
-                        self.response["errors"].extend(iterify(error))
-                    self.add_provider_to_item_records(records)
-                    self.add_collection_to_item_records(records)
-                    self.response["records"].extend(records)
-                    if len(self.response["records"]) >= self.batch_size:
-                        yield self.response
-                        self.reset_response()
+            if records:
+                self.add_provider_to_item_records(records)
+                self.add_collection_to_item_records(records)
+                self.response["records"].extend(records)
+                print "Fetched %s more of %s" % (len(records),
+                                                 self.total_records)
+            if len(self.response["records"]) >= self.batch_size:
+                yield self.response
+                self.reset_response()
 
         # Last yield
         self.add_collection_records_to_response()
@@ -1,6 +1,7 @@
+from itertools import izip
 from dplaingestion.selector import exists
 from dplaingestion.utilities import iterify
-from dplaingestion.fetchers.fetcher import getprop
+from dplaingestion.fetchers.fetcher import getprop, XML_PARSE
 from dplaingestion.fetchers.absolute_url_fetcher import AbsoluteURLFetcher
 
 
@@ -61,24 +62,32 @@ class NYPLFetcher(AbsoluteURLFetcher):
                         "is not 200 for request to URL %s" % url
         return error, content
 
+    def remaining_page_params(self, content):
+        """Returns the query parameters of the pages after the page of
+           content, up to its request/totalPages
+        """
+        current_page = int(getprop(content, "request/page") or 1)
+        total_pages = int(getprop(content, "request/totalPages") or 1)
+        return [dict(self.endpoint_url_params, page=page) for page in
+                range(current_page + 1, total_pages + 1)]
+
     def request_records(self, content, set_id):
-        self.endpoint_url_params["page"] += 1
         error = None
         total_pages = getprop(content, "request/totalPages")
         current_page = getprop(content, "request/page")
-        request_more = total_pages != current_page
-        if not request_more:
-            # Reset the page for the next collection
-            self.endpoint_url_params["page"] = 1
+        # The other pages are requested by request_set_records
+        request_more = False
 
         records = []
-        items = getprop(content, "response/capture")
+        items = iterify(getprop(content, "response/capture"))
         count = 0
 
-        for item in iterify(items):
+        # Request the items' details concurrently, in order
+        record_urls = [self.get_records_url.format(item["uuid"])
+                       for item in items]
+        for item, (record_url, error, content) in \
+                izip(items, self.request_details(record_urls)):
             count += 1
-            record_url = self.get_records_url.format(item["uuid"])
-            error, content = self.request_content_from(record_url)
             if error is None:
                 error, content = self.extract_content(content, record_url)
 
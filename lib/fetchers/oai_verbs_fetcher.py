@@ -6,8 +6,23 @@ from dplaingestion.fetchers.fetcher import Fetcher, getprop
 class OAIVerbsFetcher(Fetcher):
     def __init__(self, profile, uri_base, config_file):
         self.metadata_prefix = profile.get("metadata_prefix")
+        # The date from which records are requested when the provider is
+        # harvested incrementally (see fetch_records.py)
+        self.harvest_from = None
+        # How far the fetch has got, as of the last response yielded by
+        # fetch_all_data: whether the collection records were yielded, and
+        # for each set the resumption token of its next page, the number of
+        # pages fetched and whether it is complete
+        self.checkpoint = {"collections_fetched": False, "sets": {}}
         super(OAIVerbsFetcher, self).__init__(profile, uri_base, config_file)
 
+    def resume_from(self, checkpoint):
+        """Makes fetch_all_data carry on from checkpoint, a self.checkpoint
+           saved from an earlier fetch, skipping the complete sets and
+           requesting the others from their saved resumption tokens.
+        """
+        self.checkpoint = checkpoint
+
     def list_sets(self):
         """Requests all sets via the ListSets verb"""
         list_set_content = None
@@ -61,7 +76,8 @@ class OAIVerbsFetcher(Fetcher):
 
            Returns an (error, records_content) tuple where error is None if the
            request succeeds, the requested content is not empty and is
-           parseable, and records is a dictionary with key "items".
+           parseable, and records is a dictionary with key "items", and key
+           "deleted" for the identifiers of the records deleted.
         """
         records_content = {}
         list_records_url = self.uri_base + "/dpla-list-records?endpoint=" + url
@@ -127,21 +143,26 @@ class OAIVerbsFetcher(Fetcher):
         """A generator to yield batches (responses) of records fetched, and any
            errors encountered in the process, via the self.response dicitonary.
 
-           Records can be for collections or items.
+           Records can be for collections or items. In an incremental harvest
+           (see list_records), the identifiers of the records deleted are
+           listed under the response's "deleted" key.
 
            one_set is ignored for now.
         """
         # Set self.collections
         self.set_collections()
 
-        # Create records of ingestType "collection"
+        # Create records of ingestType "collection", unless they were
+        # fetched before resuming
         if self.collections and any(self.collections.values()):
             self.create_collection_records()
-            self.response["records"].extend([v.copy() for v in
-                                             self.collections.values()])
-            if len(self.response["records"]) >= self.batch_size:
-                yield self.response
-                self.reset_response()
+            if not self.checkpoint["collections_fetched"]:
+                self.response["records"].extend([v.copy() for v in
+                                                 self.collections.values()])
+                self.checkpoint["collections_fetched"] = True
+                if len(self.response["records"]) >= self.batch_size:
+                    yield self.response
+                    self.reset_response()
             # Now that self.collections.values has been added to the
             # response, let's remove the "_id" and "ingesType" fields since
             # we'll be using the values for each item record's collection
@@ -152,6 +173,14 @@ class OAIVerbsFetcher(Fetcher):
 
         # Fetch all records for each set
         for set in self.collections.keys():
+            set_checkpoint = self.checkpoint["sets"].setdefault(set, {
+                "resumption_token": None,
+                "pages": 0,
+                "complete": False
+            })
+            if set_checkpoint["complete"]:
+                print "Skipping set %s, fetched before resuming" % set
+                continue
             print "Fetching records for set " + set
 
             # Set initial params
@@ -167,6 +196,17 @@ class OAIVerbsFetcher(Fetcher):
             if self.metadata_prefix is not None:
                 params["metadataPrefix"] = self.metadata_prefix
 
+            # Only request the records added, changed or deleted since the
+            # last harvest, if harvesting incrementally
+            if self.harvest_from:
+                params["frm"] = self.harvest_from
+
+            if set_checkpoint["resumption_token"]:
+                print "Resuming set %s after %s pages" % \
+                      (set, set_checkpoint["pages"])
+                params["resumption_token"] = \
+                    set_checkpoint["resumption_token"]
+
             # Request records until a resumption token is not received
             while request_more:
                 # Send request
@@ -180,19 +220,26 @@ class OAIVerbsFetcher(Fetcher):
                     self.add_provider_to_item_records(content["items"])
                     self.add_collection_to_item_records(content["items"])
                     self.response["records"].extend(content["items"])
+                    if content.get("deleted"):
+                        self.response.setdefault("deleted", []).extend(
+                            content["deleted"])
+                    set_checkpoint["pages"] += 1
                     # Get resumption token
                     resumption_token = content.get("resumption_token")
                     if (resumption_token is not None and
                         len(resumption_token) > 0):
                         # Add resumption token
                         params["resumption_token"] = resumption_token
+                        set_checkpoint["resumption_token"] = resumption_token
                     else:
                         request_more = False
+                        set_checkpoint["complete"] = True
 
                 if len(self.response["records"]) >= self.batch_size:
                     yield self.response
                     self.reset_response()
 
         # Last yield
-        if self.response["errors"] or self.response["records"]:
+        if self.response["errors"] or self.response["records"] or \
+           self.response.get("deleted"):
             yield self.response
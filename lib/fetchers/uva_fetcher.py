@@ -39,23 +39,25 @@ class UVAFetcher(AbsoluteURLFetcher):
     def uva_request_records(self, content):
         error = None
 
+        urls = []
         for item in content["mets:mets"]:
             if "mets:dmdSec" in item:
                 records = content["mets:mets"][item]
                 for rec in records:
                     if not rec["ID"].startswith("collection-description-mods"):
-                        url = rec["mets:mdRef"]["xlink:href"]
-                        error, cont = self.request_content_from(url)
-                        if error is not None:
-                            yield error, cont
-                        else:
-                            error, cont = self.extract_content(cont, url)
-                            if error is not None:
-                                yield error, cont
-                            else:
-                                for error, recs in \
-                                    self.uva_extract_records(cont, url):
-                                    yield error, recs
+                        urls.append(rec["mets:mdRef"]["xlink:href"])
+
+        # Request the records concurrently, in order
+        for url, error, cont in self.request_details(urls):
+            if error is not None:
+                yield error, cont
+            else:
+                error, cont = self.extract_content(cont, url)
+                if error is not None:
+                    yield error, cont
+                else:
+                    for error, recs in self.uva_extract_records(cont, url):
+                        yield error, recs
 
     def request_records(self, content, set_id=None):
         # UVA will not use the request_more flag
@@ -0,0 +1,161 @@
+"""
+A local gazetteer of places, read from a memory-mapped file.
+
+The file has one place per line, with these tab-separated UTF-8 fields:
+
+    id, name, woe type, latitude, longitude, parent id, alternate names
+
+The woe type is the Where On Earth type that Twofishes gives a feature (7 for
+a town, 8 for a state, 9 for a county, 12 for a country). Latitude, longitude
+and the parent id may be empty, and the alternate names (such as "CA" or
+"Calif." for California) are separated by "|". Places whose names are the
+same are preferred in the order of the file.
+
+Only an index of the names, ids and coordinates of the places is held in
+memory; the places themselves are read from the file when they are looked up.
+"""
+import re
+import math
+import mmap
+from collections import namedtuple
+
+WOE_TOWN = 7
+
+GazetteerPlace = namedtuple("GazetteerPlace", ["id", "name", "woe_type",
+                                               "lat", "lng", "parent_id"])
+
+
+def normalize_name(name):
+    """Returns name folded to lower case, without punctuation and with its
+       whitespace collapsed, as the gazetteer indexes names
+    """
+    if isinstance(name, str):
+        name = name.decode("utf-8", "ignore")
+    name = re.sub(r"[^\w\s]", " ", name, flags=re.UNICODE)
+    return " ".join(name.lower().split())
+
+
+class Gazetteer(object):
+    """Looks places up by name (forward) or by coordinates (reverse).
+
+       Reverse lookups find the nearest town within max_distance kilometers,
+       searching a grid of cells of cell_size degrees.
+    """
+
+    def __init__(self, path, max_distance=25, cell_size=1.0):
+        self.max_distance = max_distance
+        self.cell_size = cell_size
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._by_name = {}
+        self._by_id = {}
+        self._grid = {}
+        self._index()
+
+    def _index(self):
+        """Indexes the offset of every place in the file by name, by id and,
+           for towns, by grid cell
+        """
+        offset = 0
+        size = self._data.size()
+        while offset < size:
+            fields = self._fields_at(offset)
+            if len(fields) >= 6 and fields[0]:
+                self._by_id[fields[0]] = offset
+                for name in self._names(fields):
+                    offsets = self._by_name.setdefault(name, [])
+                    if offset not in offsets:
+                        offsets.append(offset)
+                if int(fields[2]) == WOE_TOWN and fields[3] and fields[4]:
+                    cell = self._cell(float(fields[3]), float(fields[4]))
+                    self._grid.setdefault(cell, []).append(offset)
+            offset = self._line_end(offset) + 1
+
+    def _line_end(self, offset):
+        end = self._data.find("\n", offset)
+        return end if end != -1 else self._data.size()
+
+    def _fields_at(self, offset):
+        """Returns the fields of the line of the file at offset"""
+        line = self._data[offset:self._line_end(offset)]
+        return line.rstrip("\r").decode("utf-8").split("\t")
+
+    def _names(self, fields):
+        """Returns the normalized name and alternate names in fields"""
+        names = [fields[1]]
+        if len(fields) > 6 and fields[6]:
+            names.extend(fields[6].split("|"))
+        return [normalize_name(name) for name in names]
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lng / self.cell_size)))
+
+    def _place_at(self, offset):
+        fields = self._fields_at(offset)
+        return GazetteerPlace(fields[0], fields[1], int(fields[2]),
+                              float(fields[3]) if fields[3] else None,
+                              float(fields[4]) if fields[4] else None,
+                              fields[5] or None)
+
+    def get(self, place_id):
+        """Returns the place with the given id, or None"""
+        offset = self._by_id.get(place_id)
+        return self._place_at(offset) if offset is not None else None
+
+    def ancestors(self, place):
+        """Returns the places that contain place, the nearest first"""
+        rv = []
+        parent = self.get(place.parent_id) if place.parent_id else None
+        while parent is not None and parent not in rv:
+            rv.append(parent)
+            parent = self.get(parent.parent_id) if parent.parent_id else None
+        return rv
+
+    def find(self, name, context=()):
+        """Returns the place named name, or None if there is none.
+
+           Of the places with that name, the one with the most ancestors
+           named in context (such as the state of a town) is returned.
+        """
+        offsets = self._by_name.get(normalize_name(name))
+        if not offsets:
+            return None
+        context = set(normalize_name(c) for c in context if c)
+        best, best_score = None, -1
+        for offset in offsets:
+            place = self._place_at(offset)
+            score = 0
+            if context:
+                names = set()
+                for ancestor in self.ancestors(place):
+                    names.update(self._names(
+                        self._fields_at(self._by_id[ancestor.id])))
+                score = len(context & names)
+            if score > best_score:
+                best, best_score = place, score
+        return best
+
+    def nearest(self, lat, lng):
+        """Returns the town nearest to the coordinates, or None if there is
+           none within max_distance kilometers
+        """
+        row, col = self._cell(lat, lng)
+        best, best_distance = None, self.max_distance
+        for cell in [(r, c) for r in (row - 1, row, row + 1)
+                     for c in (col - 1, col, col + 1)]:
+            for offset in self._grid.get(cell, []):
+                place = self._place_at(offset)
+                d = distance(lat, lng, place.lat, place.lng)
+                if d <= best_distance:
+                    best, best_distance = place, d
+        return best
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """Returns the distance in kilometers between two points, approximated
+       as on a plane, which is close enough over the span of a grid cell
+    """
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371 * math.sqrt(x * x + y * y)
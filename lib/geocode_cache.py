@@ -0,0 +1,135 @@
+"""
+A two-tier cache of geocoder results: a least recently used cache in the
+process, in front of an SQLite database that the processes of every Akara
+worker share.
+
+Each result expires after a time to live. Empty results, for places that the
+geocoder could not find, are cached too, but expire sooner.
+"""
+import os
+import re
+import time
+import sqlite3
+import threading
+from urllib import urlencode
+from akara import logger
+from amara.thirdparty import json
+from dplaingestion.lru_cache import LRUCache
+
+# Results are kept for 30 days, places not found for one day
+TTL = 30 * 24 * 60 * 60
+NEGATIVE_TTL = 24 * 60 * 60
+MAXSIZE = 10000
+
+
+def cache_key(params):
+    """Returns the cache key for the geocoder request params: the params in
+       order, with the "query" case-folded and its whitespace collapsed
+    """
+    params = dict(params)
+    if params.get("query"):
+        params["query"] = re.sub(r"\s+", " ", params["query"]).strip().lower()
+    return urlencode(sorted(params.items()))
+
+
+class GeocodeCache(object):
+    """Maps cache keys (see cache_key) to geocoder results, in memory and,
+       if path is given, in the SQLite database at path. Counts the hits in
+       each tier, the misses and the hits on empty results.
+
+       The cache may be used by several threads at once.
+    """
+
+    def __init__(self, path=None, maxsize=MAXSIZE, ttl=TTL,
+                 negative_ttl=NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(maxsize)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # sqlite3 connections can not be shared between threads, or
+        # processes forked by Akara
+        self._local = threading.local()
+
+    def _db(self):
+        """Returns this thread's connection to the database, or None if the
+           cache is not kept on disk
+        """
+        if not self.path:
+            return None
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("CREATE TABLE IF NOT EXISTS geocode "
+                       "(key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            db.commit()
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        """Returns the result cached for key, or None if there is none or it
+           has expired
+        """
+        now = time.time()
+        cached = self.memory.get(key)
+        if cached is not None and cached[1] >= now:
+            self._count("memory_hits")
+        else:
+            cached = None
+            try:
+                db = self._db()
+                row = db and db.execute(
+                    "SELECT value, expires FROM geocode WHERE key = ?",
+                    (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.error("Could not read geocode cache %s: %s" %
+                             (self.path, e))
+                row = None
+            if row and row[1] >= now:
+                cached = (json.loads(row[0]), row[1])
+                self.memory.put(key, cached)
+                self._count("disk_hits")
+
+        if cached is None:
+            self._count("misses")
+            return None
+        if not cached[0]:
+            self._count("negative_hits")
+        return cached[0]
+
+    def put(self, key, value):
+        """Caches the result value for key; an empty value means that the
+           geocoder found nothing
+        """
+        expires = time.time() + (self.ttl if value else self.negative_ttl)
+        self.memory.put(key, (value, expires))
+        try:
+            db = self._db()
+            if db:
+                db.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)",
+                           (key, json.dumps(value), expires))
+                db.commit()
+        except sqlite3.Error as e:
+            logger.error("Could not write geocode cache %s: %s" %
+                         (self.path, e))
+
+    def stats(self):
+        """Returns the hit and miss counts and the hit rate"""
+        with self._lock:
+            stats = {"memory_hits": self.memory_hits,
+                     "disk_hits": self.disk_hits,
+                     "negative_hits": self.negative_hits,
+                     "misses": self.misses}
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = float(hits) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,153 @@
+"""
+Pooled HTTP sessions shared by the fetchers, the OAI client and the geocoder
+
+Every request made through get() in a process goes through one
+requests.Session, so that connections to a host are kept open and reused
+between requests instead of being opened for each of them. The session asks
+for gzip or deflate compressed responses, and every request times out after
+TIMEOUT seconds unless given its own timeout.
+
+The fetchers configure the session from the [HTTP] section of akara.ini (see
+configure_from()). In the Akara server processes, it is configured from the
+http_pool section of akara.conf when it is first used.
+"""
+import os
+import threading
+import requests
+import akara
+from requests.adapters import HTTPAdapter
+
+# Connections kept open per host, and hosts kept in the pool
+POOL_SIZE = 10
+# Seconds before a request times out
+TIMEOUT = 60
+HEADERS = {"Accept-Encoding": "gzip, deflate"}
+
+_session = None
+_session_pid = None
+_adapter = None
+_lock = threading.Lock()
+_pool_size = POOL_SIZE
+_timeout = TIMEOUT
+# Whether the session has been configured from akara.ini or akara.conf
+_configured = False
+
+
+def configure(pool_size=None, timeout=None):
+    """Sets the pool size and the default timeout of the shared session,
+       replacing the session if its pool size changes.
+    """
+    global _pool_size, _timeout, _session, _adapter
+    with _lock:
+        if timeout is not None:
+            _timeout = timeout
+        if pool_size is not None and pool_size != _pool_size:
+            _pool_size = pool_size
+            _session = _adapter = None
+
+
+def require_pool_size(pool_size):
+    """Grows the pool of the shared session to at least pool_size
+       connections per host.
+    """
+    if pool_size > _pool_size:
+        configure(pool_size=pool_size)
+
+
+def configure_from(config):
+    """Configures the shared session from the optional HTTP section of a
+       ConfigParser config (PoolSize, Timeout).
+    """
+    global _configured
+    _configured = True
+    if not config.has_section("HTTP"):
+        return
+    pool_size = timeout = None
+    if config.has_option("HTTP", "PoolSize"):
+        pool_size = config.getint("HTTP", "PoolSize")
+    if config.has_option("HTTP", "Timeout"):
+        timeout = config.getfloat("HTTP", "Timeout")
+    configure(pool_size, timeout)
+
+
+def configure_from_module_config(config):
+    """Configures the shared session from the http_pool section of akara.conf
+       (pool_size, timeout), which setup.py fills in from the [HTTP] section
+       of akara.ini. Options missing from akara.ini, whose "${HTTP__...}"
+       tokens setup.py leaves as they are, keep their defaults.
+    """
+    global _configured
+    _configured = True
+    settings = []
+    for name, convert in (("pool_size", int), ("timeout", float)):
+        try:
+            settings.append(convert(config.get(name)))
+        except (TypeError, ValueError):
+            settings.append(None)
+    configure(*settings)
+
+
+def get_session():
+    """Returns the session shared by this process, creating it on first use
+       and again in a forked child, which must not share the parent's
+       connections.
+    """
+    global _session, _session_pid, _adapter
+    if not _configured and akara.raw_config is not None:
+        # In an Akara server process
+        configure_from_module_config(akara.module_config(__name__))
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _adapter = HTTPAdapter(pool_connections=_pool_size,
+                                   pool_maxsize=_pool_size)
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+            _session.mount("http://", _adapter)
+            _session.mount("https://", _adapter)
+            _session_pid = os.getpid()
+        return _session
+
+
+def get(url, params=None, headers=None, timeout=None, **kwargs):
+    """Makes a GET request with the shared session, timing out after the
+       configured timeout unless timeout is given.
+
+       Returns the requests.Response, or raises requests.RequestException
+    """
+    if timeout is None:
+        timeout = _timeout
+    return get_session().get(url, params=params, headers=headers,
+                             timeout=timeout, **kwargs)
+
+
+def connection_stats():
+    """Returns a dictionary mapping each host in the pool to the number of
+       requests made to it, the connections opened for them and the requests
+       that reused an open connection.
+    """
+    with _lock:
+        if _adapter is None or _session_pid != os.getpid():
+            return {}
+        pools = _adapter.poolmanager.pools
+        conn_pools = [pools[key] for key in pools.keys()]
+
+    stats = {}
+    for conn_pool in conn_pools:
+        host = "%s://%s:%s" % (conn_pool.scheme, conn_pool.host,
+                               conn_pool.port)
+        host_stats = stats.setdefault(host, {"requests": 0, "connections": 0})
+        host_stats["requests"] += conn_pool.num_requests
+        host_stats["connections"] += conn_pool.num_connections
+    for host_stats in stats.values():
+        host_stats["reused"] = max(host_stats["requests"] -
+                                   host_stats["connections"], 0)
+    return stats
+
+
+def format_connection_stats():
+    """Returns connection_stats() as lines of text, one per host"""
+    lines = []
+    for host, s in sorted(connection_stats().items()):
+        lines.append("%s: %d requests, %d connections, %d reused" %
+                     (host, s["requests"], s["connections"], s["reused"]))
+    return "\n".join(lines)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import re
+from collections import Mapping
 
 ISO639_3_1 = {
 "sbk": u"Safwa",
@@ -8137,12 +8138,40 @@ ISO639_3_2 = {
 
 ISO639_3_SUBST = dict(ISO639_3_1, **ISO639_3_2)
 
-EXACT_LANGUAGE_NAME_REGEXES = {
-    k: re.compile(ur'^{0}$'.format(re.escape(v)), re.I) for
-    (k, v) in ISO639_3_SUBST.items()
-}
+class LanguageNameRegexes(Mapping):
+    """Maps each code of ISO639_3_SUBST to a case-insensitive regex for its
+       language name built from pattern. Each regex is compiled the first time
+       it is used rather than on import, which compiling all of them would
+       slow down by most of a second.
 
-WB_LANGUAGE_NAME_REGEXES = {
-    k: re.compile(ur'\b{0}\b'.format(re.escape(v)), re.I) for
-    (k, v) in ISO639_3_SUBST.items()
-}
+       Iterates over the codes in the same order as a dictionary built from
+       ISO639_3_SUBST.items().
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._codes = None
+        self._regexes = {}
+
+    def __getitem__(self, iso_code):
+        regex = self._regexes.get(iso_code)
+        if regex is None:
+            name = ISO639_3_SUBST[iso_code]
+            regex = re.compile(self.pattern.format(re.escape(name)), re.I)
+            self._regexes[iso_code] = regex
+        return regex
+
+    def __iter__(self):
+        if self._codes is None:
+            self._codes = list({k: None for (k, v) in ISO639_3_SUBST.items()})
+        return iter(self._codes)
+
+    def __len__(self):
+        return len(ISO639_3_SUBST)
+
+    def __contains__(self, iso_code):
+        return iso_code in ISO639_3_SUBST
+
+EXACT_LANGUAGE_NAME_REGEXES = LanguageNameRegexes(ur'^{0}$')
+
+WB_LANGUAGE_NAME_REGEXES = LanguageNameRegexes(ur'\b{0}\b')
@@ -0,0 +1,79 @@
+"""
+A bounded, thread-safe least recently used cache
+"""
+import threading
+import functools
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """Maps keys to values, dropping the least recently used key once more
+       than maxsize keys are held. Counts hits and misses.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Returns the hit and miss counts and the hit rate"""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0}
+
+
+def memoize(cache):
+    """Returns a decorator that caches the results of a function of one
+       hashable argument in cache, an LRUCache. The decorated function keeps
+       the cache as its cache attribute and the function itself as its
+       uncached attribute.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(arg):
+            value = cache.get(arg, _MISSING)
+            if value is _MISSING:
+                value = func(arg)
+                cache.put(arg, value)
+            return value
+        wrapper.cache = cache
+        wrapper.uncached = func
+        return wrapper
+    return decorator
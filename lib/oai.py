@@ -7,9 +7,10 @@ oaiservice class, for listing OAI sets and records
 import sys
 import time, logging
 import urllib
-import urllib2
+from requests import HTTPError, RequestException
 from amara.pushtree import pushtree
 from akara import logger
+from dplaingestion import http_pool
 from dplaingestion.utilities import iterify
 import xmltodict
 from dplaingestion.selector import getprop
@@ -109,6 +110,16 @@ class OAIParseError(Exception):
     pass
 
 
+def _request_content(url):
+    """Returns the body of the response to a GET request for url, made with
+       the shared connection pool. Raises requests.HTTPError for an error
+       status and requests.RequestException if the request fails.
+    """
+    r = http_pool.get(url)
+    r.raise_for_status()
+    return r.content
+
+
 class oaiservice(object):
     """
     Class for listing OAI sets and records
@@ -145,13 +156,12 @@ class oaiservice(object):
             self.logger.debug('OAI request URL: {0}'.format(url))
             start_t = time.time()
             try:
-                content = urllib2.urlopen(url).read()
-            except urllib2.URLError as e:
-                raise OAIHTTPError("list_sets could not make request: %s" % \
-                                   e.reason)
-            except urllib2.HTTPError as e:
+                content = _request_content(url)
+            except HTTPError as e:
                 raise OAIHTTPError("list_sets got status %d: %s" % \
-                                   (e.code, e.reason))
+                                   (e.response.status_code, e.response.reason))
+            except RequestException as e:
+                raise OAIHTTPError("list_sets could not make request: %s" % e)
             retrieved_t = time.time()
             self.logger.debug('Retrieved in {0}s'.format(retrieved_t - start_t))
 
@@ -196,9 +206,14 @@ class oaiservice(object):
                      frm=None, until=None):
         '''
         List records. Use either the resumption token or set id.
+
+        The identifiers of the records whose headers have a "deleted" status
+        are listed under "deleted". An incremental (frm) request that
+        matches no records lists no records rather than raising OAIError.
         '''
         error = None
         records = []
+        deleted = []
 
         params = {
                     'verb' : 'ListRecords',
@@ -221,13 +236,12 @@ class oaiservice(object):
         self.logger.debug('OAI request URL: {0}'.format(url))
         start_t = time.time()
         try:
-            content = urllib2.urlopen(url).read()
-        except urllib2.URLError as e:
-            raise OAIHTTPError("list_records could not make request: %s" % \
-                               e.reason)
-        except urllib2.HTTPError as e:
+            content = _request_content(url)
+        except HTTPError as e:
             raise OAIHTTPError("list_records got status %d: %s" % \
-                               (e.code, e.reason))
+                               (e.response.status_code, e.response.reason))
+        except RequestException as e:
+            raise OAIHTTPError("list_records could not make request: %s" % e)
         retrieved_t = time.time()
         self.logger.debug('Retrieved in {0}s'.format(retrieved_t - start_t))
 
@@ -244,9 +258,13 @@ class oaiservice(object):
         except KeyError:
             try:
                 error = xml_content["OAI-PMH"]["error"]
-                raise OAIError(error)
             except KeyError:
                 raise OAIParseError("Could not parse %s:\n%s" % (url, content))
+            if isinstance(error, dict) and \
+               error.get("code") == "noRecordsMatch":
+                return {'records': records, 'resumption_token': '',
+                        'deleted': deleted, 'error': None}
+            raise OAIError(error)
         if isinstance(resumption_token, dict):
             resumption_token = resumption_token.get("#text", "")
         if isinstance(xml_content['OAI-PMH']['ListRecords']['record'], dict):
@@ -287,11 +305,13 @@ class oaiservice(object):
                                                         header)
                         if not 'deleted' in record.get('status', ''):
                             records.append((rec_id, record))
+                else:
+                    deleted.append(full_rec['header']['identifier'])
             except Exception as e:
                 logger.error("Unable to process record in #list_records(): \n\t%s" % e)
 
         return {'records': records, 'resumption_token': resumption_token,
-                'error': error}
+                'deleted': deleted, 'error': error}
 
     def record_for_prefix(self, prefix, orig, header):
         """
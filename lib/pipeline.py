@@ -0,0 +1,403 @@
+"""
+In-process enrichment pipeline
+
+The enrich service used to POST every record to every URI of a profile's
+enrichment pipeline. Each of those URIs names a service that is registered in
+the very same Akara process, so the HTTP round trip (and the copying of
+request headers, rebuilding of URIs and so on) is pure overhead.
+
+This module resolves the pipeline URIs to the services registered with Akara
+and calls them directly:
+
+    * Services that have registered a record function with record_service()
+      are handed the record dictionary itself, so no JSON is produced or
+      parsed between two such steps. Those that have also registered a batch
+      function with record_batch_service() are handed all the records of a
+      batch at once.
+    * Any other service is called through its WSGI handler, with the record
+      serialized exactly as it would be for an HTTP request.
+    * Absolute URIs, and paths that are not mounted in this process, are
+      still requested over HTTP.
+
+The steps of a pipeline header value are resolved once into a Plan, which is
+cached (see get_plan()), so a request only walks a list of ready-made steps.
+
+Services with a record function also accept a JSON array of records (see
+map_records()), so a batch of records can be sent to them in one request. The
+output is the same as that of the HTTP pipeline, one record at a time.
+"""
+import re
+import cgi
+import hashlib
+import urlparse
+from cStringIO import StringIO
+from akara import logger
+from akara import request
+from akara import response
+from akara import registry
+from amara.lib.iri import is_absolute
+from akara.util import copy_headers_to_dict
+from amara.thirdparty import json, httplib2
+from dplaingestion.lru_cache import LRUCache
+
+H = httplib2.Http()
+H.force_exception_as_status_code = True
+
+# Service path (ie "shred") -> function that enriches a record dictionary
+RECORD_SERVICES = {}
+# Service path -> function that enriches a list of record dictionaries
+RECORD_BATCH_SERVICES = {}
+
+
+def record_service(path):
+    """Registers the decorated function as the in-process implementation of
+       the Akara service mounted at path.
+
+       The function is called with the record dictionary followed by the
+       query parameters of the pipeline URI as keyword arguments, and must
+       return the enriched record. Since the record may be handed to the next
+       service without being serialized, the function must only put JSON types
+       in the record (text as unicode or ASCII str) and must not make two
+       fields share the same list or dictionary.
+
+       The service itself should hand its parsed body to map_records(), so
+       that it accepts a batch of records as well as a single record.
+    """
+    def register(func):
+        RECORD_SERVICES[path] = func
+        return func
+    return register
+
+
+def record_batch_service(path):
+    """Registers the decorated function as the in-process implementation of
+       the Akara service mounted at path for a batch of records. The service
+       must also have a record function (see record_service()), which is
+       used for a single record.
+
+       The function is called with the list of record dictionaries followed
+       by the query parameters of the pipeline URI as keyword arguments, and
+       must return the list of enriched records, in the same order, with the
+       output of the record function for each.
+    """
+    def register(func):
+        RECORD_BATCH_SERVICES[path] = func
+        return func
+    return register
+
+
+def map_records(func, data, *args, **kwargs):
+    """Applies the record function func to data, which is either a single
+       record or a list of records, and returns the result in the same form.
+    """
+    if isinstance(data, list):
+        return [func(record, *args, **kwargs) for record in data]
+    return func(data, *args, **kwargs)
+
+
+class PipelineStep(object):
+    """A pipeline URI resolved to the way it will be called"""
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.path, _, self.query = uri.partition("?")
+        self.mount_point = self.path.lstrip("/")
+        self.record_func = None
+        self.batch_func = None
+        self.handler = None
+        # Services with a record function accept a list of records, wherever
+        # they are mounted.
+        self.accepts_batch = \
+            urlparse.urlsplit(self.path).path.strip("/") in RECORD_SERVICES
+        try:
+            self.kwargs = self.params()
+        except ValueError:
+            # Left to the service to reject
+            self.kwargs = None
+        if not is_absolute(uri):
+            # Ensure the path starts with "/"
+            self.relative_uri = re.sub(r"^(?!/)", "/", uri)
+
+        if is_absolute(uri) or "/" in self.mount_point:
+            return
+        self.record_func = RECORD_SERVICES.get(self.mount_point)
+        self.batch_func = RECORD_BATCH_SERVICES.get(self.mount_point)
+        try:
+            self.handler = registry.get_service(self.mount_point).handler
+        except KeyError:
+            pass
+        self.environ = {
+            "REQUEST_METHOD": "POST",
+            "SCRIPT_NAME": "/" + self.mount_point,
+            "PATH_INFO": "",
+            "QUERY_STRING": self.query
+        }
+
+    @property
+    def is_local(self):
+        return self.handler is not None
+
+    def params(self):
+        """Returns the query parameters as keyword arguments, the way Akara
+           passes them to a simple_service.
+        """
+        params = {}
+        for k, v in cgi.parse_qs(self.query).iteritems():
+            if len(v) != 1:
+                raise ValueError("Using the %r query parameter multiple " % k +
+                                 "times is not supported")
+            params[k] = v[0]
+        return params
+
+
+def resolve(enrichments):
+    """Returns the list of PipelineSteps for a list of pipeline URIs"""
+    return [PipelineStep(uri) for uri in enrichments if uri]
+
+
+class Plan(object):
+    """A compiled pipeline: the steps of a Pipeline-Item or Pipeline-Coll
+       header value, resolved once and reused for every request carrying the
+       same value. See get_plan().
+    """
+
+    def __init__(self, header_value):
+        self.steps = resolve(header_value.split(","))
+        self.hash = plan_hash(header_value)
+
+    @property
+    def step_count(self):
+        return len(self.steps)
+
+    def describe(self):
+        """Returns the step count and content hash, to tell which version of
+           a pipeline enriched a record.
+        """
+        return {"steps": self.step_count, "hash": self.hash}
+
+
+def plan_hash(header_value):
+    """Returns the content hash of a pipeline header value"""
+    if isinstance(header_value, unicode):
+        header_value = header_value.encode("utf-8")
+    return hashlib.sha1(header_value).hexdigest()
+
+
+PLAN_CACHE = LRUCache(32)
+
+def get_plan(header_value):
+    """Returns the Plan for a pipeline header value, compiling it unless it is
+       in the cache.
+    """
+    key = plan_hash(header_value)
+    plan = PLAN_CACHE.get(key)
+    if plan is None:
+        plan = Plan(header_value)
+        PLAN_CACHE.put(key, plan)
+        logger.debug("Compiled pipeline %s (%d steps)" % (plan.hash,
+                                                          plan.step_count))
+    return plan
+
+
+class _Record(object):
+    """The state of a record going through a pipeline.
+
+       Exactly one of body (JSON text) and data (dictionary) holds the record.
+    """
+    def __init__(self, body):
+        self.body = body
+        self.data = None
+        self.error = None
+        # Set when a record function raised
+        self.failed = False
+
+    def as_data(self):
+        if self.data is None:
+            self.data = json.loads(self.body)
+            self.body = None
+        return self.data
+
+    def as_body(self):
+        if self.data is not None:
+            self.body = json.dumps(self.data)
+            self.data = None
+        return self.body
+
+
+class _Context(object):
+    """What the services of a pipeline are called with for one request"""
+
+    def __init__(self, ctype, wsgi_header):
+        self.ctype = ctype
+        self.environ = dict(request.environ)
+        self.environ.pop(wsgi_header, None)
+        self.environ["CONTENT_TYPE"] = ctype
+        self.headers = copy_headers_to_dict(request.environ,
+                                            exclude=[wsgi_header])
+        self.headers["content-type"] = ctype
+        self.prefix = request.environ["wsgi.url_scheme"] + "://"
+        if request.environ.get("HTTP_HOST"):
+            self.prefix += request.environ["HTTP_HOST"]
+        else:
+            self.prefix += request.environ["SERVER_NAME"]
+
+
+def run(content, ctype, steps, wsgi_header):
+    """Runs content through the given PipelineSteps.
+
+       Returns a tuple (error, body) where error is the message for the last
+       step that failed, if any, and body is the JSON text of the enriched
+       content.
+    """
+    return run_batch([content], ctype, steps, wsgi_header)[0]
+
+
+def run_batch(contents, ctype, steps, wsgi_header):
+    """Runs each of contents through the given PipelineSteps, one step at a
+       time for the whole batch. Services that accept a list of records are
+       called once per step rather than once per record.
+
+       Returns a list of (error, body) tuples, as run() does, in the order of
+       contents.
+    """
+    if not contents:
+        return []
+    context = _Context(ctype, wsgi_header)
+    bodies = [json.dumps(content) for content in contents]
+    records = [_Record(body) for body in bodies]
+    _run(records, steps, context, True)
+
+    results = []
+    for body, record in zip(bodies, records):
+        if record.failed:
+            # The failed record function may have left the record half
+            # enriched, where the HTTP pipeline would have carried on with
+            # the previous step's output. Start over without record
+            # functions.
+            record = _Record(body)
+            _run([record], steps, context, False)
+        results.append((record.error, record.as_body()))
+    return results
+
+
+def _run(records, steps, context, use_record_funcs):
+    for step in steps:
+        records = [record for record in records if not record.failed]
+        if not records:
+            break
+
+        if use_record_funcs and step.batch_func and len(records) > 1:
+            try:
+                enriched = _call_batch_func(step, [record.as_data()
+                                                   for record in records])
+                for record, data in zip(records, enriched):
+                    record.data = data
+            except Exception, e:
+                logger.error("Error in %s: %s" % (step.uri, e))
+                for record in records:
+                    record.failed = True
+        elif use_record_funcs and step.record_func:
+            for record in records:
+                try:
+                    record.data = _call_record_func(step, record.as_data())
+                except Exception, e:
+                    logger.error("Error in %s: %s" % (step.uri, e))
+                    record.failed = True
+        elif step.accepts_batch and len(records) > 1:
+            body = "[" + ",".join([r.as_body() for r in records]) + "]"
+            status, content = _call(step, body, context)
+            if _ok(status):
+                for record, data in zip(records, json.loads(content)):
+                    record.data = data
+                    record.body = None
+            else:
+                # Only the records that fail on their own are in error, as
+                # when they are sent one at a time
+                logger.warn("Batch call to %s failed, retrying its %d " %
+                            (step.uri, len(records)) + "records one by one")
+                _call_each(step, records, context)
+        else:
+            _call_each(step, records, context)
+
+
+def _call_each(step, records, context):
+    """Calls step with each of records in turn"""
+    for record in records:
+        status, content = _call(step, record.as_body(), context)
+        if _ok(status):
+            record.body = content
+        else:
+            record.error = _error(step)
+
+
+def _ok(status):
+    return str(status).startswith("2")
+
+
+def _error(step):
+    error = "Error in enrichment pipeline at %s" % step.uri
+    logger.error(error)
+    return error
+
+
+def _call(step, body, context):
+    if step.is_local:
+        return _call_handler(step, body, context)
+    else:
+        return _call_uri(step, body, context)
+
+
+def _call_record_func(step, data):
+    logger.debug("Calling record service: %s " % step.uri)
+    if step.kwargs is None:
+        raise ValueError("Invalid query parameters")
+    return step.record_func(data, **step.kwargs)
+
+
+def _call_batch_func(step, data):
+    logger.debug("Calling record batch service: %s " % step.uri)
+    if step.kwargs is None:
+        raise ValueError("Invalid query parameters")
+    return step.batch_func(data, **step.kwargs)
+
+
+def _call_handler(step, body, context):
+    """Calls the WSGI handler of a service mounted in this process and
+       returns the response status and body.
+    """
+    logger.debug("Calling service: %s " % step.uri)
+    environ = dict(context.environ)
+    environ.update(step.environ)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ["wsgi.input"] = StringIO(body)
+
+    captured = []
+    def start_response(status, headers, exc_info=None):
+        captured[:] = [status]
+
+    # The service resets akara.request and akara.response for itself, so
+    # they have to be restored for the enrich service.
+    saved = (request.environ, response.code, response.headers)
+    try:
+        content = "".join(step.handler(environ, start_response))
+    except Exception, e:
+        logger.error("Error in %s: %s" % (step.uri, e))
+        return 500, None
+    finally:
+        request.environ, response.code, response.headers = saved
+
+    return captured[0].split(" ", 1)[0], content
+
+
+def _call_uri(step, body, context):
+    """POSTs body to the step's URI and returns the response status and
+       body.
+    """
+    if is_absolute(step.uri):
+        uri = step.uri
+    else:
+        uri = context.prefix + step.relative_uri
+    logger.debug("Calling url: %s " % uri)
+    resp, content = H.request(uri, "POST", body=body,
+                              headers=dict(context.headers))
+    return resp.status, content
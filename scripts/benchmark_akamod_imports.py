@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark of the akamod modules
+
+Imports each dplaingestion.akamod module in a fresh Python process, as a
+newly forked Akara worker would, and prints the time the import took beyond
+that of the Akara and Amara modules every service imports anyway. The
+slowest modules are listed first. Modules that cannot be imported outside of
+Akara, such as those reading their module_config() on import, are reported
+and left out.
+
+Usage:
+    $ python benchmark_akamod_imports.py [module ...] [--repeat N]
+"""
+import os
+import sys
+import argparse
+import subprocess
+import dplaingestion.akamod
+
+# Imported before the timer starts, so that only the module's own cost is
+# measured
+PRELUDE = """
+import importlib
+import akara.services
+from akara import logger, module_config, request, response
+from amara.thirdparty import json
+"""
+
+TIMED_IMPORT = PRELUDE + """
+import time
+start = time.time()
+importlib.import_module(%r)
+print time.time() - start
+"""
+
+
+def import_time(module, repeat):
+    """Returns the best time, in seconds, of importing module in a new
+       process, or None if the import failed.
+    """
+    times = []
+    for i in range(repeat):
+        proc = subprocess.Popen([sys.executable, "-c", TIMED_IMPORT % module],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            print >> sys.stderr, "Could not import %s: %s" % \
+                                 (module, err.strip().splitlines()[-1])
+            return None
+        times.append(float(out.strip().splitlines()[-1]))
+    return min(times)
+
+
+def akamod_modules():
+    """Returns the names of all the modules in dplaingestion.akamod"""
+    akamod_dir = os.path.dirname(dplaingestion.akamod.__file__)
+    names = set(os.path.splitext(f)[0] for f in os.listdir(akamod_dir)
+                if f.endswith((".py", ".pyc")) and not f.startswith("__"))
+    return sorted(names)
+
+
+def define_arguments():
+    """Defines command line arguments for the current script"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*",
+                        help="akamod modules to import (default all)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times to import each module")
+    return parser
+
+
+def main(argv):
+    args = define_arguments().parse_args(argv[1:])
+    modules = args.modules or akamod_modules()
+
+    results = []
+    for name in modules:
+        seconds = import_time("dplaingestion.akamod." + name, args.repeat)
+        if seconds is not None:
+            results.append((seconds, name))
+
+    total = 0
+    for seconds, name in sorted(results, reverse=True):
+        total += seconds
+        print "%-45s %8.1f ms" % (name, seconds * 1000)
+    print "%-45s %8.1f ms" % ("Total (best of %d)" % args.repeat,
+                              total * 1000)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the akamod functions whose regexes are compiled once, on
+import, against the versions that built their regexes on every call
+
+For each module, runs both versions of the function over the same sample
+values, checks that they return the same results, and prints the time each
+took.
+
+Usage:
+    $ python benchmark_akamod_regexes.py [--repeat N] [--number N]
+"""
+import re
+import sys
+import timeit
+import argparse
+import importlib
+from dplaingestion.akamod import enrich_location
+from dplaingestion.akamod import cleanup_value
+enrich_format = importlib.import_module("dplaingestion.akamod.enrich-format")
+enrich_subject = importlib.import_module("dplaingestion.akamod.enrich-subject")
+
+LOCATIONS = ["Boston, Mass.", "Philadelphia (Penn.)", "Austin, TX",
+             "Lake Charles, La; New Orleans, LA", "Going in to the city",
+             "Phila., Pa.", "Washington, D.C.", "Anchorage, AK - 1920",
+             "Unknown place", "Burlington, VT; Portland, ME; Concord, NH"]
+
+FORMATS = ["image/jpg", "Image/JPEG", "audio/mp3 (128 kbps)", "jpg",
+           "text/html;", "video/mp4 720p", "Photograph", "img/jpg",
+           "application/pdf", "3 x 5 in."]
+
+VALUES = ["  A title.  ", "( Boston ) -- Maps", "Smith,  John;",
+          "\"Quoted\" value,", "History -- 20th century.", "Letters",
+          "'Boston' ; ", ".A value with  many   spaces ."]
+
+SUBJECTS = ["boston", "Boats -- Massachusetts.", "  'History'; ",
+            "Maps - - 1900", "A", None, "United States--History"]
+
+
+def old_from_abbrev(strg):
+    states = []
+    for pattern, replace in (('\.',''), ('\(',''), ('\)',''), ('-',''),
+                             (',','')):
+        strg = re.sub(pattern, replace, strg)
+    for state, iso in enrich_location.STATES.iteritems():
+        st = re.sub('US-','',iso)
+        match = re.compile(r'\b({0})\b'.format(st)).search(strg.upper())
+        if match:
+            s = match.group(0)
+            low = re.compile(r'\b({0})\b'.format(s.lower())).search(strg)
+            if not low:
+                states.append(state.title())
+    if not states:
+        for state,abbrevs in enrich_location.ABBREV.iteritems():
+            for abbrev in abbrevs.split(';'):
+                match = re.compile(r'\b({0})\b'.format(abbrev)).search(strg.upper())
+                if match:
+                    states.append(state)
+                break
+    if not states:
+        states.append(strg)
+    return states
+
+
+def old_format_cleanup(s):
+    REGEXPS = ('audio/mp3', 'audio/mpeg'), ('images/jpeg', 'image/jpeg'), \
+              ('image/jpg', 'image/jpeg'), ('image/jp$', 'image/jpeg'), \
+              ('img/jpg', 'image/jpeg'), ('^jpeg$', 'image/jpeg'), \
+              ('^jpg$', 'image/jpeg'), ('\W$', '')
+    s = s.lower().strip()
+    for pattern, replace in REGEXPS:
+        s = re.sub(pattern, replace, s)
+        s = re.sub(r"^([a-z0-9/]+)\s.*",r"\1", s)
+    return s
+
+
+def old_is_imt(s):
+    imt_regexes = [re.compile('^' + x + '(/)') for x in
+                   enrich_format.IMT_TYPES]
+    return any(regex.match(s) for regex in imt_regexes)
+
+
+def old_value_cleanup(value, prop):
+    dquote = '' if prop == "sourceResource/title" else '"'
+    with_dot = '' if prop in cleanup_value.DONT_STRIP_DOT_END else "\."
+    TAGS_FOR_STRIPPING = '[%s\' \r\t\n;,%s]*'
+    TAGS_FOR_STRIPPING_AT_BEGIN = TAGS_FOR_STRIPPING % ("\.", dquote)
+    TAGS_FOR_STRIPPING_AT_END = TAGS_FOR_STRIPPING % (with_dot, dquote)
+    REGEXPS = ('\( ', '('), \
+              (' \)', ')'), \
+              (' *-- *', '--'), \
+              ('[\t ]{2,}', ' '), \
+              ('^' + TAGS_FOR_STRIPPING_AT_BEGIN, ''), \
+              (TAGS_FOR_STRIPPING_AT_END + '$', '')
+    if isinstance(value, basestring):
+        value = value.strip()
+        for pattern, replace in REGEXPS:
+            value = re.sub(pattern, replace, value)
+    return value
+
+
+def old_subject_cleanup(s):
+    TAGS_FOR_STRIPPING = '[\.\' ";]*'
+    REGEXPS = ('\s*-{2,4}\s*', '--'), \
+              ('\s*-\s*-\s*', '--'), \
+              ('^' + TAGS_FOR_STRIPPING, ''), \
+              (TAGS_FOR_STRIPPING + '$','')
+    try:
+        s = s.strip()
+    except AttributeError:
+        s = ''
+    for pattern, replace in REGEXPS:
+        s = re.sub(pattern, replace, s)
+    if len(s) > 2:
+        s = s[0].upper() + s[1:]
+    else:
+        s = None
+    return s
+
+
+PROPS = ["sourceResource/title", "sourceResource/subject",
+         "sourceResource/format"]
+
+# (function name, old function, new function, list of argument tuples)
+BENCHMARKS = [
+    ("enrich_location.from_abbrev", old_from_abbrev,
+     enrich_location.from_abbrev, [(v,) for v in LOCATIONS]),
+    ("enrich-format.cleanup", old_format_cleanup, enrich_format.cleanup,
+     [(v,) for v in FORMATS]),
+    ("enrich-format.is_imt", old_is_imt, enrich_format.is_imt,
+     [(old_format_cleanup(v),) for v in FORMATS]),
+    ("cleanup_value.cleanup", old_value_cleanup, cleanup_value.cleanup,
+     [(v, p) for v in VALUES for p in PROPS]),
+    ("enrich-subject.cleanup", old_subject_cleanup, enrich_subject.cleanup,
+     [(v,) for v in SUBJECTS])
+]
+
+
+def define_arguments():
+    """Defines command line arguments for the current script"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to time each function")
+    parser.add_argument("--number", type=int, default=200,
+                        help="Number of passes over the samples per timing")
+    return parser
+
+
+def main(argv):
+    args = define_arguments().parse_args(argv[1:])
+
+    print "%-28s %12s %12s %8s" % ("function", "per call", "precompiled",
+                                   "speedup")
+    for name, old, new, samples in BENCHMARKS:
+        for sample in samples:
+            assert old(*sample) == new(*sample), \
+                   "%s differs for %r" % (name, sample)
+
+        times = []
+        for func in (old, new):
+            timer = timeit.Timer(lambda: [func(*sample) for sample in samples])
+            best = min(timer.repeat(args.repeat, args.number))
+            times.append(best * 1e6 / (args.number * len(samples)))
+        print "%-28s %9.2f us %9.2f us %7.1fx" % (name, times[0], times[1],
+                                                   times[0] / times[1])
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of DictDiffer against the path-flattening differ it replaced
+
+Diffs each record of a JSON file against an unchanged copy and against a copy
+with a few fields changed, added and removed, checks that both differs find
+the same differences, and prints the time each took.
+
+The file holds either an array of records or an object of records keyed by
+id, such as the files of an enrich_process/data_dir.
+
+Usage:
+    $ python benchmark_dict_differ.py [json_file] [--repeat N]
+"""
+import sys
+import timeit
+import argparse
+from copy import deepcopy
+from itertools import chain
+from collections import Mapping
+from amara.thirdparty import json
+from dplaingestion.dict_differ import DictDiffer
+
+
+class FlatteningDictDiffer(object):
+    """The previous DictDiffer, which flattens both dictionaries into
+       dictionaries keyed by path before comparing them
+    """
+
+    def __init__(self, current_dict, past_dict):
+        self.current_dict = self._pathify_dict(current_dict)
+        self.past_dict = self._pathify_dict(past_dict)
+        self.set_current = set(self.current_dict)
+        self.set_past = set(self.past_dict)
+        self.intersect = self.set_current.intersection(self.set_past)
+
+    def _flatten_dict(self, dictionary):
+        def _flatten_iter(pairs, _key_accum=()):
+            atoms = ((k, v) for k, v in pairs if not isinstance(v, Mapping))
+            submaps = ((k, v) for k, v in pairs if isinstance(v, Mapping))
+            def compress(k):
+                return _key_accum + (k,)
+            return chain(((compress(k), v) for k, v in atoms),
+                         *[_flatten_iter(submap.items(), compress(k))
+                           for k, submap in submaps])
+        return dict(_flatten_iter(dictionary.items()))
+
+    def _pathify_dict(self, d):
+        flat_dict = self._flatten_dict(d)
+        return dict(("/".join(k), v) for k, v in flat_dict.iteritems())
+
+    def added(self):
+        return list(self.set_current - self.intersect)
+
+    def removed(self):
+        return list(self.set_past - self.intersect)
+
+    def changed(self):
+        return list(set(o for o in list(self.intersect) if
+                    self.past_dict[o] != self.current_dict[o]))
+
+
+def changed_copy(record):
+    """Returns a copy of record with a few fields changed, added and
+       removed
+    """
+    copy = deepcopy(record)
+    for i, key in enumerate(sorted(copy.keys())):
+        if i % 3 == 0:
+            copy[key] = "changed"
+        elif i % 3 == 1 and isinstance(copy[key], dict):
+            copy[key]["added"] = {"field": "added"}
+    copy.pop(sorted(copy.keys())[-1])
+    return copy
+
+
+def fields_changed(differ, current, past):
+    """Returns the differences the way Couch._get_fields_changed uses them"""
+    diff = differ(current, past)
+    return (sorted(diff.added()), sorted(diff.removed()),
+            sorted(diff.changed()))
+
+
+def define_arguments():
+    """Defines command line arguments for the current script"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_file", nargs="?",
+                        default="test/test_data/clemson_ctm",
+                        help="JSON file of records to diff")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to diff the records")
+    return parser
+
+
+def main(argv):
+    args = define_arguments().parse_args(argv[1:])
+    with open(args.json_file) as f:
+        records = json.load(f)
+    if isinstance(records, dict):
+        records = records.values()
+    # Nest the records, as sourceResource and originalRecord are in MAP
+    # records
+    records = [r if "sourceResource" in r else
+               {"_id": str(i), "sourceResource": r, "originalRecord": r}
+               for i, r in enumerate(records)]
+    pairs = [(deepcopy(r), r) for r in records] + \
+            [(changed_copy(r), r) for r in records]
+
+    for current, past in pairs:
+        expected = fields_changed(FlatteningDictDiffer, current, past)
+        assert fields_changed(DictDiffer, current, past) == expected, \
+               "Differences do not match for record %s" % past.get("_id")
+
+    print "%d records, %d diffs, best of %d runs" % (len(records), len(pairs),
+                                                     args.repeat)
+    for name, differ in (("flattening", FlatteningDictDiffer),
+                         ("DictDiffer", DictDiffer)):
+        timer = timeit.Timer(lambda: [fields_changed(differ, c, p)
+                                      for c, p in pairs])
+        best = min(timer.repeat(args.repeat, 1))
+        print "%-12s %8.2f ms  %6.1f us/diff" % (name, best * 1000,
+                                                 best * 1e6 / len(pairs))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
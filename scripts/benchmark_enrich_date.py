@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Benchmark of enrich_date's memoized date parsing against parsing every date
+
+Collects the date values of the records of a JSON file (sourceResource/date,
+or date for records that are not yet mapped), splits and cleans them as
+enrich_date does, then parses them all with parse_date_or_range, with and
+without its cache. Checks that both give the same results, and prints the
+time each took and the hit rates of the caches.
+
+The file holds either an array of records or an object of records keyed by
+id, such as the files of an enrich_process/data_dir.
+
+Usage:
+    $ python benchmark_enrich_date.py [json_file] [--repeat N]
+"""
+import sys
+import timeit
+import argparse
+from amara.thirdparty import json
+from dplaingestion.selector import getprop
+from dplaingestion.utilities import iterify, clean_date, \
+                                    remove_all_brackets_and_strip
+from dplaingestion.akamod import enrich_date
+
+
+def date_strings(records):
+    """Returns the cleaned date strings of records that enrich_date parses"""
+    strings = []
+    for record in records:
+        value = getprop(record, "sourceResource/date", True) or \
+                record.get("date")
+        for s in iterify(value):
+            if not isinstance(s, basestring):
+                continue
+            for part in s.split(";"):
+                stripped = clean_date(remove_all_brackets_and_strip(part))
+                if len(stripped) >= 4:
+                    strings.append(stripped)
+    return strings
+
+
+def clear_caches():
+    enrich_date.parse_date_or_range.cache.clear()
+    enrich_date.robust_date_parser.cache.clear()
+
+
+def define_arguments():
+    """Defines command line arguments for the current script"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_file", nargs="?",
+                        default="test/test_data/clemson_ctm",
+                        help="JSON file of records whose dates to parse")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to parse the dates")
+    return parser
+
+
+def main(argv):
+    args = define_arguments().parse_args(argv[1:])
+    with open(args.json_file) as f:
+        records = json.load(f)
+    if isinstance(records, dict):
+        records = records.values()
+    strings = date_strings(records)
+    if not strings:
+        print >> sys.stderr, "No dates in %s" % args.json_file
+        return -1
+
+    uncached = enrich_date.parse_date_or_range.uncached
+    clear_caches()
+    for s in strings:
+        assert enrich_date.parse_date_or_range(s) == uncached(s), \
+               "Results differ for %r" % s
+
+    print "%d dates, %d distinct, best of %d runs" % \
+          (len(strings), len(set(strings)), args.repeat)
+    # The robust_date_parser cache is still used by the uncached function,
+    # so it is cleared before every run
+    timings = (("uncached", uncached, True),
+               ("cold cache", enrich_date.parse_date_or_range, True),
+               ("warm cache", enrich_date.parse_date_or_range, False))
+    for name, parse, clear in timings:
+        def run():
+            if clear:
+                clear_caches()
+            for s in strings:
+                parse(s)
+        best = min(timeit.Timer(run).repeat(args.repeat, 1))
+        print "%-12s %8.2f ms  %6.1f us/date" % (name, best * 1000,
+                                                 best * 1e6 / len(strings))
+
+    clear_caches()
+    for s in strings:
+        enrich_date.parse_date_or_range(s)
+    for name, stats in sorted(enrich_date.date_cache_stats().items()):
+        print "%-20s hit rate %5.1f%% (%d hits, %d misses)" % \
+              (name, stats["hit_rate"] * 100, stats["hits"], stats["misses"])
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -12,9 +12,8 @@ import sys
 import shutil
 import tempfile
 import argparse
-import threading
-import time
-import Queue
+import signal
+import multiprocessing
 import ConfigParser
 import httplib
 from akara import logger
@@ -26,123 +25,123 @@ from dplaingestion.utilities import make_tarfile, iso_utc_with_tz
 
 config = ConfigParser.ConfigParser()
 config.readfp(open('akara.ini'))
-threads_working = 0
+
+# Seconds to wait for a result at a time, so that a keyboard interrupt is not
+# held up by the wait
+RESULT_TIMEOUT = 60
 
 class EnrichmentError(Exception):
     pass
 
 
-class EnricherThread(threading.Thread):
-    """
-    Thread that enriches files in the given queue
-    """
+# Set in each worker process by init_worker()
+worker_headers = None
+worker_port = None
+worker_enrich_dir = None
 
-    def __init__(self, queue, errors, dashboard_errors, ingestion_doc,
-                 profile, stats, enrich_dir):
-        """
-        queue:            Queue object
-        errors:           list of thread-related error messages
-        dashboard_errors: list of error messages to save to dashboard database
-        ingestion_doc:    parsed JSON ingestion document from dashboard database
-        profile:          parsed JSON from provider profile file
-        stats:            dict of statistics for whole run
-        enrich_dir:       name of output directory
-        """
-        self.queue = queue
-        self.errors = errors
-        self.dashboard_errors = dashboard_errors
-        self.enrich_dir = enrich_dir
-        self.headers = {
-            "Source": ingestion_doc["provider"],
-            "Content-Type": "application/json",
-            "Pipeline-Item": ",".join(profile["enrichments_item"]),
-            "Pipeline-Coll": ",".join(profile["enrichments_coll"])
-        }
-        self.stats = stats
-        threading.Thread.__init__(self)
-
-    def run(self):
-        while True:
-            try:
-                filename = self.queue.get(True)
-                self.enrich(filename)
-            except EnrichmentError as e:
-                msg = "Could not enrich %s: %s\n" % (filename, e.message)
-                self.errors.append(msg)
-                break
-            except Exception as e:
-                msg = "Unexpected exception %s: %s" % (e.__class__, e.message)
-                self.errors.append(msg)
-                break
-
-    def enrich(self, input_filename):
-        """Enrich the records in the given file"""
-
-        global threads_working
-        threads_working += 1
+def init_worker(headers, ports, next_worker, enrich_dir):
+    """Sets up a worker process of the pool.
 
+    headers:     request headers for the enrich service
+    ports:       Akara ports to share out between the workers
+    next_worker: shared counter used to number the workers
+    enrich_dir:  name of output directory
+    """
+    global worker_headers, worker_port, worker_enrich_dir
+    # The parent process handles keyboard interrupts
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    with next_worker.get_lock():
+        number = next_worker.value
+        next_worker.value += 1
+    worker_headers = headers
+    worker_port = ports[number % len(ports)]
+    worker_enrich_dir = enrich_dir
+
+def enrich_file(input_filename):
+    """Enriches the records in the given file and writes them to the enrich
+    directory.
+
+    Returns a tuple (input_filename, result, error) where result holds the
+    counts and errors reported by the enrich service and error is None, or
+    result is None and error is the message for a failure.
+    """
+    try:
         with open(input_filename, "r") as f:
-            data = json.loads(f.read())
+            data = f.read()
 
         # Enrich
-        port = int(config.get('Akara', 'Port'))
-        conn = httplib.HTTPConnection("localhost", port)
-        conn.request("POST", "/enrich", json.dumps(data), self.headers)
+        conn = httplib.HTTPConnection("localhost", worker_port)
+        conn.request("POST", "/enrich", data, worker_headers)
         resp = conn.getresponse()
 
         if not resp.status == 200:
             raise EnrichmentError("Error (status %s)" % resp.status)
 
         data = json.loads(resp.read())
-        enriched_records = data["enriched_records"]
-
-        # Update counts
-        self.stats['enriched_items'] += data["enriched_item_count"]
-        self.stats['enriched_colls'] += data["enriched_coll_count"]
-        self.stats['missing_id'] += data["missing_id_count"]
-        self.stats['missing_source_resource'] += \
-                data["missing_source_resource_count"]
-
-        self.dashboard_errors.extend(data["errors"])
 
         # Write enriched data to file
         basename = os.path.basename(input_filename)
-        with open(os.path.join(self.enrich_dir, basename), "w") as f:
-            f.write(json.dumps(enriched_records))
+        with open(os.path.join(worker_enrich_dir, basename), "w") as f:
+            f.write(json.dumps(data.pop("enriched_records")))
+    except EnrichmentError as e:
+        return input_filename, None, \
+               "Could not enrich %s: %s\n" % (input_filename, e.message)
+    except Exception as e:
+        return input_filename, None, \
+               "Unexpected exception %s: %s" % (e.__class__, e.message)
 
-        threads_working -= 1
+    return input_filename, data, None
 
+def merge_result(stats, dashboard_errors, result):
+    """Adds the counts and errors the enrich service reported for a file to
+    the totals for the run
+    """
+    stats['enriched_items'] += result["enriched_item_count"]
+    stats['enriched_colls'] += result["enriched_coll_count"]
+    stats['missing_id'] += result["missing_id_count"]
+    stats['missing_source_resource'] += \
+            result["missing_source_resource_count"]
+    # The pipeline plans the server compiled for this run
+    stats['pipelines'] = result["pipelines"]
+    dashboard_errors.extend(result["errors"])
+
+def next_result(results):
+    """Returns the next result from the pool, waiting for it in a way that
+    lets a keyboard interrupt through
+    """
+    while True:
+        try:
+            return results.next(RESULT_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            pass
 
-def queue_and_errors(ingestion_doc, profile, stats, enrich_dir):
+def create_pool(ingestion_doc, profile, enrich_dir):
     """
-    Spawn threads to process files from queue, and return the queue and a
-    list to hold any errors
+    Creates the pool of processes that enrich the files, one per core unless
+    [Enrichment] Processes says otherwise.
+
+    The workers post to the Akara instances listed in [Enrichment]
+    AkaraPorts, spread evenly between them, or to [Akara] Port.
     """
-    global config
-    queue_size = int(config.get('Enrichment', 'QueueSize'))
-    thread_count = int(config.get('Enrichment', 'ThreadCount'))
-    queue = Queue.Queue(queue_size)
-    errors = []
-    dashboard_errors = []
-    threads = [EnricherThread(queue,
-                              errors,
-                              dashboard_errors,
-                              ingestion_doc,
-                              profile,
-                              stats,
-                              enrich_dir)
-               for i in range(thread_count)]
-    for t in threads:
-        t.daemon = True
-        t.start()
-    return queue, errors
-
-def print_errors_thrown(thread_errors):
-    if thread_errors:
-        print >> sys.stderr, "\n".join([s for s in thread_errors])
-        return True
+    headers = {
+        "Source": ingestion_doc["provider"],
+        "Content-Type": "application/json",
+        "Pipeline-Item": ",".join(profile["enrichments_item"]),
+        "Pipeline-Coll": ",".join(profile["enrichments_coll"])
+    }
+    if config.has_option('Enrichment', 'Processes'):
+        processes = int(config.get('Enrichment', 'Processes'))
     else:
-        return False
+        processes = multiprocessing.cpu_count()
+    if config.has_option('Enrichment', 'AkaraPorts'):
+        ports = [int(p) for p in
+                 config.get('Enrichment', 'AkaraPorts').split(",")]
+    else:
+        ports = [int(config.get('Akara', 'Port'))]
+
+    return multiprocessing.Pool(processes, init_worker,
+                                (headers, ports, multiprocessing.Value("i", 0),
+                                 enrich_dir))
 
 def create_enrich_dir(provider):
     return tempfile.mkdtemp("_" + provider)
@@ -156,7 +155,6 @@ def define_arguments():
     return parser
 
 def main(argv):
-    global threads_working
     parser = define_arguments()
     args = parser.parse_args(argv[1:])
     couch = Couch()
@@ -194,49 +192,30 @@ def main(argv):
     stats = {'enriched_items': 0,
              'enriched_colls': 0,
              'missing_id': 0,
-             'missing_source_resource': 0
+             'missing_source_resource': 0,
+             'pipelines': {}
             }
-
-    # Initialize queue and threads
-    queue, thread_errors = queue_and_errors(ingestion_doc=ingestion_doc,
-                                            profile=profile,
-                                            stats=stats,
-                                            enrich_dir=enrich_dir)
-    # Initialize list of input files
-    listing = os.listdir(fetch_dir)
-    # Initialize counters and statistics
     dashboard_errors = []
-    file_count = 0
     status = None
+
+    listing = [os.path.join(fetch_dir, basename)
+               for basename in os.listdir(fetch_dir)]
     total_files = len(listing)
-    files = iter(listing)
+    pool = create_pool(ingestion_doc, profile, enrich_dir)
 
     try:
-        # Keep the queue full of filenames
-        while True:
-            time.sleep(0.25)
-            try:
-                if print_errors_thrown(thread_errors):
-                    dashboard_errors.extend(thread_errors)
-                    raise Exception()
-                if not queue.full():
-                    basename = files.next()
-                    filename = os.path.join(fetch_dir, basename)
-                    file_count += 1
-                    print "Enqueuing: %s (%s of %s)" % \
-                            (filename, file_count, total_files)
-                    queue.put(filename)
-            except StopIteration:
-                break
-        # Wait for queue to be empty before returning
-        while True:
-            if queue.empty() and not threads_working:
-                if not print_errors_thrown(thread_errors):
-                    break
-                else:
-                    dashboard_errors.extend(thread_errors)
-                    raise Exception()
-            time.sleep(0.25)
+        results = pool.imap_unordered(enrich_file, listing)
+        for file_count in range(1, total_files + 1):
+            filename, result, error = next_result(results)
+            if error:
+                print >> sys.stderr, error
+                dashboard_errors.append(error)
+                raise EnrichmentError()
+            merge_result(stats, dashboard_errors, result)
+            print "Enriched: %s (%s of %s)" % (filename, file_count,
+                                              total_files)
+        pool.close()
+        pool.join()
     except KeyboardInterrupt:
         status = "error"
         msg = "\nCaught keyboard interrupt"
@@ -245,13 +224,20 @@ def main(argv):
     except Exception as e:
         if e.message:
             print >> sys.stderr, e.message
+            dashboard_errors.append(e.message)
         status = "error"
-        dashboard_errors.append(e.message)
     finally:
+        if status == "error":
+            pool.terminate()
         print "Enriched items: %s" % stats['enriched_items']
         print "Enriched collections: %s" % stats['enriched_colls']
         print "Missing ID: %s" % stats['missing_id']
         print "Missing sourceResource: %s" % stats['missing_source_resource']
+        for name, plan in sorted(stats['pipelines'].items()):
+            msg = "Pipeline %s: %s steps, plan %s" % (name, plan["steps"],
+                                                      plan["hash"])
+            print msg
+            logger.info(msg)
         if not status == "error":
             status = "complete"
         # Prepare fields for ingestion document update
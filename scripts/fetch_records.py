@@ -3,7 +3,16 @@
 Script to fetch records from a provider.
 
 Usage:
-    $ python fetch_records.py ingestion_document_id
+    $ python fetch_records.py ingestion_document_id [--resume]
+
+With --resume, continues the ingestion's last fetch from the checkpoint saved
+next to its data directory, keeping the files already fetched. Only fetchers
+with a resume_from method, such as the OAI verbs fetcher, can be resumed.
+
+If the profile sets "incremental_harvest", an OAI fetch only requests the
+records added, changed or deleted since the day the provider's last successful
+ingestion started fetching. The identifiers of the records deleted are written
+to a file next to the data directory, for remove_deleted_records.py.
 """
 import os
 import sys
@@ -17,6 +26,7 @@ import traceback
 from akara import logger
 from datetime import datetime
 from amara.thirdparty import json
+from dplaingestion import http_pool
 from dplaingestion.couch import Couch
 from dplaingestion.selector import getprop
 from dplaingestion.utilities import iterify, iso_utc_with_tz
@@ -24,6 +34,7 @@ from dplaingestion.create_fetcher import create_fetcher
 
 
 threads_working = 0
+deleted_ids_lock = threading.Lock()
 
 
 class FetchError(Exception):
@@ -78,22 +89,28 @@ class FetcherThread(threading.Thread):
                                self.fetch_dir) 
         self.stats["total_items"] += rv["total_items"]
         self.stats["total_collections"] += rv["total_collections"]
+        self.stats["total_deleted_ids"] += rv["total_deleted_ids"]
         self.d_errors += rv["errors"]
         threads_working -= 1
 
-def queue_and_errors(num_threads, in_doc, config_file, fetch_dir, stats):
+def queue_and_errors(num_threads, in_doc, config_file, fetch_dir, stats,
+                     harvest_from=None):
     queue = Queue.Queue(num_threads)
     t_errors = []
     d_errors = []
+    fetchers = [create_fetcher(in_doc["profile_path"], in_doc["uri_base"],
+                               config_file)
+                for i in range(num_threads)]
+    if harvest_from:
+        for fetcher in fetchers:
+            fetcher.harvest_from = harvest_from
     threads = [FetcherThread(queue,
-                             create_fetcher(in_doc["profile_path"],
-                                            in_doc["uri_base"],
-                                            config_file),
+                             fetcher,
                              t_errors,
                              d_errors,
                              fetch_dir,
                              stats)
-               for i in range(num_threads)]
+               for fetcher in fetchers]
     for t in threads:
         t.daemon = True
         t.start()
@@ -109,30 +126,116 @@ def print_errors_thrown(th_errors):
 def create_fetch_dir(provider):
     return tempfile.mkdtemp("_" + provider)
 
+def checkpoint_path(fetch_dir):
+    """Returns the path of the checkpoint file of fetch_dir, kept next to
+       the directory so that it is not taken for a file of records
+    """
+    return fetch_dir.rstrip(os.sep) + ".checkpoint"
+
+def deleted_ids_path(fetch_dir):
+    """Returns the path of the file listing the identifiers of the records
+       that an incremental harvest into fetch_dir found deleted
+    """
+    return fetch_dir.rstrip(os.sep) + ".deleted"
+
+def write_deleted_ids(fetch_dir, deleted_ids):
+    """Appends deleted_ids to the deleted ids file of fetch_dir, returning
+       the size of the file
+    """
+    with deleted_ids_lock:
+        with open(deleted_ids_path(fetch_dir), "a") as f:
+            for deleted_id in deleted_ids:
+                f.write(deleted_id.encode("utf-8") + "\n")
+            return f.tell()
+
+def truncate_deleted_ids(fetch_dir, size):
+    """Removes the ids appended to the deleted ids file of fetch_dir after it
+       was size bytes long, when a checkpoint was saved
+    """
+    path = deleted_ids_path(fetch_dir)
+    if os.path.exists(path):
+        with open(path, "r+") as f:
+            f.truncate(size)
+
+def incremental_harvest_from(couch, ingestion_doc):
+    """Returns the date (YYYY-MM-DD) on which the fetch of the provider's
+       last successful ingestion before ingestion_doc started, or None if
+       there is no such ingestion and all records must be harvested.
+
+       The date is given to the day, the granularity that every OAI
+       repository supports. Records changed on that day are harvested again.
+    """
+    last_ingestion_doc = couch._get_last_ingestion_doc_for(
+        ingestion_doc["provider"],
+        before_sequence=ingestion_doc["ingestionSequence"],
+        successful=True)
+    start_time = last_ingestion_doc and \
+                 getprop(last_ingestion_doc, "fetch_process/start_time", True)
+    return start_time[:10] if start_time else None
+
+def load_checkpoint(fetch_dir):
+    """Returns the checkpoint saved for fetch_dir, or None if there is none"""
+    try:
+        with open(checkpoint_path(fetch_dir), "r") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def save_checkpoint(fetch_dir, checkpoint):
+    """Saves checkpoint for fetch_dir, replacing the last one at once"""
+    checkpoint["saved_at"] = iso_utc_with_tz()
+    path = checkpoint_path(fetch_dir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.rename(path + ".tmp", path)
+
+def remove_unlisted_files(fetch_dir, files):
+    """Removes the files of fetch_dir written after the checkpoint listing
+       files was saved, whose records will be fetched again
+    """
+    for filename in set(os.listdir(fetch_dir)) - set(files):
+        os.remove(os.path.join(fetch_dir, filename))
+
 def define_arguments():
     """Defines command line arguments for the current script"""
     parser = argparse.ArgumentParser()
     parser.add_argument("ingestion_document_id", 
                         help="The ID of the ingestion document")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the last fetch from its checkpoint")
 
     return parser
 
 
-def fetch_all_for_set(set, fetcher, fetch_dir):
+def fetch_all_for_set(set, fetcher, fetch_dir, checkpoint=None):
     """
     Fetch all records (and create all fetch files) for the given set and
     fetcher, or all sets if this value is empty.
 
+    If checkpoint is given, the fetcher's checkpoint, the files written, the
+    size of the deleted ids file and the running totals are saved to it after
+    each response with records or deleted ids.
+
+    The identifiers of any records the fetcher reports deleted are written
+    to the deleted ids file of fetch_dir.
+
     Returns a dictionary of errors and statistics.
     """
     errors = []
     total_items = 0
     total_collections = 0
+    total_deleted_ids = 0
     # Thread obj needs:  fetcher, error_msg, fetch_dir
     for response in fetcher.fetch_all_data(set):
         if response["errors"]:
             errors.extend(iterify(response["errors"]))
             print response["errors"]
+        if response.get("deleted"):
+            size = write_deleted_ids(fetch_dir, response["deleted"])
+            total_deleted_ids += len(response["deleted"])
+            if checkpoint is not None:
+                checkpoint["deleted_ids_size"] = size
+                checkpoint["total_deleted_ids"] += len(response["deleted"])
         if response["records"]:
             # Write records to file
             filename = os.path.join(fetch_dir, str(uuid.uuid4()))
@@ -143,11 +246,22 @@ def fetch_all_for_set(set, fetcher, fetch_dir):
                          record.get("ingestType") == "collection"])
             total_items += items
             total_collections += len(response["records"]) - items
+
+            if checkpoint is not None:
+                checkpoint["files"].append(os.path.basename(filename))
+                checkpoint["total_items"] += items
+                checkpoint["total_collections"] += \
+                    len(response["records"]) - items
+        if checkpoint is not None and \
+           (response["records"] or response.get("deleted")):
+            checkpoint["fetcher"] = fetcher.checkpoint
+            save_checkpoint(fetch_dir, checkpoint)
     return {
         "errors": errors,
         "total_items": total_items,
-        "total_collections": total_collections
-        }    
+        "total_collections": total_collections,
+        "total_deleted_ids": total_deleted_ids
+        }
 
 def main(argv):
     parser = define_arguments()
@@ -163,16 +277,55 @@ def main(argv):
         profile = json.load(f)
 
     # Update ingestion document
-    fetch_dir = create_fetch_dir(ingestion_doc["provider"])
-    kwargs = {
-        "fetch_process/status": "running",
-        "fetch_process/data_dir": fetch_dir,
-        "fetch_process/start_time": iso_utc_with_tz(),
-        "fetch_process/end_time": None,
-        "fetch_process/error": None,
-        "fetch_process/total_items": None,
-        "fetch_process/total_collections": None
-    }
+    harvest_from = None
+    if args.resume:
+        fetch_dir = getprop(ingestion_doc, "fetch_process/data_dir")
+        checkpoint = fetch_dir and os.path.isdir(fetch_dir) and \
+                     load_checkpoint(fetch_dir)
+        if not checkpoint:
+            print >> sys.stderr, "Cannot resume, there is no checkpoint " + \
+                                 "for the last fetch"
+            return -1
+        # Record what the resumed fetch keeps from the last one
+        sets = checkpoint["fetcher"].get("sets", {})
+        resumed = {
+            "checkpoint_time": checkpoint["saved_at"],
+            "files_kept": len(checkpoint["files"]),
+            "items_kept": checkpoint["total_items"],
+            "collections_kept": checkpoint["total_collections"],
+            "deleted_ids_kept": checkpoint.get("total_deleted_ids", 0),
+            "sets_skipped": sorted(k for k, v in sets.items()
+                                   if v["complete"]),
+            "pages_skipped": dict((k, v["pages"]) for k, v in sets.items()
+                                  if not v["complete"] and v["pages"])
+        }
+        kwargs = {
+            "fetch_process/status": "running",
+            "fetch_process/end_time": None,
+            "fetch_process/error": None,
+            "fetch_process/resumed": resumed
+        }
+        harvest_from = getprop(ingestion_doc, "fetch_process/harvest_from",
+                               True)
+    else:
+        fetch_dir = create_fetch_dir(ingestion_doc["provider"])
+        checkpoint = None
+        if profile.get("incremental_harvest"):
+            harvest_from = incremental_harvest_from(couch, ingestion_doc)
+        kwargs = {
+            "fetch_process/status": "running",
+            "fetch_process/data_dir": fetch_dir,
+            "fetch_process/start_time": iso_utc_with_tz(),
+            "fetch_process/end_time": None,
+            "fetch_process/error": None,
+            "fetch_process/total_items": None,
+            "fetch_process/total_collections": None,
+            "fetch_process/resumed": None,
+            "fetch_process/harvest_from": harvest_from,
+            "fetch_process/deleted_ids_file": harvest_from and
+                                              deleted_ids_path(fetch_dir),
+            "fetch_process/total_deleted_ids": None
+        }
     try:
         couch.update_ingestion_doc(ingestion_doc, **kwargs)
     except:
@@ -187,10 +340,19 @@ def main(argv):
                              ingestion_doc["uri_base"],
                              config_file)
 
+    if harvest_from:
+        if not hasattr(fetcher, "harvest_from"):
+            print >> sys.stderr, "Cannot harvest %s incrementally" % \
+                                 ingestion_doc["provider"]
+            return -1
+        print "Harvesting records changed since %s" % harvest_from
+        fetcher.harvest_from = harvest_from
+
     print "Fetching records for %s" % ingestion_doc["provider"]
     stats = {
         "total_items": 0,
-        "total_collections": 0
+        "total_collections": 0,
+        "total_deleted_ids": 0
     }
     try:
         threads = int(profile.get("fetcher_threads")) or 1
@@ -198,6 +360,34 @@ def main(argv):
     except:
         print >> sys.stderr, "Can not determine fetcher threads, so using 1"
         threads = 1
+
+    # Only a fetch made by one fetcher, that can save how far it has got,
+    # is checkpointed
+    checkpointed = threads == 1 and hasattr(fetcher, "resume_from")
+    if checkpoint is not None:
+        if not checkpointed:
+            print >> sys.stderr, "Cannot resume, the fetch for %s " % \
+                                 ingestion_doc["provider"] + \
+                                 "is not checkpointed"
+            return -1
+        print "Resuming from the checkpoint of %s" % checkpoint["saved_at"]
+        remove_unlisted_files(fetch_dir, checkpoint["files"])
+        checkpoint.setdefault("deleted_ids_size", 0)
+        checkpoint.setdefault("total_deleted_ids", 0)
+        truncate_deleted_ids(fetch_dir, checkpoint["deleted_ids_size"])
+        fetcher.resume_from(checkpoint["fetcher"])
+        stats["total_items"] = checkpoint["total_items"]
+        stats["total_collections"] = checkpoint["total_collections"]
+        stats["total_deleted_ids"] = checkpoint["total_deleted_ids"]
+    elif checkpointed:
+        checkpoint = {
+            "fetcher": fetcher.checkpoint,
+            "files": [],
+            "total_items": 0,
+            "total_collections": 0,
+            "deleted_ids_size": 0,
+            "total_deleted_ids": 0
+        }
     sets = None
     sets_supported = (profile.get("sets") != "NotSupported")
     if threads > 1 and sets_supported and hasattr(fetcher, "fetch_sets"):
@@ -211,7 +401,8 @@ def main(argv):
                                                       ingestion_doc,
                                                       config_file,
                                                       fetch_dir,
-                                                      stats)
+                                                      stats,
+                                                      harvest_from)
         status = None
         try:
             while True:
@@ -247,24 +438,38 @@ def main(argv):
             if not status == "error":
                 status = "complete"
     else:  # not threads
-        rv = fetch_all_for_set(None, fetcher, fetch_dir)
+        rv = fetch_all_for_set(None, fetcher, fetch_dir, checkpoint)
         stats["total_items"] += rv["total_items"]
         stats["total_collections"] += rv["total_collections"]
+        stats["total_deleted_ids"] += rv["total_deleted_ids"]
         error_msg += rv["errors"]
 
     print "Total items: %s" % stats["total_items"]
     print "Total collections: %s" % stats["total_collections"]
+    if harvest_from:
+        print "Total deleted ids: %s" % stats["total_deleted_ids"]
+    connection_stats = http_pool.format_connection_stats()
+    if connection_stats:
+        print "HTTP connections:\n%s" % connection_stats
 
 
     # Update ingestion document
-    try:
-        os.rmdir(fetch_dir)
-        # Error if fetch_dir was empty
-        status = "error"
-        error_msg.append("Error, no records fetched")
-        logger.error(error_msg)
-    except:
+    if harvest_from:
+        # Nothing may have changed since the last harvest
         status = "complete"
+    else:
+        try:
+            os.rmdir(fetch_dir)
+            # Error if fetch_dir was empty
+            status = "error"
+            error_msg.append("Error, no records fetched")
+            logger.error(error_msg)
+        except:
+            status = "complete"
+    if status == "complete" and not error_msg and \
+       os.path.exists(checkpoint_path(fetch_dir)):
+        # There is nothing left to resume
+        os.remove(checkpoint_path(fetch_dir))
     kwargs = {
         "fetch_process/status": status,
         "fetch_process/error": error_msg,
@@ -272,6 +477,8 @@ def main(argv):
         "fetch_process/total_items": stats["total_items"],
         "fetch_process/total_collections": stats["total_collections"]
     }
+    if harvest_from:
+        kwargs["fetch_process/total_deleted_ids"] = stats["total_deleted_ids"]
     try:
         couch.update_ingestion_doc(ingestion_doc, **kwargs)
     except:
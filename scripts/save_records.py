@@ -7,8 +7,10 @@ Usage:
 """
 import os
 import sys
+import Queue
 import shutil
 import argparse
+import threading
 from akara import logger
 from datetime import datetime
 from amara.thirdparty import json
@@ -24,10 +26,196 @@ def define_arguments():
                         help="The ID of the ingestion document")
     parser.add_argument("--no-backup", dest="backup", action="store_false",
                         help="skip the backup process")
+    parser.add_argument("--batches-in-flight", type=int, default=2,
+                        help="number of batches that may wait between two " +
+                             "stages of the save (default 2)")
     parser.set_defaults(backup=True)
 
     return parser
 
+# Seconds between checks for a stopped save while waiting on a queue
+QUEUE_TIMEOUT = 1
+
+class SaveError(Exception):
+    pass
+
+
+def read_batches(enrich_dir, batch_size):
+    """Yields dictionaries of the docs in the files of enrich_dir, adding
+    whole files to a batch until the next one would make it exceed batch_size.
+
+    Raises SaveError if a file cannot be loaded.
+    """
+    docs = {}
+    for file in os.listdir(enrich_dir):
+        filename = os.path.join(enrich_dir, file)
+        with open(filename, "r") as f:
+            try:
+                file_docs = json.loads(f.read())
+            except:
+                raise SaveError("Error loading " + filename)
+
+        print >> sys.stderr, "Read file %s" % filename
+        if docs and len(docs) + len(file_docs) > batch_size:
+            yield docs
+            docs = file_docs
+        else:
+            docs.update(file_docs)
+
+    if docs:
+        yield docs
+
+
+class SavePipeline(object):
+    """Saves the enriched docs in three stages that run at once, so that
+    reading and preparing (fetching the stored docs and diffing) the next
+    batches overlaps posting the current one:
+
+    1. A reader thread reads batches from the enrich files
+    2. A preparer thread calls Couch.prepare_dpla_batch on each batch
+    3. The calling thread calls Couch.post_dpla_batch on each prepared batch
+
+    At most batches_in_flight batches wait between two stages, which bounds
+    the memory used.
+    """
+
+    def __init__(self, couch, ingestion_doc, enrich_dir, batch_size,
+                 batches_in_flight):
+        self.couch = couch
+        self.ingestion_doc = ingestion_doc
+        self.enrich_dir = enrich_dir
+        self.batch_size = batch_size
+        self.read_queue = Queue.Queue(batches_in_flight)
+        self.post_queue = Queue.Queue(batches_in_flight)
+        self.stopped = threading.Event()
+        self.error_msg = None
+        # Ids of the batches prepared but not yet posted
+        self.pending_doc_ids = {}
+        self.lock = threading.Lock()
+        self.total_items = 0
+        self.total_collections = 0
+
+    def fail(self, error_msg):
+        """Records the error and stops all stages"""
+        if not self.error_msg:
+            self.error_msg = error_msg
+        self.stopped.set()
+
+    def _put(self, queue, item):
+        """Puts item in queue unless the save has stopped"""
+        while not self.stopped.is_set():
+            try:
+                queue.put(item, True, QUEUE_TIMEOUT)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get(self, queue):
+        """Returns the next item of queue, or None once the save has stopped
+        """
+        while not self.stopped.is_set():
+            try:
+                return queue.get(True, QUEUE_TIMEOUT)
+            except Queue.Empty:
+                pass
+        return None
+
+    def read(self):
+        try:
+            for docs in read_batches(self.enrich_dir, self.batch_size):
+                if not self._put(self.read_queue, docs):
+                    return
+        except SaveError as e:
+            self.fail(e.message)
+        except Exception as e:
+            self.fail("Error reading documents: %s" % e)
+        # No more batches
+        self._put(self.read_queue, None)
+
+    def prepare(self):
+        number = 0
+        try:
+            while True:
+                docs = self._get(self.read_queue)
+                if docs is None:
+                    break
+                with self.lock:
+                    pending_doc_ids = set()
+                    for doc_ids in self.pending_doc_ids.values():
+                        pending_doc_ids.update(doc_ids)
+                resp, batch = self.couch.prepare_dpla_batch(docs,
+                                                            self.ingestion_doc,
+                                                            pending_doc_ids)
+                if resp == -1:
+                    self.fail(batch)
+                    return
+
+                number += 1
+                batch["number"] = number
+                batch["items"] = len([doc for doc in docs.values() if
+                                      doc.get("ingestType") == "item"])
+                batch["collections"] = len(docs) - batch["items"]
+                with self.lock:
+                    self.pending_doc_ids[number] = docs.keys()
+                if not self._put(self.post_queue, batch):
+                    return
+        except Exception as e:
+            self.fail("Error preparing documents: %s" % e)
+            return
+        # No more batches
+        self._put(self.post_queue, None)
+
+    def report_view_index_lag(self):
+        lag = self.couch.view_index_lag(self.couch.dpla_db.name)
+        msg = "View index lag: %s" % ", ".join(["%s %s" % (name, lag[name])
+                                                for name in sorted(lag)])
+        print msg
+        logger.info(msg)
+
+    def run(self):
+        """Saves all the docs and returns the error message, if any"""
+        stages = [threading.Thread(target=self.read),
+                  threading.Thread(target=self.prepare)]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+
+        sync_point = 5000
+        while True:
+            batch = self._get(self.post_queue)
+            if batch is None:
+                break
+            resp, error_msg = self.couch.post_dpla_batch(batch,
+                                                         self.ingestion_doc)
+            with self.lock:
+                del self.pending_doc_ids[batch["number"]]
+            if resp == -1:
+                self.fail(error_msg)
+                break
+
+            self.total_items += batch["items"]
+            self.total_collections += batch["collections"]
+            print "Saved %s documents" % (self.total_items +
+                                          self.total_collections)
+
+            if self.total_items > sync_point:
+                # Start the view index updates without waiting for them
+                print "Refreshing views"
+                self.couch.sync_views(self.couch.dpla_db.name, wait=False)
+                self.report_view_index_lag()
+                sync_point = self.total_items + 10000
+
+        if not self.error_msg:
+            print "Syncing views"
+            self.couch.sync_views(self.couch.dpla_db.name)
+
+        self.stopped.set()
+        for stage in stages:
+            stage.join()
+
+        return self.error_msg
+
 def main(argv):
     parser = define_arguments()
     args = parser.parse_args(argv[1:])
@@ -68,58 +256,12 @@ def main(argv):
             couch.update_ingestion_doc(ingestion_doc, **kwargs)
             return resp
 
-    error_msg = None
     enrich_dir = getprop(ingestion_doc, "enrich_process/data_dir")
-    total_items = 0
-    total_collections = 0
-    sync_point = 5000
-    docs = {}
-    for file in os.listdir(enrich_dir):
-        filename = os.path.join(enrich_dir, file)
-        with open(filename, "r") as f:
-            try:
-                file_docs = json.loads(f.read())
-            except:
-                error_msg = "Error loading " + filename
-                break
-
-        # Save when docs is about to exceed the batch size
-        print >> sys.stderr, "Read file %s" % filename
-        if docs and len(docs) + len(file_docs) > batch_size:
-            resp, error_msg = couch.process_and_post_to_dpla(docs,
-                                                             ingestion_doc)
-            if resp == -1:
-                docs = None
-                break
-
-            items = len([doc for doc in docs.values() if
-                         doc.get("ingestType") == "item"])
-            total_items += items
-            total_collections += len(docs) - items
-            print "Saved %s documents" % (total_items + total_collections)
-
-            if total_items > sync_point:
-                print "Syncing views"
-                couch.sync_views(couch.dpla_db.name)
-                sync_point = total_items + 10000
-
-            # Set docs for the next iteration
-            docs = file_docs
-        else:
-            docs.update(file_docs)
-
-    # Last save
-    if docs:
-        resp, error_msg = couch.process_and_post_to_dpla(docs,
-                                                         ingestion_doc)
-        if resp != -1:
-            items = len([doc for doc in docs.values() if
-                         doc.get("ingestType") == "item"])
-            total_items += items
-            total_collections += len(docs) - items
-            print "Saved %s documents" % (total_items + total_collections)
-            print "Syncing views"
-            couch.sync_views(couch.dpla_db.name)
+    pipeline = SavePipeline(couch, ingestion_doc, enrich_dir, batch_size,
+                            args.batches_in_flight)
+    error_msg = pipeline.run()
+    total_items = pipeline.total_items
+    total_collections = pipeline.total_collections
 
     print "Total items: %s" % total_items
     print "Total collections: %s" % total_collections
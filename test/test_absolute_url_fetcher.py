@@ -0,0 +1,129 @@
+import json
+import threading
+from mock import MagicMock, patch
+from requests import ConnectionError
+from dplaingestion import http_pool
+from dplaingestion.fetchers.uva_fetcher import UVAFetcher
+from dplaingestion.fetchers.mdl_api_fetcher import MDLAPIFetcher
+
+
+def _fetcher(**options):
+    with open("profiles/virginia.pjs", "r") as f:
+        profile = json.load(f)
+    profile.update(options)
+    return UVAFetcher(profile, "http://localhost:8080",
+                      "test/test_data/test.conf")
+
+def _response(status_code, text=None):
+    response = MagicMock()
+    response.ok = status_code < 400
+    response.status_code = status_code
+    response.reason = "Reason"
+    response.text = text
+    return response
+
+def _patch_get(**kwargs):
+    return patch("dplaingestion.http_pool.get", MagicMock(**kwargs))
+
+def test_request_details_in_order():
+    """Details requested concurrently are yielded in the order requested"""
+    fetcher = _fetcher(detail_fetch_threads=4)
+    urls = ["http://example.org/%s" % i for i in range(20)]
+
+    with _patch_get(side_effect=lambda url, **kwargs: _response(200,
+                                                                url.upper())):
+        results = list(fetcher.request_details(urls))
+    assert results == [(url, None, url.upper()) for url in urls]
+
+def test_request_details_per_host_limit():
+    """No more than max_requests_per_host requests go to one host at once"""
+    fetcher = _fetcher(detail_fetch_threads=6, max_requests_per_host=2)
+    lock = threading.Lock()
+    counts = {"current": 0, "max": 0}
+    def _get(url, **kwargs):
+        with lock:
+            counts["current"] += 1
+            counts["max"] = max(counts["max"], counts["current"])
+        threading.Event().wait(0.01)
+        with lock:
+            counts["current"] -= 1
+        return _response(200, url)
+    urls = ["http://limited.example.org/%s" % i for i in range(12)]
+
+    with _patch_get(side_effect=_get):
+        assert len(list(fetcher.request_details(urls))) == 12
+    assert counts["max"] == 2
+
+@patch("dplaingestion.fetchers.absolute_url_fetcher.time.sleep")
+def test_request_detail_retries(sleep):
+    """Connection errors and server errors are retried, with backoff"""
+    fetcher = _fetcher(detail_fetch_retries=2)
+    with _patch_get(side_effect=[ConnectionError("refused"), _response(503),
+                                 _response(200, "content")]):
+        assert fetcher.request_with_retries("http://example.org/1") == \
+            (None, "content")
+    assert [args[0][0] for args in sleep.call_args_list] == [1, 2]
+
+def test_request_detail_client_error_not_retried():
+    """Client errors are returned without retrying"""
+    fetcher = _fetcher(detail_fetch_retries=2)
+    with _patch_get(return_value=_response(404)) as get:
+        error, content = fetcher.request_with_retries("http://example.org/1")
+    assert error == "Error (404--Reason) requesting http://example.org/1"
+    assert content is None
+    assert get.call_count == 1
+
+def test_request_pages_window():
+    """No more than page_fetch_window pages are requested or waiting to be
+       processed at once, and a failed page does not stop the others
+    """
+    fetcher = _fetcher(page_fetch_window=3, detail_fetch_retries=0)
+    lock = threading.Lock()
+    counts = {"outstanding": 0, "max": 0}
+    def _get(url, params=None, **kwargs):
+        with lock:
+            counts["outstanding"] += 1
+            counts["max"] = max(counts["max"], counts["outstanding"])
+        if params["page"] == 5:
+            return _response(404)
+        return _response(200, str(params["page"]))
+    page_params = [{"page": page} for page in range(2, 12)]
+
+    results = []
+    with _patch_get(side_effect=_get):
+        for params, error, content in \
+                fetcher.request_pages("http://example.org/", page_params):
+            threading.Event().wait(0.01)
+            with lock:
+                counts["outstanding"] -= 1
+            results.append((params["page"], error, content))
+
+    assert counts["max"] == 3
+    assert sorted(results) == \
+        [(2, None, "2"), (3, None, "3"), (4, None, "4"),
+         (5, "Error (404--Reason) requesting http://example.org/?page=5",
+          None)] + [(page, None, str(page)) for page in range(6, 12)]
+
+def test_mdl_pages_requested_concurrently():
+    """MDL pages after the first are requested once the total is known"""
+    with open("profiles/minnesota.pjs", "r") as f:
+        profile = json.load(f)
+    fetcher = MDLAPIFetcher(profile, "http://localhost:8080",
+                            "test/test_data/test.conf")
+    def _get(url, params=None, **kwargs):
+        start = params["start"]
+        docs = [{"record_id": "id%s" % i} for i in
+                range(start, min(start + 10, 25))]
+        return _response(200, json.dumps({
+            "response": {"numFound": 25, "start": start, "docs": docs}
+        }))
+
+    with _patch_get(side_effect=_get) as get:
+        responses = list(fetcher.fetch_all_data(None))
+    assert sorted(get.call_args_list[i][1]["params"]["start"] for i in
+                  range(3)) == [0, 10, 20]
+    assert get.call_count == 3
+    ids = [record["_id"] for response in responses for record in
+           response["records"]]
+    assert sorted(ids) == sorted("id%s" % i for i in range(25))
+    assert fetcher.endpoint_url_params["start"] == 0
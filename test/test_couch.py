@@ -1,6 +1,7 @@
 import os
 import sys
 import base64
+import tempfile
 import ConfigParser
 from nose import with_setup
 from nose.tools import nottest
@@ -82,7 +83,7 @@ class CouchTest(Couch):
     def get_provider_backups(self):
         return [db for db in self.server if db.startswith(PROVIDER + "_")]
 
-    def ingest(self, file, provider, json_content=None):
+    def ingest(self, file, provider, json_content=None, fetch_process=None):
         if not json_content:
             with open(file) as f:
                 content = json.load(f)
@@ -94,6 +95,9 @@ class CouchTest(Couch):
                                                            "profiles/clemson.pjs",
                                                            THRESHOLDS)
         ingestion_doc = self.dashboard_db[ingestion_doc_id]
+        if fetch_process:
+            ingestion_doc["fetch_process"] = fetch_process
+            self.dashboard_db.save(ingestion_doc)
 
         url = server() + "enrich"
         body = json.dumps(content)
@@ -190,6 +194,48 @@ def test_deleted_docs():
     docs_added = [row["doc"] for row in rows if row["doc"]["status"] == "added"]
     assert len(docs_added) == 0
 
+@attr(travis_exclude='yes')
+@with_setup(couch_setup, couch_teardown)
+def test_incremental_deleted_docs():
+    nums = [372, 373]
+    DOCS_DELETED = ["clemson--http://repository.clemson.edu/u?/ctm,%s" % num
+                    for num in nums]
+    deleted_ids_file = tempfile.mktemp(".deleted")
+    with open(deleted_ids_file, "w") as f:
+        for num in nums:
+            f.write("oai:repository.clemson.edu:ctm/%s\n" % num)
+
+    couch.ingest(DATA, PROVIDER)
+    # The records not harvested again are kept, unless reported deleted
+    try:
+        second_ingestion_doc_id = couch.ingest(DATA_DELETED, PROVIDER,
+            fetch_process={"harvest_from": "2014-01-31",
+                           "deleted_ids_file": deleted_ids_file})
+    finally:
+        os.remove(deleted_ids_file)
+
+    second_ingestion_doc = couch.dashboard_db.get(second_ingestion_doc_id)
+    assert second_ingestion_doc["countDeleted"] == len(DOCS_DELETED)
+    all_ids = [doc["_id"] for doc in
+               couch._query_all_dpla_provider_docs(PROVIDER)]
+    assert not set(DOCS_DELETED) & set(all_ids)
+
+@attr(travis_exclude='yes')
+@with_setup(couch_setup, couch_teardown)
+def test_incremental_no_deleted_docs():
+    couch.ingest(DATA, PROVIDER)
+    all_ids = set(doc["_id"] for doc in
+                  couch._query_all_dpla_provider_docs(PROVIDER))
+    # No records were reported deleted, so there is no deleted ids file
+    second_ingestion_doc_id = couch.ingest(DATA_DELETED, PROVIDER,
+        fetch_process={"harvest_from": "2014-01-31",
+                       "deleted_ids_file": tempfile.mktemp(".deleted")})
+
+    second_ingestion_doc = couch.dashboard_db.get(second_ingestion_doc_id)
+    assert second_ingestion_doc["countDeleted"] == 0
+    assert set(doc["_id"] for doc in
+               couch._query_all_dpla_provider_docs(PROVIDER)) == all_ids
+
 @attr(travis_exclude='yes')
 @with_setup(couch_setup, couch_teardown)
 def test_changed_docs():
@@ -417,3 +463,136 @@ def test_get_last_ingestion_document():
     couch.ingest(data, PROVIDER, json_content=True)
     ingestion_doc = couch._get_last_ingestion_doc_for(PROVIDER)
     assert ingestion_doc["ingestionSequence"] == 5
+
+@attr(travis_exclude='yes')
+@with_setup(couch_setup, couch_teardown)
+def test_get_docs_by_id():
+    couch.ingest(DATA, PROVIDER)
+    all_docs = dict((doc["_id"], doc) for doc in
+                    couch._query_all_dpla_provider_docs(PROVIDER))
+    ids = all_docs.keys()[:couch.batch_size + 1] + ["clemson--missing"]
+
+    docs = couch._get_docs_by_id(couch.dpla_db, ids)
+    assert set(docs.keys()) == set(ids) - set(["clemson--missing"])
+    for doc_id, doc in docs.items():
+        assert doc["_rev"] == all_docs[doc_id]["_rev"]
+
+@attr(travis_exclude='yes')
+@with_setup(couch_setup, couch_teardown)
+def test_unchanged_docs():
+    first_ingestion_doc_id = couch.ingest(DATA, PROVIDER)
+    first_docs = dict((doc["_id"], doc) for doc in
+                      couch._query_all_dpla_provider_docs(PROVIDER))
+    second_ingestion_doc_id = couch.ingest(DATA, PROVIDER)
+
+    second_ingestion_doc = couch.dashboard_db.get(second_ingestion_doc_id)
+    assert second_ingestion_doc["countUnchanged"] == len(first_docs)
+    assert second_ingestion_doc["countChanged"] == 0
+    assert second_ingestion_doc["countDeleted"] == 0
+
+    # Unchanged documents are only given the new ingestionSequence
+    second_docs = dict((doc["_id"], doc) for doc in
+                       couch._query_all_dpla_provider_docs(PROVIDER))
+    assert set(second_docs) == set(first_docs)
+    for doc_id, doc in second_docs.items():
+        assert doc["ingestionSequence"] == 2
+        assert couch._prep_for_diff(dict(doc)) == \
+               couch._prep_for_diff(dict(first_docs[doc_id]))
+        assert doc["ingestDate"] == first_docs[doc_id]["ingestDate"]
+    seq_docs = couch._query_all_dpla_prov_docs_by_ingest_seq(PROVIDER, 2)
+    assert set(doc["_id"] for doc in seq_docs) == set(first_docs)
+
+    # Documents harvested twice are only counted once
+    third_ingestion_doc_id = couch.ingest(DATA, PROVIDER)
+    third_ingestion_doc = couch.dashboard_db.get(third_ingestion_doc_id)
+    harvested = dict((doc["_id"], doc) for doc in second_docs.values()[:10])
+    for doc in harvested.values():
+        del doc["_rev"]
+    status, batch = couch.prepare_dpla_batch(harvested, third_ingestion_doc)
+    assert status == 0
+    assert batch["counts"]["countUnchanged"] == 0
+    assert batch["post_docs"] == []
+
+@attr(travis_exclude='yes')
+@with_setup(couch_setup, couch_teardown)
+def test_unchanged_docs_with_new_admin():
+    """Documents whose admin fields changed are saved as harvested"""
+    couch.ingest(DATA, PROVIDER)
+    ingestion_doc_id = couch._create_ingestion_document(PROVIDER,
+                                                        server()[:-1],
+                                                        "profiles/clemson.pjs",
+                                                        THRESHOLDS)
+    ingestion_doc = couch.dashboard_db[ingestion_doc_id]
+    harvested = dict((doc["_id"], doc) for doc in
+                     list(couch._query_all_dpla_provider_docs(PROVIDER))[:2])
+    for doc in harvested.values():
+        del doc["_rev"]
+        doc["ingestDate"] = "2020-01-01T00:00:00Z"
+    doc_id = harvested.keys()[0]
+    harvested[doc_id]["admin"]["object_status"] = 0
+
+    status, batch = couch.prepare_dpla_batch(harvested, ingestion_doc)
+    assert status == 0
+    assert batch["counts"]["countUnchanged"] == 1
+    assert batch["counts"]["countChanged"] == 0
+    post_docs = dict((doc["_id"], doc) for doc in batch["post_docs"])
+    assert post_docs[doc_id]["admin"]["object_status"] == 0
+    assert post_docs[doc_id]["ingestDate"] == "2020-01-01T00:00:00Z"
+
+@attr(travis_exclude='yes')
+@with_setup(couch_setup, couch_teardown)
+def test_refresh_views():
+    couch.ingest(DATA, PROVIDER)
+    rev = couch.dpla_db["_design/all_provider_docs"]["_rev"]
+
+    couch.sync_views("dpla", wait=False)
+    # Unchanged design documents are not saved again
+    assert couch.dpla_db["_design/all_provider_docs"]["_rev"] == rev
+
+    lag = couch.view_index_lag("dpla")
+    assert "all_provider_docs" in lag
+    assert all(v >= 0 for v in lag.values())
+
+@attr(travis_exclude='yes')
+@with_setup(couch_setup, couch_teardown)
+def test_delta_backup_and_rollback():
+    couch.backup_mode = "delta"
+    couch.ingest(DATA, PROVIDER)
+    first_docs = dict((doc["_id"], doc) for doc in
+                      couch._query_all_dpla_provider_docs(PROVIDER))
+    for doc in first_docs.values():
+        del doc["_rev"]
+
+    second_ingestion_doc_id = couch.ingest(DATA_CHANGED, PROVIDER)
+    third_ingestion_doc_id = couch.ingest(DATA_DELETED, PROVIDER)
+
+    # Only the documents changed or deleted are backed up. The documents
+    # changed by the second ingestion are changed back by the third.
+    changed_ids = set(["clemson--http://repository.clemson.edu/u?/ctm,%s" %
+                       num for num in [161, 169, 179]])
+    deleted_ids = set(["clemson--http://repository.clemson.edu/u?/ctm,%s" %
+                       num for num in [372, 373, 374, 375, 376, 377, 51, 68,
+                                       77, 94]])
+    second_ingestion_doc = couch.dashboard_db.get(second_ingestion_doc_id)
+    assert second_ingestion_doc["backupMode"] == "delta"
+    second_backup = couch.server[second_ingestion_doc["backupDB"]]
+    assert set(row.id for row in second_backup.view("_all_docs")) == \
+           changed_ids
+    third_ingestion_doc = couch.dashboard_db.get(third_ingestion_doc_id)
+    third_backup = couch.server[third_ingestion_doc["backupDB"]]
+    assert set(row.id for row in third_backup.view("_all_docs")) == \
+           changed_ids | deleted_ids
+
+    assert couch.rollback(PROVIDER, 1) == "Rollback complete"
+    rollback_docs = dict((doc["_id"], doc) for doc in
+                         couch._query_all_dpla_provider_docs(PROVIDER))
+    for doc in rollback_docs.values():
+        del doc["_rev"]
+    assert rollback_docs == first_docs
+
+    # Only the ingestion documents of the ingestions rolled back from are
+    # left in the dashboard database
+    for seq in (2, 3):
+        alldocs = couch._query_all_dashboard_prov_docs_by_ingest_seq
+        assert [doc.get("type") for doc in alldocs(PROVIDER, seq)] == \
+               ["ingestion"]
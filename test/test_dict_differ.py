@@ -53,3 +53,25 @@ def test_dict_differ():
     assert list(set(["e", "f/ff/2"])) == list(set(diff.removed()))
     assert list(set(["b", "c/cc/1", "d", "f/ff/3"])) == list(set(diff.changed()))
     assert list(set(["c/cc/2", "c/dd", "c/ee/eee/1", "c/ee/eee/2/eeeee"])) == list(set(diff.added()))
+
+def test_dict_differ_value_becomes_dict():
+    original = {"a": "value", "b": {"bb": "value"}, "c": {}, "d": "value"}
+    new = {"a": {"aa": "value"}, "b": "value", "c": "value", "d": {}}
+
+    diff = DictDiffer(new, original)
+
+    assert sorted(diff.added()) == ["a/aa", "b", "c"]
+    assert sorted(diff.removed()) == ["a", "b/bb", "d"]
+    assert diff.changed() == []
+
+def test_dict_differ_same_dicts():
+    original = {"a": {"aa": ["value"]}, "b": "value"}
+
+    assert DictDiffer(original, original).differences() == []
+    assert DictDiffer(dict(original), original).differences() == []
+
+def test_dict_differ_results_are_not_shared():
+    diff = DictDiffer({"a": "value"}, {})
+    diff.added().append("b")
+
+    assert diff.added() == ["a"]
@@ -1,6 +1,9 @@
 from amara.thirdparty import json
 from nose.tools import nottest
-from dplaingestion.akamod.enrich_date import check_date_format
+from mock import patch
+from dplaingestion.akamod import enrich_date
+from dplaingestion.akamod.enrich_date import check_date_format, \
+     parse_date_or_range, date_cache_stats
 from server_support import server, H
 from dict_differ import DictDiffer, assert_same_jsons, pinfo
 import sys
@@ -901,5 +904,62 @@ def test_non_increasing_year_list():
     resp, content = H.request(url, "POST", body=json.dumps(INPUT))
     assert_same_jsons(EXPECTED, content)
 
+def test_parse_date_or_range_memoized():
+    """Dates parsed again are looked up in the cache"""
+    parse_date_or_range.cache.clear()
+    for i in range(3):
+        assert parse_date_or_range("1999-2004") == ("1999", "2004")
+        assert parse_date_or_range("1890-95") == ("1890", "1895")
+    stats = date_cache_stats()["parse_date_or_range"]
+    assert stats["hits"] == 4
+    assert stats["misses"] == 2
+
+def _fast_path_sample():
+    """Returns dates of the shapes of the fast path, valid or not, and of
+       shapes close to them
+    """
+    sample = ["%04d" % year for year in range(0, 3000, 7)]
+    for year in (140, 999, 1000, 1406, 1899, 1900, 1905, 1912, 1960, 1999,
+                 2000, 2010, 2012, 2013, 2999):
+        for month in range(14):
+            sample.append("%04d-%02d" % (year, month))
+            sample.append("%04d-%d" % (year, month))
+            for day in (0, 1, 9, 28, 29, 30, 31, 32):
+                sample.append("%04d-%02d-%02d" % (year, month, day))
+                sample.append("%d/%d/%04d" % (month, day, year))
+                sample.append("%02d/%02d/%04d" % (month, day, year))
+                sample.append("%d/%d/%04d" % (day, month, year))
+    for begin, end in ((1960, 1970), (1970, 1960), (1911, 140), (1999, 1999)):
+        sample.append("%04d-%04d" % (begin, end))
+        sample.append("%04d/%04d" % (begin, end))
+    return sample
+
+def test_fast_path_matches_fuzzy_parsers():
+    """Dates parsed by the fast path are parsed as the fuzzy parsers do"""
+    sample = _fast_path_sample()
+    fast = dict((d, (enrich_date.fast_date_or_range(d),
+                     enrich_date.fast_date_parser(d))) for d in sample)
+    assert len([d for d in sample if fast[d][0]]) > 3000
+
+    try:
+        # Let the fuzzy parsers parse every date
+        with patch.object(enrich_date, "fast_date_parser", return_value=None):
+            enrich_date.parse_date_or_range.cache.clear()
+            enrich_date.robust_date_parser.cache.clear()
+            for d in sample:
+                date_or_range, date = fast[d]
+                if date_or_range is not None:
+                    expected = enrich_date.fuzzy_parse_date_or_range(d)
+                    assert date_or_range == expected, \
+                           "%r: got %r, expected %r" % (d, date_or_range,
+                                                        expected)
+                if date is not None:
+                    expected = enrich_date.fuzzy_date_parser(d)
+                    assert date == expected, \
+                           "%r: got %r, expected %r" % (d, date, expected)
+    finally:
+        enrich_date.parse_date_or_range.cache.clear()
+        enrich_date.robust_date_parser.cache.clear()
+
 if __name__ == "__main__":
     raise SystemExit("Use nosetests")
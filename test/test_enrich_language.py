@@ -141,5 +141,27 @@ def test_language_set_from_unicode_regex_match():
     assert resp.status == 200
     assert_same_jsons(EXPECTED, json.loads(content))
 
+def test_language_name_lookups_match_regexes():
+    """Language name lookups should find the codes the regexes find"""
+    from dplaingestion.iso639_3 import EXACT_LANGUAGE_NAME_REGEXES
+    from dplaingestion.iso639_3 import WB_LANGUAGE_NAME_REGEXES
+    from dplaingestion.akamod.enrich_language import \
+        exact_language_name_code, language_name_codes
+
+    for lang_string in [" english ", "ENGLISH and French", "eng; fre",
+                        "Bali (Nigeria)", "x(Bali (Nigeria)) text",
+                        "Mende (Sierra Leone) text", "english_french",
+                        u"Fran\xe7ais, Southeastern Nochixtl\xe1n Mixtec",
+                        "Latin, Greek (ancient)", "In Spanish and english.",
+                        ""]:
+        exact = [code for code, regex in EXACT_LANGUAGE_NAME_REGEXES.items()
+                 if regex.match(lang_string.strip())]
+        assert exact_language_name_code(lang_string) == \
+            (exact[0] if exact else None)
+
+        found = [code for code, regex in WB_LANGUAGE_NAME_REGEXES.items()
+                 if regex.search(lang_string)]
+        assert language_name_codes(lang_string) == found
+
 if __name__ == "__main__":
     raise SystemExit("Use nosetest")
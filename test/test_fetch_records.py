@@ -0,0 +1,43 @@
+import os
+import imp
+import shutil
+import tempfile
+from mock import MagicMock
+
+fetch_records = imp.load_source("fetch_records", "scripts/fetch_records.py")
+
+
+def test_checkpoint_counts_deleted_ids():
+    """The checkpoint keeps the count of the deleted ids, and the size of
+       their file, so that a resumed fetch carries on from them
+    """
+    fetch_dir = tempfile.mkdtemp()
+    try:
+        fetcher = MagicMock()
+        fetcher.checkpoint = {"sets": {}}
+        fetcher.fetch_all_data.return_value = [
+            {"errors": [], "records": [{"_id": "1"}], "deleted": [u"a"]},
+            {"errors": [], "records": [], "deleted": [u"b", u"c"]}
+        ]
+        checkpoint = {"fetcher": fetcher.checkpoint, "files": [],
+                      "total_items": 0, "total_collections": 0,
+                      "deleted_ids_size": 0, "total_deleted_ids": 0}
+        rv = fetch_records.fetch_all_for_set(None, fetcher, fetch_dir,
+                                             checkpoint)
+        assert rv["total_deleted_ids"] == 3
+        saved = fetch_records.load_checkpoint(fetch_dir)
+        assert saved["total_deleted_ids"] == 3
+        assert saved["deleted_ids_size"] == len("a\nb\nc\n")
+        assert len(saved["files"]) == 1
+
+        # Ids written after the checkpoint are removed on resume
+        fetch_records.write_deleted_ids(fetch_dir, [u"d"])
+        fetch_records.truncate_deleted_ids(fetch_dir,
+                                           saved["deleted_ids_size"])
+        with open(fetch_records.deleted_ids_path(fetch_dir)) as f:
+            assert f.read() == "a\nb\nc\n"
+    finally:
+        shutil.rmtree(fetch_dir)
+        for suffix in (".checkpoint", ".deleted"):
+            if os.path.exists(fetch_dir + suffix):
+                os.remove(fetch_dir + suffix)
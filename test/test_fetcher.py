@@ -304,5 +304,31 @@ def test_file_fetcher_smithsonian():
         assert response["records"]
         break
 
+def test_file_fetcher_hathi():
+    profile_path = "profiles/hathi.pjs"
+    fetcher = create_fetcher(profile_path, uri_base, config_file)
+    assert fetcher.__class__.__name__ == "HathiFetcher"
+
+    data_dir = "%s/test/test_data/hathi/" % os.getcwd()
+    fetcher.endpoint_url = "file:/" + data_dir
+    fetcher.batch_size = 2
+    filepath = data_dir + "hathi_sample.xml"
+    batches = [records for error, records in
+               fetcher.extract_xml_content(filepath)]
+    assert [len(records) for records in batches] == [2, 1]
+
+    # Records are streamed as xmltodict would parse them
+    with open(filepath, "r") as f:
+        expected = xmltodict.parse(f.read(), attr_prefix="")
+    expected = expected["collection"]["record"]
+    assert [r for records in batches for r in records] == expected
+
+    records = []
+    for response in fetcher.fetch_all_data():
+        assert response["errors"] == []
+        records.extend(response["records"])
+    assert [r["_id"] for r in records] == ["012242315", "000000012",
+                                           "000000023"]
+
 if __name__ == "__main__":
     raise SystemExit("Use nosetests")
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+from amara.thirdparty import json
+from dplaingestion.fetchers.file_fetcher import FileFetcher
+
+
+class JSONFileFetcher(FileFetcher):
+    """Fetches the records of JSON files, each in the collection named by
+       its "set"
+    """
+    def __init__(self, profile, uri_base, config_file):
+        self.file_filter = "*.json"
+        super(JSONFileFetcher, self).__init__(profile, uri_base, config_file)
+
+    def extract_records(self, file_path):
+        with open(file_path, "r") as f:
+            records = json.load(f)
+        for record in records:
+            self.create_collection_record(record["set"], record["set"].title())
+        yield [], records
+
+
+def _fetch(data_dir, **options):
+    profile = {"name": "test", "endpoint_url": "file:" + data_dir,
+               "contributor": {"name": "Test"}}
+    profile.update(options)
+    fetcher = JSONFileFetcher(profile, "http://localhost:8080",
+                              "test/test_data/test.conf")
+    fetcher.batch_size = 7
+    return list(fetcher.fetch_all_data())
+
+def _write_files(data_dir):
+    for i in range(20):
+        records = [{"_id": "%s-%s" % (i, j), "set": "set%s" % (i % 3)}
+                   for j in range(i % 4)]
+        with open(os.path.join(data_dir, "%02d.json" % i), "w") as f:
+            json.dump(records, f)
+
+def test_parallel_file_parsing():
+    """Files parsed in parallel give the records and collections that files
+       parsed one after another give
+    """
+    data_dir = tempfile.mkdtemp()
+    try:
+        _write_files(data_dir)
+        serial = _fetch(data_dir)
+        ordered = _fetch(data_dir, file_parse_processes=3)
+        unordered = _fetch(data_dir, file_parse_processes=3,
+                           file_parse_ordered=False)
+    finally:
+        shutil.rmtree(data_dir)
+
+    # Item record batches of at least batch_size, then the collections
+    assert len(serial[-1]["records"]) == 3
+    assert all(len(r["records"]) >= 7 for r in serial[:-2])
+
+    def _ids(responses):
+        return [record["_id"] for r in responses for record in r["records"]]
+    # os.walk does not sort the files, so compare to the serial order
+    assert _ids(ordered) == _ids(serial)
+    assert sorted(_ids(unordered)) == sorted(_ids(serial))
+    assert [len(r["records"]) for r in ordered] == \
+           [len(r["records"]) for r in serial]
+    assert sorted(ordered[-1]["records"]) == sorted(serial[-1]["records"])
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from dplaingestion.akamod.geocode import GazetteerGeocoder, Place
+from dplaingestion.gazetteer import Gazetteer, normalize_name
+
+GAZETTEER = "test/test_data/gazetteer.tsv"
+
+
+def _geocode(spatial):
+    place = Place(spatial)
+    place.enrich_geodata(GazetteerGeocoder(Gazetteer(GAZETTEER)))
+    return place.to_map_json()
+
+def test_normalize_name():
+    assert normalize_name("  Calif. ") == "calif"
+    assert normalize_name(u"Saint-Étienne") == u"saint étienne"
+
+def test_gazetteer_forward_lookup():
+    """The gazetteer gives the same Place properties as Twofishes"""
+    assert _geocode({"name": "Bakersfield, CA"}) == {
+        "name": "Bakersfield, CA",
+        "city": "Bakersfield",
+        "county": "Kern County",
+        "state": "California",
+        "country": "United States",
+        "coordinates": "35.37329, -119.01871"
+    }
+
+def test_gazetteer_forward_lookup_context():
+    """Places with the same name are told apart by the places around them"""
+    assert _geocode({"name": "Boston"})["state"] == "Massachusetts"
+    assert _geocode({"name": "Boston, Lincolnshire"})["country"] == \
+           "United Kingdom"
+    assert _geocode({"name": "Boston", "country": "UK"})["state"] == \
+           "Lincolnshire"
+
+def test_gazetteer_country():
+    """Countries are not given coordinates"""
+    assert _geocode({"name": "USA"}) == {"name": "United States",
+                                         "country": "United States"}
+
+def test_gazetteer_reverse_lookup():
+    assert _geocode({"coordinates": "35.4, -119.0"}) == {
+        "name": "Bakersfield, California, United States",
+        "city": "Bakersfield",
+        "county": "Kern County",
+        "state": "California",
+        "country": "United States",
+        "coordinates": "35.4, -119.0"
+    }
+    # Too far from any town
+    assert _geocode({"coordinates": "0, 0"}) == {"coordinates": "0, 0"}
+
+def test_gazetteer_not_found():
+    assert _geocode({"name": "Atlantis"}) == {"name": "Atlantis"}
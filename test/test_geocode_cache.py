@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+from urlparse import urlparse, parse_qs
+from mock import patch
+from multiprocessing.pool import ThreadPool
+from dplaingestion.geocode_cache import GeocodeCache, cache_key
+from dplaingestion.akamod import geocode
+
+BOSTON = {"feature": {"displayName": "Boston, MA, United States",
+                      "name": "Boston", "woeType": 7,
+                      "geometry": {"center": {"lat": 42.35843,
+                                              "lng": -71.05977}}},
+          "parents": [{"name": "Massachusetts", "woeType": 8},
+                      {"name": "United States", "woeType": 12}]}
+
+
+def test_cache_key_normalizes_query():
+    assert cache_key({"query": " Boston,  Mass. ", "lang": "en"}) == \
+           cache_key({"lang": "en", "query": "boston, mass."})
+    assert cache_key({"ll": "42.3,-71.0"}) != cache_key({"ll": "42.3,-71.1"})
+
+def test_cache_shared_on_disk():
+    """A result cached by one process is found by another, via the database
+       """
+    cache_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(cache_dir, "geocode.sqlite")
+        first = GeocodeCache(path)
+        assert first.get("boston") is None
+        first.put("boston", BOSTON)
+        assert first.get("boston") == BOSTON
+
+        second = GeocodeCache(path)
+        assert second.get("boston") == BOSTON
+        assert second.get("boston") == BOSTON
+        assert second.stats() == {"memory_hits": 1, "disk_hits": 1,
+                                  "negative_hits": 0, "misses": 0,
+                                  "hit_rate": 1.0}
+    finally:
+        shutil.rmtree(cache_dir)
+
+def test_cache_negative_results_expire():
+    cache = GeocodeCache(ttl=60, negative_ttl=-1)
+    cache.put("boston", BOSTON)
+    cache.put("nowhere", {})
+    assert cache.get("boston") == BOSTON
+    assert cache.get("nowhere") is None
+
+    cache = GeocodeCache(ttl=60, negative_ttl=60)
+    cache.put("nowhere", {})
+    assert cache.get("nowhere") == {}
+    assert cache.stats()["negative_hits"] == 1
+
+@patch("dplaingestion.akamod.geocode.module_config",
+       return_value={"twofishes_base_url": "http://twofishes/"})
+def test_geocoder_requests_each_place_once(module_config):
+    """Places found, or not found, are only requested once; places that
+       could not be requested are requested again
+    """
+    geocoder = geocode.TwofishesGeocoder(GeocodeCache())
+    responses = {"Boston": {"interpretations": [BOSTON]},
+                 "Nowhere": {"interpretations": []},
+                 "Failed": {}}
+    def _twofishes_data(url):
+        return responses[parse_qs(urlparse(url).query)["query"][0]]
+
+    with patch.object(geocode.TwofishesGeocoder, "_twofishes_data",
+                      side_effect=_twofishes_data) as data:
+        for i in range(3):
+            for name in ("Boston", "Nowhere", "Failed"):
+                place = geocode.Place({"name": name})
+                place.enrich_geodata(geocoder)
+                if name == "Boston":
+                    assert place.state == "Massachusetts"
+        assert data.call_count == 2 + 3
+
+def test_cache_counts_lookups_from_threads():
+    """Lookups made by several threads at once are all counted"""
+    cache = GeocodeCache()
+    cache.put("boston", BOSTON)
+    pool = ThreadPool(8)
+    try:
+        pool.map(lambda i: cache.get("boston" if i % 2 else "nowhere"),
+                 range(4000))
+    finally:
+        pool.close()
+    stats = cache.stats()
+    assert stats["memory_hits"] == 2000
+    assert stats["misses"] == 2000
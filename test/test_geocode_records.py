@@ -0,0 +1,41 @@
+import copy
+from mock import patch
+from dplaingestion.akamod import geocode
+from dplaingestion.gazetteer import Gazetteer
+
+GAZETTEER = "test/test_data/gazetteer.tsv"
+
+
+def _records():
+    names = ["Bakersfield, CA", "Boston", "Atlantis", "Boston"]
+    records = [{"_id": str(i),
+                "sourceResource": {"spatial": [{"name": names[i % 4]},
+                                               {"name": "USA"}]}}
+               for i in range(40)]
+    records.append({"_id": "coordinates", "sourceResource": {
+        "spatial": {"coordinates": "35.4, -119.0"}}})
+    records.append({"_id": "no spatial", "sourceResource": {}})
+    return records
+
+def test_geocode_records_once_per_place():
+    """A batch of records is geocoded as each record is alone, looking each
+       distinct place up once
+    """
+    geocoder = geocode.GazetteerGeocoder(Gazetteer(GAZETTEER))
+    geocoder.batch_threads = 3
+    with patch.object(geocode, "_geocoder", geocoder):
+        expected = [geocode.geocode_record(record) for record in _records()]
+        with patch.object(geocoder, "enrich_place",
+                          wraps=geocoder.enrich_place) as enrich_place:
+            with patch.object(geocode, "logger") as logger:
+                records = geocode.geocode_records(_records())
+
+    assert records == expected
+    assert enrich_place.call_count == 5
+    assert "81 places of 42 records as 5 distinct places " + \
+           "(dedup ratio 16.2)" in logger.info.call_args[0][0]
+
+    # Records do not share the same dictionaries
+    records[0]["sourceResource"]["spatial"][1]["name"] = "Changed"
+    assert records[1]["sourceResource"]["spatial"][1]["name"] == \
+           "United States"
@@ -0,0 +1,95 @@
+import threading
+import ConfigParser
+from StringIO import StringIO
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from mock import patch
+from dplaingestion import http_pool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.headers.get("Accept-Encoding", "")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _Server(ThreadingMixIn, HTTPServer):
+    # Connections kept open by the pool must not keep the server running
+    daemon_threads = True
+
+def _serve():
+    server = _Server(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def test_connections_reused():
+    """Requests to one host reuse its connection, and are counted"""
+    http_pool.configure(pool_size=http_pool.POOL_SIZE + 1)
+    server = _serve()
+    try:
+        url = "http://127.0.0.1:%d/" % server.server_port
+        for i in range(3):
+            r = http_pool.get(url)
+            assert r.text == "gzip, deflate"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    stats = http_pool.connection_stats()
+    assert stats == {
+        "http://127.0.0.1:%d" % server.server_port: {
+            "requests": 3, "connections": 1, "reused": 2
+        }
+    }
+    http_pool.configure(pool_size=http_pool.POOL_SIZE)
+    assert http_pool.connection_stats() == {}
+
+def test_default_timeout():
+    """Requests time out after the configured timeout unless given one"""
+    with patch.object(http_pool.get_session(), "get") as get:
+        http_pool.get("http://example.org/")
+        assert get.call_args[1]["timeout"] == http_pool.TIMEOUT
+        http_pool.get("http://example.org/", timeout=2)
+        assert get.call_args[1]["timeout"] == 2
+
+def test_configure_from():
+    """The pool size and timeout are read from the HTTP config section"""
+    config = ConfigParser.ConfigParser()
+    config.readfp(StringIO("[HTTP]\nPoolSize=3\nTimeout=7.5\n"))
+    try:
+        http_pool.configure_from(config)
+        assert http_pool._pool_size == 3
+        assert http_pool._timeout == 7.5
+        http_pool.require_pool_size(2)
+        assert http_pool._pool_size == 3
+        http_pool.require_pool_size(5)
+        assert http_pool._pool_size == 5
+    finally:
+        http_pool.configure(http_pool.POOL_SIZE, http_pool.TIMEOUT)
+
+def test_configured_from_akara_conf():
+    """In an Akara server process, the session is configured from the
+       http_pool section of akara.conf on first use
+    """
+    class http_pool_config:
+        pool_size = "3"
+        # Left out of akara.ini
+        timeout = "${HTTP__Timeout}"
+
+    with patch("akara.raw_config", {"http_pool": http_pool_config}), \
+         patch.object(http_pool, "_configured", False):
+        try:
+            http_pool.get_session()
+            assert http_pool._pool_size == 3
+            assert http_pool._timeout == http_pool.TIMEOUT
+        finally:
+            http_pool.configure(http_pool.POOL_SIZE, http_pool.TIMEOUT)
@@ -0,0 +1,42 @@
+from dplaingestion.lru_cache import LRUCache, memoize
+
+def test_lru_cache_drops_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+def test_lru_cache_stats():
+    cache = LRUCache()
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["size"] == 1
+    assert round(stats["hit_rate"], 2) == 0.67
+
+def test_memoize():
+    calls = []
+
+    @memoize(LRUCache(3))
+    def parse(s):
+        calls.append(s)
+        return None if s == "none" else s.upper()
+
+    assert [parse(s) for s in ("a", "none", "a", "none", "b", "a")] == \
+           ["A", None, "A", None, "B", "A"]
+    assert calls == ["a", "none", "b"]
+    assert parse.cache.stats()["hits"] == 3
+    assert parse.uncached("c") == "C"
+    assert "c" not in parse.cache
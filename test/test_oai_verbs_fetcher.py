@@ -0,0 +1,80 @@
+import copy
+from mock import MagicMock
+from amara.thirdparty import json
+from dplaingestion.fetchers.oai_verbs_fetcher import OAIVerbsFetcher
+
+# Set -> the items of each page, in order
+PAGES = {
+    "a": [["a1", "a2"], ["a3", "a4"], ["a5"]],
+    "b": [["b1", "b2"], ["b3"]]
+}
+
+
+def _list_records(url, params):
+    set_pages = PAGES[params["oaiset"]]
+    page = int(params.get("resumption_token", "0"))
+    token = str(page + 1) if page + 1 < len(set_pages) else ""
+    items = [{"id": i, "header": {"setSpec": params["oaiset"]}}
+             for i in set_pages[page]]
+    return None, {"items": items, "resumption_token": token}
+
+def _fetcher():
+    with open("profiles/clemson.pjs", "r") as f:
+        profile = json.load(f)
+    fetcher = OAIVerbsFetcher(profile, "http://localhost:8080",
+                              "test/test_data/test.conf")
+    fetcher.batch_size = 2
+    fetcher.list_sets = MagicMock(return_value=(None, [
+        {"setSpec": "a", "setName": "A"}, {"setSpec": "b", "setName": "B"}
+    ]))
+    fetcher.list_records = MagicMock(side_effect=_list_records)
+    return fetcher
+
+def _ids(responses):
+    return [r["id"] for response in responses
+            for r in response["records"]]
+
+def test_oai_fetch_resumes_from_checkpoint():
+    """A fetch resumed from the checkpoint of an interrupted fetch gets the
+       rest of the records, without requesting the pages it had fetched
+    """
+    all_ids = sorted(_ids(_fetcher().fetch_all_data()))
+    assert len(all_ids) == 10
+
+    # Interrupt a fetch after its third response
+    fetcher = _fetcher()
+    responses = []
+    for response in fetcher.fetch_all_data():
+        responses.append(copy.deepcopy(response))
+        if len(responses) == 3:
+            checkpoint = json.loads(json.dumps(fetcher.checkpoint))
+            break
+    requested = fetcher.list_records.call_count
+
+    fetcher = _fetcher()
+    fetcher.resume_from(checkpoint)
+    resumed = list(fetcher.fetch_all_data())
+
+    assert sorted(_ids(responses) + _ids(resumed)) == all_ids
+    assert requested + fetcher.list_records.call_count == 5
+    assert all(v["complete"] for v in fetcher.checkpoint["sets"].values())
+
+def test_oai_incremental_harvest():
+    """An incremental harvest requests the records changed since
+       harvest_from, and lists the records deleted in its responses
+    """
+    def _list_changed_records(url, params):
+        error, content = _list_records(url, params)
+        content["deleted"] = ["%s-deleted" % params["oaiset"]]
+        return error, content
+
+    fetcher = _fetcher()
+    fetcher.list_records.side_effect = _list_changed_records
+    fetcher.harvest_from = "2014-01-31"
+    responses = [copy.deepcopy(r) for r in fetcher.fetch_all_data()]
+
+    assert all(call[0][1]["frm"] == "2014-01-31"
+               for call in fetcher.list_records.call_args_list)
+    deleted = [i for r in responses for i in r.get("deleted", [])]
+    assert sorted(set(deleted)) == ["a-deleted", "b-deleted"]
+    assert len(_ids(responses)) == 10
@@ -0,0 +1,200 @@
+from amara.thirdparty import json
+from mock import patch
+from dict_differ import assert_same_jsons
+from server_support import server, H
+from dplaingestion.pipeline import plan_hash, record_service, \
+     record_batch_service, resolve, _run, _Record
+
+PIPELINE = [
+    "/set_context",
+    "/shred?prop=sourceResource%2Fsubject",
+    "/cleanup_value",
+    "/capitalize_value",
+    "/enrich-subject",
+    "/set_prop?prop=sourceResource%2FstateLocatedIn&value=Massachusetts",
+    "/copy_prop?prop=provider%2Fname&to_prop=dataProvider&skip_if_exists=True",
+    "/unset_prop?prop=sourceResource%2Fformat"
+]
+
+RECORD = {
+    "_id": "test--123",
+    "id": "123",
+    "@id": "http://dp.la/api/items/123",
+    "ingestType": "item",
+    "provider": {"name": "Test Provider"},
+    "sourceResource": {
+        "title": "  a title. ",
+        "subject": "boston;  boats  ;boston",
+        "format": "Photograph",
+        "stateLocatedIn": "nowhere"
+    }
+}
+
+
+def _enrich_step_by_step(record):
+    """Runs record through PIPELINE with one HTTP request per service"""
+    body = json.dumps(record)
+    for uri in PIPELINE:
+        resp, content = H.request(server() + uri.lstrip("/"), "POST",
+                                  body=body)
+        assert str(resp.status).startswith("2")
+        body = content
+    return json.loads(body)
+
+
+def test_enrich_in_process_matches_http_pipeline():
+    """Records enriched in process are the same as with HTTP requests"""
+    headers = dict(H.HEADERS)
+    headers.update({"Source": "test",
+                    "Pipeline-Item": ",".join(PIPELINE),
+                    "Pipeline-Coll": ""})
+    resp, content = H.request(server() + "enrich", "POST",
+                              body=json.dumps([dict(RECORD)]),
+                              headers=headers)
+    assert str(resp.status).startswith("2")
+    data = json.loads(content)
+    assert data["errors"] == []
+    enriched = data["enriched_records"]["test--123"]
+
+    expected = dict(RECORD)
+    expected["originalRecord"] = dict(RECORD)
+    expected["ingestDate"] = enriched["ingestDate"]
+    expected = _enrich_step_by_step(expected)
+
+    assert_same_jsons(expected, enriched)
+
+
+def test_enrich_reports_failed_step():
+    """A failing step is reported and skipped, as with HTTP requests"""
+    headers = dict(H.HEADERS)
+    headers.update({"Source": "test",
+                    "Pipeline-Item": "/set_context,/shred,/set_context",
+                    "Pipeline-Coll": ""})
+    resp, content = H.request(server() + "enrich", "POST",
+                              body=json.dumps([dict(RECORD)]),
+                              headers=headers)
+    assert str(resp.status).startswith("2")
+    data = json.loads(content)
+    assert data["errors"] == ["Error in enrichment pipeline at /shred"]
+    enriched = data["enriched_records"]["test--123"]
+    assert enriched["sourceResource"]["subject"] == RECORD["sourceResource"]["subject"]
+    assert enriched["@context"] == "http://dp.la/api/items/context"
+
+
+def test_record_services_accept_a_batch():
+    """Services with a record function enrich each record of a JSON array"""
+    other = dict(RECORD, _id="test--456", id="456")
+    for uri in PIPELINE:
+        if uri.strip("/") in ("capitalize_value", "enrich-subject"):
+            # Not batch-aware
+            continue
+        url = server() + uri.lstrip("/")
+        resp, content = H.request(url, "POST",
+                                  body=json.dumps([RECORD, other]))
+        assert str(resp.status).startswith("2")
+        batch = json.loads(content)
+
+        expected = []
+        for record in (RECORD, other):
+            resp, content = H.request(url, "POST", body=json.dumps(record))
+            assert str(resp.status).startswith("2")
+            expected.append(json.loads(content))
+
+        assert len(batch) == 2
+        for e, b in zip(expected, batch):
+            assert_same_jsons(e, b)
+
+
+def test_enrich_batch_keeps_records_apart():
+    """Enriching several records at once gives each its own result"""
+    headers = dict(H.HEADERS)
+    headers.update({"Source": "test",
+                    "Pipeline-Item": ",".join(PIPELINE),
+                    "Pipeline-Coll": "/set_context"})
+    other = dict(RECORD, _id="test--456", id="456",
+                 provider={"name": "Other Provider"})
+    coll = {"_id": "test--coll", "id": "coll", "ingestType": "collection"}
+    resp, content = H.request(server() + "enrich", "POST",
+                              body=json.dumps([RECORD, coll, other]),
+                              headers=headers)
+    assert str(resp.status).startswith("2")
+    data = json.loads(content)
+    assert data["errors"] == []
+    assert data["enriched_item_count"] == 2
+    assert data["enriched_coll_count"] == 1
+
+    enriched = data["enriched_records"]
+    assert enriched["test--123"]["dataProvider"] == "Test Provider"
+    assert enriched["test--456"]["dataProvider"] == "Other Provider"
+    assert enriched["test--coll"]["@context"] == \
+        "http://dp.la/api/collections/context"
+
+
+def test_enrich_reports_pipeline_plans():
+    """The enrich response tells which compiled pipelines were used"""
+    headers = dict(H.HEADERS)
+    headers.update({"Source": "test",
+                    "Pipeline-Item": ",".join(PIPELINE),
+                    "Pipeline-Coll": "/set_context"})
+    for i in range(2):
+        resp, content = H.request(server() + "enrich", "POST",
+                                  body=json.dumps([RECORD]),
+                                  headers=headers)
+        assert str(resp.status).startswith("2")
+        pipelines = json.loads(content)["pipelines"]
+        assert pipelines["item"] == {"steps": len(PIPELINE),
+                                     "hash": plan_hash(",".join(PIPELINE))}
+        assert pipelines["coll"] == {"steps": 1,
+                                     "hash": plan_hash("/set_context")}
+
+
+def test_record_batch_service_called_once_per_batch():
+    """A service with a batch function is handed all the records at once,
+       and a single record is handed to its record function
+    """
+    calls = []
+
+    @record_service("test_batch")
+    def enrich_one(record):
+        calls.append(1)
+        return dict(record, enriched=True)
+
+    @record_batch_service("test_batch")
+    def enrich_many(records):
+        calls.append(len(records))
+        return [dict(record, enriched=True) for record in records]
+
+    steps = resolve(["/test_batch"])
+    batch = [_Record(json.dumps({"_id": str(i)})) for i in range(1, 4)]
+    single = [_Record(json.dumps({"_id": "4"}))]
+    _run(batch, steps, None, True)
+    _run(single, steps, None, True)
+    assert calls == [3, 1]
+    assert [record.as_data() for record in batch + single] == \
+           [{"_id": str(i), "enriched": True} for i in range(1, 5)]
+
+
+def test_failed_batch_call_retried_record_by_record():
+    """When a service fails a batch of records, only the records that it
+       fails on their own are in error
+    """
+    @record_service("test_http_batch")
+    def enrich_one(record):
+        return record
+
+    def call(step, body, context):
+        data = json.loads(body)
+        if isinstance(data, list) or data.get("bad"):
+            return 500, None
+        return 200, json.dumps(dict(data, enriched=True))
+
+    steps = resolve(["/test_http_batch"])
+    records = [_Record(json.dumps({"_id": "1"})),
+               _Record(json.dumps({"_id": "2", "bad": True}))]
+    with patch("dplaingestion.pipeline._call", side_effect=call) as _call:
+        _run(records, steps, None, False)
+    assert _call.call_count == 3
+    assert records[0].error is None
+    assert records[0].as_data() == {"_id": "1", "enriched": True}
+    assert records[1].error == "Error in enrichment pipeline at " + \
+                               "/test_http_batch"
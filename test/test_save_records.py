@@ -0,0 +1,26 @@
+import os
+import imp
+import shutil
+import tempfile
+from mock import MagicMock
+from amara.thirdparty import json
+
+save_records = imp.load_source("save_records", "scripts/save_records.py")
+
+
+def test_save_stops_when_preparing_fails():
+    """An error preparing a batch stops the save, rather than leaving it
+       waiting for batches that will never come
+    """
+    enrich_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(enrich_dir, "1.json"), "w") as f:
+            json.dump({"test--1": {"_id": "test--1", "ingestType": "item"}},
+                      f)
+        couch = MagicMock()
+        couch.prepare_dpla_batch.side_effect = KeyError("id")
+        pipeline = save_records.SavePipeline(couch, {}, enrich_dir, 500, 2)
+        assert pipeline.run() == "Error preparing documents: 'id'"
+        assert not couch.post_dpla_batch.called
+    finally:
+        shutil.rmtree(enrich_dir)